@@ -1,4 +1,23 @@
 from .base_log import Logger
 from .load_bulk_data.fetch_ids.run_fetch_ids import RunFetchIDs
-from .load_bulk_data.config.config import Config
-from .load_bulk_data.load_movie_details.run_movie_details import RunMovieDetails
\ No newline at end of file
+from .load_bulk_data.fetch_ids.fetch_ids import FetchIDsError
+from .load_bulk_data.config.config import Config, get_config
+from .load_bulk_data.load_movie_details.run_movie_details import RunMovieDetails
+from .load_bulk_data.utils.progress_store import ProgressStore
+from .load_bulk_data.utils.dead_letters import DeadLetterStore
+from .load_bulk_data.utils.id_set import IDSet
+from .load_bulk_data.utils.rate_limiter import configure_rate_limiter
+from .load_bulk_data.load_mongo.mongo_loader import MongoLoader
+from .load_bulk_data.load_mongo.people import PeopleNormalizer
+from .load_bulk_data.load_mongo.indexes import IndexManager
+from .load_bulk_data.load_mongo.read_models import ReadModels
+from .load_bulk_data.load_mongo.projection import project_movie
+from .load_bulk_data.landing.landing_zone import LandingZone
+from .load_bulk_data.landing.run_replay import RunReplay
+from .load_bulk_data.export.run_parquet_export import RunParquetExport
+from .load_bulk_data.delta_sync.run_delta_sync import RunDeltaSync
+from .load_bulk_data.delta_sync.fetch_changes import FetchChangesError
+from .load_bulk_data.retry_sweep.run_retry_sweep import RunRetrySweep
+from .load_bulk_data.utils.metrics import get_metrics
+from .load_bulk_data.utils.profiler import get_profiler, configure_profiler
+from .load_bulk_data.load_assets.run_assets import RunAssets
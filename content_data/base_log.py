@@ -1,41 +1,208 @@
 import os
+import time
+import queue
+import atexit
 import logging
-from logging.handlers import RotatingFileHandler
+import threading
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 from pathlib import Path
+from typing import Callable, List, Optional
+from dotenv import load_dotenv
+
+log_dir = os.path.dirname(os.path.abspath(__file__))
+
+_env_loaded = False
+_env_lock = threading.Lock()
+
+
+def load_env() -> None:
+    """
+    Load the `.env` file into the environment, once per process.
+    It is called when the configuration or the logs are first used rather than at import.
+    """
+    global _env_loaded
+    with _env_lock:
+        if not _env_loaded:
+            load_dotenv()
+            _env_loaded = True
+
+
+def get_log_settings() -> dict:
+    """
+    Read the settings of the logs from the environment:
+        - `max_bytes`: the files are rotated every `TMDB_LOG_MAX_MB` (defaults to 50), a bulk run writes far more than a few MB of logs,
+        - `backup_count`: `TMDB_LOG_BACKUPS` (defaults to 10) old files are kept,
+        - `async`: the records are written by a background thread unless `TMDB_LOG_ASYNC=false`,
+        - `progress_interval`: seconds between two progress lines, `TMDB_LOG_PROGRESS_SECONDS` (defaults to 10).
+    """
+    load_env()
+    return {
+        "max_bytes": int(os.getenv("TMDB_LOG_MAX_MB", 50)) * 1024 ** 2,
+        "backup_count": int(os.getenv("TMDB_LOG_BACKUPS", 10)),
+        "async": os.getenv("TMDB_LOG_ASYNC", "true").lower() != "false",
+        "progress_interval": float(os.getenv("TMDB_LOG_PROGRESS_SECONDS", 10)),
+    }
+
+
+class _RoutingHandler(logging.Handler):
+    """
+    Hands every record taken off the queue to the handlers of the logger it was logged by.
+    """
+    def __init__(self) -> None:
+        super().__init__()
+        self.routes = {}
+
+    def emit(self, record: logging.LogRecord) -> None:
+        for handler in self.routes.get(record.name, ()):
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+
+_log_queue = queue.SimpleQueue()
+_router = _RoutingHandler()
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def _start_listener() -> None:
+    global _listener
+    with _listener_lock:
+        if _listener is None:
+            _listener = QueueListener(_log_queue, _router)
+            _listener.start()
+            atexit.register(stop_logging)
+
+
+def stop_logging() -> None:
+    """
+    Write out the queued records and stop the background writer, it is also called at exit.
+    """
+    global _listener
+    with _listener_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+class _LazyHandler(logging.Handler):
+    """
+    Sets up the handlers of a logger on its first record and hands every record over to them.
+    The modules create their loggers at import, hence the log files and the writer thread only exist once something is logged.
+    """
+    def __init__(self, setup: Callable[[], List[logging.Handler]]) -> None:
+        super().__init__()
+        self.setup = setup
+        self.handlers: Optional[List[logging.Handler]] = None
+
+    def handle(self, record: logging.LogRecord) -> bool:
+        if self.handlers is None:
+            with self.lock:
+                if self.handlers is None:
+                    self.handlers = self.setup()
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+        return True
 
-log_dir = os.path.dirname(os.path.abspath(__file__)) 
 
 class Logger:
-    def __init__(self, pipeline_name: str, log_dir: str = log_dir+"/tmdb_logs"):
-        Path(log_dir).mkdir(parents=True, exist_ok=True)
+    """
+    Logs of a pipeline, written to `tmdb_logs/<pipeline_name>.csv` and to the console.
 
-        log_file = Path(log_dir) / f"{pipeline_name}.csv"
+    By default the records are put on a queue and written by a single background thread,
+    so logging never blocks the event loop on file or console I/O.
+    Set `TMDB_LOG_ASYNC=false` to write them synchronously.
+    The files are rotated every `TMDB_LOG_MAX_MB` (defaults to 50) keeping `TMDB_LOG_BACKUPS` (defaults to 10) old files.
+    The file is only created when the first record is logged.
+    """
+    def __init__(self, pipeline_name: str, log_dir: str = log_dir+"/tmdb_logs"):
+        self.pipeline_name = pipeline_name
+        self.log_dir = log_dir
 
         self.logger = logging.getLogger(pipeline_name)
         self.logger.setLevel(logging.DEBUG)
-        
 
         if not self.logger.handlers:
-            if not os.path.exists(log_file):
-                with open(log_file, "w", encoding="utf-8") as f:
-                    f.write("timestamp,module,level,message\n")
-            
-            file_handler = RotatingFileHandler(
-                log_file, maxBytes=1_000_000, backupCount=5, encoding="utf-8"
-            )
+            self.logger.addHandler(_LazyHandler(self._get_handlers))
 
-            console_handler = logging.StreamHandler()
+    def _get_handlers(self) -> List[logging.Handler]:
+        settings = get_log_settings()
+        Path(self.log_dir).mkdir(parents=True, exist_ok=True)
+        log_file = Path(self.log_dir) / f"{self.pipeline_name}.csv"
 
-            formatter = logging.Formatter(
-                "%(asctime)s,%(name)s,%(levelname)s,%(message)s",
-                datefmt="%Y-%m-%d %H:%M:%S"
-            )
+        if not os.path.exists(log_file):
+            with open(log_file, "w", encoding="utf-8") as f:
+                f.write("timestamp,module,level,message\n")
 
-            file_handler.setFormatter(formatter)
-            console_handler.setFormatter(formatter)
+        file_handler = RotatingFileHandler(
+            log_file, maxBytes=settings["max_bytes"], backupCount=settings["backup_count"], encoding="utf-8"
+        )
 
-            self.logger.addHandler(file_handler)
-            self.logger.addHandler(console_handler)
+        console_handler = logging.StreamHandler()
+
+        formatter = logging.Formatter(
+            "%(asctime)s,%(name)s,%(levelname)s,%(message)s",
+            datefmt="%Y-%m-%d %H:%M:%S"
+        )
+
+        file_handler.setFormatter(formatter)
+        console_handler.setFormatter(formatter)
+
+        if not settings["async"]:
+            return [file_handler, console_handler]
+        _router.routes[self.pipeline_name] = [file_handler, console_handler]
+        _start_listener()
+        return [QueueHandler(_log_queue)]
 
     def get_logger(self):
         return self.logger
+
+
+class ProgressLogger:
+    """
+    Aggregates the successes of a hot path (e.g. one per request) into a progress line
+    logged at most every `interval` seconds, instead of a line per success.
+
+    #### Example Usage:
+
+        >>> progress = ProgressLogger(logger, "✅ Fetched the details of {count} movies")
+        >>> progress.update()  # on every success
+        >>> progress.flush()   # at the end of the run, logs the successes since the last line
+    """
+    def __init__(self, logger: logging.Logger, message: str, interval: float = None) -> None:
+        self.logger = logger
+        self.message = message
+        self._interval = interval
+        self.count = 0
+        self._logged_count = 0
+        self._logged_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def interval(self) -> float:
+        # the progress loggers are created at import, hence the default is read on the first update
+        if self._interval is None:
+            self._interval = get_log_settings()["progress_interval"]
+        return self._interval
+
+    def _get_line(self, now: float) -> str:
+        rate = (self.count - self._logged_count) / max(now - self._logged_at, 1e-9)
+        self._logged_count = self.count
+        self._logged_at = now
+        return f"{self.message.format(count=self.count)} ({rate:.1f}/s)"
+
+    def update(self, count: int = 1) -> None:
+        with self._lock:
+            self.count += count
+            now = time.monotonic()
+            if now - self._logged_at < self.interval:
+                return
+            line = self._get_line(now)
+        self.logger.info(line)
+
+    def flush(self) -> None:
+        with self._lock:
+            if self.count == self._logged_count:
+                return
+            line = self._get_line(time.monotonic())
+        self.logger.info(line)
@@ -0,0 +1,247 @@
+"""
+This file contains a local fake of the TMDB API, used to benchmark the pipelines without using up the API quota.
+
+The server answers the paths of `endpoint_config` (`/discover`, `/movie/{id}` with its sub-resources and
+`append_to_response`, `/movie/changes`) with generated, deterministic payloads. The latency, the error rate,
+the `429` rate and the number of movies released per day are configurable.
+It also serves generated image files under `/t/p/<size><file_path>`, the layout of the image CDN of TMDB.
+"""
+
+# external imports
+import json
+import time
+import hashlib
+import random
+import threading
+from datetime import date
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Any, Dict, Optional, Tuple, Union
+
+# local imports
+from ..config.endpoint_config import endpoint_config
+
+RESULTS_PER_PAGE = 20
+CHANGES_PER_PAGE = 100
+MAX_PAGES = 500
+
+endpoints = endpoint_config["endpoints"]
+DISCOVER_PATH = endpoints["discover"]["movies"]["path"]
+DETAILS_PATH = endpoints["details"]["movies"]["path"]
+CHANGES_PATH = endpoints["changes"]["movies"]["path"]
+IMAGES_PATH = "/t/p"
+
+
+class FakeTMDBServer:
+    """
+    This class runs the fake TMDB API on a background thread.
+    It sets configurations as follows:
+
+        - `self.port`: Port to listen on, `0` picks a free port. Defaults to `8765`.
+        - `self.latency`: Seconds every response is delayed by. Defaults to `0.02`.
+        - `self.error_rate`: Share of the requests answered with a `500`. Defaults to `0`.
+        - `self.rate_limited_rate`: Share of the requests answered with a `429`. Defaults to `0`.
+        - `self.movies_per_day`: Number of movies released on every day of the year, sets the page counts. Defaults to `20`.
+        - `self.cast_size`: Number of cast members of every movie, sets the payload size. Defaults to `20`.
+        - `self.image_kb`: Size of every image file served. Defaults to `64`.
+        - `self.stats`: Number of requests served per status code.
+
+    #### Example Usage:
+
+        >>> server = FakeTMDBServer(port=8765, latency=0.05, rate_limited_rate=0.01).start()
+        >>> ...  # point TMDB_BASE_URL to server.base_url before importing the pipelines
+        >>> server.stop()
+    """
+    def __init__(self, port: int = 8765, latency: float = 0.02, error_rate: float = 0, rate_limited_rate: float = 0, movies_per_day: int = 20, cast_size: int = 20, image_kb: int = 64, seed: int = 0) -> None:
+        self.port = port
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limited_rate = rate_limited_rate
+        self.movies_per_day = movies_per_day
+        self.cast_size = cast_size
+        self.image_kb = image_kb
+        self.stats: Dict[int, int] = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    @property
+    def image_base_url(self) -> str:
+        return f"{self.base_url}{IMAGES_PATH}"
+
+    def start(self) -> "FakeTMDBServer":
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+            def do_GET(self) -> None:
+                status, body, headers = server.handle(self.path)
+                payload = body if isinstance(body, bytes) else json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                if "Content-Type" not in headers:
+                    self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", self.port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def _count(self, status: int) -> None:
+        with self._lock:
+            self.stats[status] = self.stats.get(status, 0) + 1
+
+    def handle(self, raw_path: str) -> Tuple[int, Union[Dict[str, Any], bytes], Dict[str, str]]:
+        """
+        Answer a request path, returning the status code, the JSON body (the raw bytes for an image) and the extra headers.
+        """
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            roll = self._random.random()
+        if roll < self.rate_limited_rate:
+            self._count(429)
+            return 429, {"status_code": 25, "status_message": "Your request count is over the allowed limit."}, {"Retry-After": "1"}
+        if roll < self.rate_limited_rate + self.error_rate:
+            self._count(500)
+            return 500, {"status_code": 11, "status_message": "Internal error."}, {}
+
+        url = urlparse(raw_path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        if url.path.startswith(f"{IMAGES_PATH}/"):
+            self._count(200)
+            return 200, self._get_image(url.path[len(IMAGES_PATH) + 1:]), {"Content-Type": "image/jpeg"}
+        if url.path == DISCOVER_PATH:
+            body = self._discover(params)
+        elif url.path == CHANGES_PATH:
+            body = self._changes(params)
+        elif url.path.startswith(f"{DETAILS_PATH}/"):
+            body = self._details(url.path[len(DETAILS_PATH) + 1:], params)
+        else:
+            body = None
+
+        if body is None:
+            self._count(404)
+            return 404, {"status_code": 34, "status_message": "The resource you requested could not be found."}, {}
+        self._count(200)
+        return 200, body, {}
+
+    def _discover(self, params: Dict[str, str]) -> Dict[str, Any]:
+        start = date.fromisoformat(params["primary_release_date.gte"])
+        end = date.fromisoformat(params["primary_release_date.lte"])
+        page = int(params.get("page", 1))
+        total_results = max((end - start).days + 1, 0) * self.movies_per_day
+        total_pages = -(-total_results // RESULTS_PER_PAGE)
+
+        # the ids are numbered by release day, hence every date range serves distinct ids
+        results = []
+        if page <= MAX_PAGES:
+            for index in range((page - 1) * RESULTS_PER_PAGE, min(page * RESULTS_PER_PAGE, total_results)):
+                day, number = divmod(index, self.movies_per_day)
+                release_date = date.fromordinal(start.toordinal() + day)
+                results.append({"id": self._get_movie_id(release_date, number), "release_date": release_date.isoformat()})
+        return {"page": page, "results": results, "total_results": total_results, "total_pages": total_pages}
+
+    def _changes(self, params: Dict[str, str]) -> Dict[str, Any]:
+        start = date.fromisoformat(params["start_date"])
+        end = date.fromisoformat(params["end_date"])
+        page = int(params.get("page", 1))
+        ids = [self._get_movie_id(date.fromordinal(day), number) for day in range(start.toordinal(), end.toordinal() + 1) for number in range(0, self.movies_per_day, 10)]
+        results = [{"id": movie_id, "adult": False} for movie_id in ids[(page - 1) * CHANGES_PER_PAGE:page * CHANGES_PER_PAGE]]
+        return {"page": page, "results": results, "total_pages": max(-(-len(ids) // CHANGES_PER_PAGE), 1), "total_results": len(ids)}
+
+    def _details(self, path: str, params: Dict[str, str]) -> Optional[Dict[str, Any]]:
+        movie_id, _, sub_resource = path.partition("/")
+        if not movie_id.isdigit():
+            return None
+        movie_id = int(movie_id)
+        if sub_resource:
+            return {"id": movie_id, **self._get_sub_resource(movie_id, sub_resource)} if sub_resource in ("credits", "images", "videos") else None
+
+        release_date = date.fromordinal(movie_id // 10_000).isoformat()
+        body = {
+            "id": movie_id,
+            "title": f"Movie {movie_id}",
+            "adult": False,
+            "backdrop_path": f"/{movie_id}_backdrop.jpg",
+            "poster_path": f"/{movie_id}_poster.jpg",
+            "release_date": release_date,
+            "overview": "A generated movie of the fake TMDB API. " * 5,
+            "tagline": "Generated for benchmarks.",
+            "runtime": 90 + movie_id % 60,
+            "genres": [{"id": 18, "name": "Drama"}, {"id": 35, "name": "Comedy"}],
+            "production_companies": [{"id": 1, "name": "Fake Studio", "origin_country": "US"}],
+            "production_countries": [{"iso_3166_1": "US", "name": "United States of America"}],
+            "popularity": movie_id % 1000 / 10,
+            "vote_average": movie_id % 100 / 10,
+            "vote_count": movie_id % 5000,
+            "status": "Released",
+            "original_language": "en",
+            "budget": 0,
+            "revenue": 0,
+            "homepage": f"https://example.com/movies/{movie_id}",
+            "imdb_id": f"tt{movie_id % 10_000_000:07d}",
+            "origin_country": ["US"],
+            "original_title": f"Movie {movie_id}",
+            "belongs_to_collection": None,
+            "spoken_languages": [{"english_name": "English", "iso_639_1": "en", "name": "English"}],
+            "video": False,
+        }
+        for sub_resource in params.get("append_to_response", "").split(","):
+            if sub_resource in ("credits", "images", "videos"):
+                body[sub_resource] = self._get_sub_resource(movie_id, sub_resource)
+        return body
+
+    def _get_sub_resource(self, movie_id: int, sub_resource: str) -> Dict[str, Any]:
+        if sub_resource == "credits":
+            return {
+                "cast": [
+                    {"adult": False, "gender": i % 3, "id": movie_id * 100 + i, "known_for_department": "Acting", "name": f"Actor {i}", "original_name": f"Actor {i}",
+                     "popularity": i / 10, "profile_path": f"/{i}.jpg", "cast_id": i, "character": f"Character {i}", "credit_id": f"credit_{movie_id}_{i}", "order": i}
+                    for i in range(self.cast_size)
+                ],
+                "crew": [
+                    {"adult": False, "gender": 2, "id": movie_id * 100 + 99, "known_for_department": "Directing", "name": "Director", "original_name": "Director",
+                     "popularity": 1.0, "profile_path": None, "credit_id": f"credit_{movie_id}_99", "department": "Directing", "job": "Director"}
+                ],
+            }
+        if sub_resource == "images":
+            return {
+                # as on TMDB, the first poster and backdrop are the ones of the details
+                "backdrops": [{"file_path": f"/{movie_id}_backdrop{f'_{i}' if i else ''}.jpg", "width": 1920, "height": 1080, "iso_639_1": None} for i in range(3)],
+                "posters": [{"file_path": f"/{movie_id}_poster{f'_{i}' if i else ''}.jpg", "width": 1000, "height": 1500, "iso_639_1": "en"} for i in range(3)],
+                "logos": [],
+            }
+        return {"results": [
+            {"id": f"{movie_id}_{i}", "key": f"key_{movie_id}_{i}", "site": "YouTube", "type": "Trailer" if i == 0 else "Teaser", "official": True,
+             "iso_639_1": "en", "size": 1080, "published_at": "2024-01-01T00:00:00.000Z"}
+            for i in range(2)
+        ]}
+
+    def _get_image(self, path: str) -> bytes:
+        # deterministic bytes per size and file path, hence every image has its own content
+        seed = hashlib.sha256(path.encode("utf-8")).digest()
+        return (seed * (self.image_kb * 1024 // len(seed) + 1))[:self.image_kb * 1024]
+
+    @staticmethod
+    def _get_movie_id(release_date: date, number: int) -> int:
+        return release_date.toordinal() * 10_000 + number
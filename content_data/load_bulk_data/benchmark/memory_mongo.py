@@ -0,0 +1,261 @@
+"""
+This file contains an in-memory stand-in of the MongoDB database, used to benchmark the pipelines without a MongoDB server.
+
+It only implements the calls the loaders and the asset stage make (`create_index`, `bulk_write` of `ReplaceOne`,
+and of the `UpdateOne`/`UpdateMany` of the people normalization and the read models, `delete_many`, `count_documents`, `drop`,
+and `find`/`find_one` with equality, `$in` and `$nin` filters, whose cursor can be sorted and limited).
+Every document is BSON encoded as the driver would do, hence the serialization cost and the memory are comparable.
+"""
+
+# external imports
+import bson
+import time
+import itertools
+import threading
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Union
+from pymongo import ReplaceOne, UpdateMany, UpdateOne
+from pymongo.results import BulkWriteResult, DeleteResult
+
+
+class MemoryCursor:
+    """
+    The documents found, decoded lazily unless they are sorted.
+    """
+    def __init__(self, documents: Iterable[Dict[str, Any]]) -> None:
+        self._documents = documents
+
+    def sort(self, key: str, direction: int = 1) -> "MemoryCursor":
+        self._documents = sorted(self._documents, key=lambda document: document.get(key) or 0, reverse=direction < 0)
+        return self
+
+    def limit(self, limit: int) -> "MemoryCursor":
+        if limit:
+            self._documents = itertools.islice(self._documents, limit)
+        return self
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return iter(self._documents)
+
+
+class MemoryCollection:
+    def __init__(self, name: str, write_latency: float = 0) -> None:
+        self.name = name
+        self.write_latency = write_latency
+        self._documents: Dict[Any, bytes] = {}
+        self._key = "_id"
+        self._index_names = {"_id_"}
+        # indexed field -> value -> keys of the documents holding it, used to find the targets of an `UpdateMany`
+        self._indexes: Dict[str, Dict[Any, Set[Any]]] = {}
+        self._lock = threading.Lock()
+
+    def create_index(self, keys: List[tuple], unique: bool = False, name: str = None, **kwargs) -> str:
+        # the documents are kept by their unique key, the other single field indexes only serve the updates
+        if unique and len(keys) == 1:
+            self._key = keys[0][0]
+        elif len(keys) == 1:
+            self._indexes.setdefault(keys[0][0], {})
+        name = name or "_".join(f"{key}_{direction}" for key, direction in keys)
+        self._index_names.add(name)
+        return name
+
+    def index_information(self) -> Dict[str, Any]:
+        return {name: {} for name in self._index_names}
+
+    @staticmethod
+    def _get_field(document: Dict[str, Any], path: str) -> List[Any]:
+        """
+        Get the values of a dotted path, the arrays on the way are flattened as MongoDB does.
+        """
+        values = [document]
+        for field in path.split("."):
+            values = [value.get(field) for value in values if isinstance(value, dict)]
+            values = [item for value in values for item in (value if isinstance(value, list) else [value])]
+        return [value for value in values if value is not None]
+
+    def _update_indexes(self, key: Any, previous: Dict[str, List[Any]], document: Dict[str, Any]) -> None:
+        for field, index in self._indexes.items():
+            for value in previous.get(field, []):
+                index.get(value, set()).discard(key)
+            for value in self._get_field(document, field):
+                index.setdefault(value, set()).add(key)
+
+    def _get_candidates(self, filter: Dict[str, Any]) -> List[Any]:
+        for field, condition in filter.items():
+            if field not in self._indexes:
+                continue
+            if isinstance(condition, list):
+                # the empty arrays are not indexed
+                continue
+            if not isinstance(condition, dict):
+                return list(self._indexes[field].get(condition, ()))
+            if "$in" in condition:
+                return list({key for value in condition["$in"] for key in self._indexes[field].get(value, ())})
+        return list(self._documents)
+
+    def _update(self, key: Any, document: Dict[str, Any], update: Dict[str, Any]) -> None:
+        previous = {field: self._get_field(document, field) for field in self._indexes}
+        document = self._apply_update(document, update)
+        self._update_indexes(key, previous, document)
+        self._documents[key] = bson.encode(document)
+
+    def bulk_write(self, requests: List[Union[ReplaceOne, UpdateOne, UpdateMany]], ordered: bool = True, **kwargs) -> BulkWriteResult:
+        if self.write_latency:
+            time.sleep(self.write_latency)
+        replaced = [request for request in requests if isinstance(request, ReplaceOne)]
+        encoded = [(request._filter.get(self._key), bson.encode(request._doc)) for request in replaced]
+        upserted = matched = 0
+        with self._lock:
+            for key, document in encoded:
+                if key in self._documents:
+                    matched += 1
+                else:
+                    upserted += 1
+                self._documents[key] = document
+            for request in requests:
+                if isinstance(request, UpdateOne):
+                    key = request._filter.get(self._key)
+                    if key in self._documents:
+                        matched += 1
+                        self._update(key, bson.decode(self._documents[key]), request._doc)
+                    else:
+                        upserted += 1
+                        self._update(key, {self._key: key}, request._doc)
+                elif isinstance(request, UpdateMany):
+                    for key in self._get_candidates(request._filter):
+                        document = bson.decode(self._documents[key])
+                        if self._matches(document, request._filter):
+                            matched += 1
+                            self._update(key, document, request._doc)
+        return BulkWriteResult({"nInserted": 0, "nUpserted": upserted, "nMatched": matched, "nModified": matched, "nRemoved": 0, "upserted": []}, acknowledged=True)
+
+    @classmethod
+    def _apply_update(cls, document: Dict[str, Any], update: Dict[str, Any]) -> Dict[str, Any]:
+        for path, value in update.get("$set", {}).items():
+            *parents, field = path.split(".")
+            target = document
+            for parent in parents:
+                target = target.setdefault(parent, {})
+            target[field] = value
+        for path in update.get("$unset", {}):
+            *parents, field = path.split(".")
+            target = document
+            for parent in parents:
+                target = target.get(parent, {})
+            target.pop(field, None)
+        for field, value in update.get("$addToSet", {}).items():
+            values = document.setdefault(field, [])
+            values.extend(item for item in value.get("$each", [value]) if item not in values)
+        for field, condition in update.get("$pull", {}).items():
+            # a condition document matches the fields of the items, a value matches the items themselves
+            matches = (lambda item: cls._matches(item, condition)) if isinstance(condition, dict) else (lambda item: item == condition)
+            document[field] = [item for item in document.get(field, []) if not matches(item)]
+        for field, value in update.get("$push", {}).items():
+            values = document.setdefault(field, []) + list(value["$each"])
+            for sort_field, direction in reversed(list(value.get("$sort", {}).items())):
+                values.sort(key=lambda item: item.get(sort_field) or 0, reverse=direction < 0)
+            document[field] = values[:value["$slice"]] if "$slice" in value else values
+        return document
+
+    @classmethod
+    def _matches(cls, document: Dict[str, Any], filter: Dict[str, Any]) -> bool:
+        for field, condition in filter.items():
+            # a condition on an array field matches any of its items
+            values = cls._get_field(document, field) or [None]
+            if isinstance(condition, dict) and "$in" in condition:
+                if not any(item in condition["$in"] for item in values):
+                    return False
+            elif isinstance(condition, dict) and "$nin" in condition:
+                if any(item in condition["$nin"] for item in values):
+                    return False
+            elif isinstance(condition, list):
+                # an array condition matches the whole array, e.g. `[]` the empty ones
+                if document.get(field) != condition:
+                    return False
+            elif condition not in values:
+                return False
+        return True
+
+    @staticmethod
+    def _project(document: Dict[str, Any], projection: Dict[str, Any]) -> Dict[str, Any]:
+        fields = [field for field, included in projection.items() if included and field != "_id"]
+        if not fields:
+            return document
+        # as in MongoDB, the `_id` is kept unless it is excluded
+        projected = {"_id": document["_id"]} if projection.get("_id", 1) and "_id" in document else {}
+        for field in fields:
+            # `posters.file_path` keeps the `file_path` of every item of the `posters` list
+            field, _, sub_field = field.partition(".")
+            if field not in document:
+                continue
+            value = document[field]
+            if sub_field and isinstance(value, list):
+                kept = projected.get(field) or [{} for _ in value]
+                for item, projected_item in zip(value, kept):
+                    if sub_field in item:
+                        projected_item[sub_field] = item[sub_field]
+                value = kept
+            projected[field] = value
+        return projected
+
+    def _find(self, filter: Dict[str, Any], projection: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        with self._lock:
+            documents = list(self._documents.values())
+        for encoded in documents:
+            document = bson.decode(encoded)
+            if self._matches(document, filter):
+                yield self._project(document, projection)
+
+    def find(self, filter: Dict[str, Any] = None, projection: Dict[str, Any] = None, **kwargs) -> MemoryCursor:
+        return MemoryCursor(self._find(filter or {}, projection or {}))
+
+    def find_one(self, filter: Dict[str, Any] = None, projection: Dict[str, Any] = None, **kwargs) -> Optional[Dict[str, Any]]:
+        return next(iter(self.find(filter, projection)), None)
+
+    def delete_many(self, filter: Dict[str, Any], **kwargs) -> DeleteResult:
+        with self._lock:
+            deleted = 0
+            for key in self._get_candidates(filter):
+                document = bson.decode(self._documents[key])
+                if self._matches(document, filter):
+                    self._update_indexes(key, {field: self._get_field(document, field) for field in self._indexes}, {})
+                    del self._documents[key]
+                    deleted += 1
+        return DeleteResult({"n": deleted}, acknowledged=True)
+
+    def count_documents(self, filter: Dict[str, Any], **kwargs) -> int:
+        return len(self._documents)
+
+    def drop(self) -> None:
+        with self._lock:
+            self._documents.clear()
+            for index in self._indexes.values():
+                index.clear()
+
+
+class MemoryDatabase:
+    """
+    This class stands in for the `pymongo` `Database` of the loaders.
+
+    #### Example Usage:
+
+        >>> db = MemoryDatabase(write_latency=0.005)
+        >>> MongoLoader(db=db).load_movies(movies, year=2024)
+        >>> db["movies"].count_documents({})
+    """
+    def __init__(self, name: str = "tmdb_benchmark", write_latency: float = 0) -> None:
+        self.name = name
+        self.write_latency = write_latency
+        self._collections: Dict[str, MemoryCollection] = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name: str) -> MemoryCollection:
+        with self._lock:
+            if name not in self._collections:
+                self._collections[name] = MemoryCollection(name, write_latency=self.write_latency)
+            return self._collections[name]
+
+    def drop_collection(self, name: str) -> None:
+        self[name].drop()
+
+    def list_collection_names(self) -> List[str]:
+        return list(self._collections)
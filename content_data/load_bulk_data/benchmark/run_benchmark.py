@@ -0,0 +1,173 @@
+"""
+This file contains the functionality to benchmark the yearly pipeline end to end,
+fetching the ids with `RunFetchIDs`, streaming the details with `RunMovieDetails` and loading them with `MongoLoader`.
+
+It is meant to be run against the `FakeTMDBServer` and a local MongoDB (or the `MemoryDatabase` stand-in),
+so the throughput of a change or of the concurrency settings can be compared without using up the API quota.
+"""
+
+# external imports
+import sys
+import time
+import asyncio
+import resource
+import tempfile
+from typing import Any, Dict, List, Optional
+from pymongo.database import Database
+
+# local imports
+from ..fetch_ids.run_fetch_ids import RunFetchIDs
+from ..load_mongo.mongo_loader import MongoLoader, COLLECTION_KEYS
+from ..load_movie_details.run_movie_details import RunMovieDetails
+from ..load_assets.asset_store import AssetStore
+from ..load_assets.run_assets import RunAssets
+from ..utils.id_set import IDSet
+from ..utils.concurrency import ConcurrencyController
+from ...base_log import Logger
+
+logger = Logger('run_benchmark').get_logger()
+
+
+def get_peak_rss_mb() -> float:
+    """
+    Peak resident memory of the process so far, in MB.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports KB, macOS reports bytes
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+
+class RunBenchmark:
+    """
+    This class runs the yearly pipeline once and reports its throughput.
+    It sets configurations as follows:
+
+        - `self.db`: Database to load into, its content collections are dropped first.
+        - `self.year`: Year to fetch. Defaults to `2024`.
+        - `self.max_concurrency`: Number of requests in flight, for both the ids and the details. Defaults to `10`.
+        - `self.batch_size`: Number of movies fetched before they are loaded. Defaults to `500`.
+        - `self.load_batch_size`: Number of documents per bulk write. Defaults to `1000`.
+        - `self.load_workers`: Number of bulk writes in parallel. Defaults to `4`.
+        - `self.max_movies`: Only the details of the first `max_movies` ids are fetched, all of them if `None`.
+        - `self.assets`: Whether the images of the loaded movies are downloaded too, into a temporary asset store. Defaults to `False`.
+        - `self.adaptive`: Whether the stages use an AIMD `ConcurrencyController`, `max_concurrency` then being its upper bound. Defaults to `False`.
+
+    #### Notes:
+        - The report holds the ids/s of the discovery, the movies/s of the streaming (fetch and load together),
+        the documents/s of the loads alone and the peak RSS of the process.
+        - The peak RSS never goes down, run one setting per process for comparable memory numbers.
+
+    #### Example Usage:
+
+        >>> report = RunBenchmark(db=MemoryDatabase(), year=2024, max_concurrency=20).run()
+    """
+    def __init__(self, db: Database, year: int = 2024, max_concurrency: int = 10, batch_size: int = 500, load_batch_size: int = 1000, load_workers: int = 4, max_movies: int = None, adaptive: bool = False, assets: bool = False) -> None:
+        self.db = db
+        self.year = year
+        self.max_concurrency = max_concurrency
+        self.batch_size = batch_size
+        self.load_batch_size = load_batch_size
+        self.load_workers = load_workers
+        self.max_movies = max_movies
+        self.adaptive = adaptive
+        self.assets = assets
+        self.controllers: Dict[str, ConcurrencyController] = {}
+
+    def _get_controller(self, name: str) -> Optional[ConcurrencyController]:
+        if not self.adaptive:
+            return None
+        self.controllers[name] = ConcurrencyController(name=name, initial=min(10, self.max_concurrency), min_limit=min(2, self.max_concurrency), max_limit=self.max_concurrency)
+        return self.controllers[name]
+
+    async def _fetch_ids(self) -> IDSet:
+        return await RunFetchIDs(year=self.year, max_concurrency=self.max_concurrency, controller=self._get_controller("ids")).fetch_yearly_data_async()
+
+    async def _stream_movies(self, movie_ids: List[int], loader: MongoLoader) -> Dict[str, float]:
+        """
+        Fetch and load the movies the way the streaming mode of the yearly driver does,
+        a batch is loaded in a worker thread while the next one is being fetched.
+        """
+        load_seconds = 0.0
+
+        def load(batch: List[Dict[str, Any]]) -> None:
+            nonlocal load_seconds
+            start = time.perf_counter()
+            loader.load_movies(batch, self.year)
+            load_seconds += time.perf_counter() - start
+
+        queue = asyncio.Queue(maxsize=self.batch_size)
+        producer = asyncio.create_task(RunMovieDetails(movie_ids=movie_ids, max_concurrency=self.max_concurrency, controller=self._get_controller("movie_details")).stream_movies(queue))
+        batch = []
+        movies = 0
+        flush = None
+        while True:
+            movie = await queue.get()
+            if movie is not RunMovieDetails.END_OF_STREAM:
+                batch.append(movie)
+            if len(batch) >= self.batch_size or (movie is RunMovieDetails.END_OF_STREAM and batch):
+                if flush:
+                    await flush
+                flush = asyncio.create_task(asyncio.to_thread(load, batch))
+                movies += len(batch)
+                batch = []
+            if movie is RunMovieDetails.END_OF_STREAM:
+                break
+        if flush:
+            await flush
+        await producer
+        return {"movies": movies, "load_seconds": load_seconds}
+
+    async def run_async(self) -> Dict[str, Any]:
+        for collection in COLLECTION_KEYS:
+            self.db.drop_collection(collection)
+        loader = MongoLoader(db=self.db, batch_size=self.load_batch_size, max_workers=self.load_workers)
+
+        start = time.perf_counter()
+        ids = await self._fetch_ids()
+        ids_seconds = time.perf_counter() - start
+        logger.info(f"Benchmark fetched {len(ids)} ids in {ids_seconds:.2f}s")
+
+        start = time.perf_counter()
+        movie_ids = ids[:self.max_movies] if self.max_movies is not None else ids
+        streamed = await self._stream_movies(movie_ids, loader)
+        movies_seconds = time.perf_counter() - start
+        documents = sum(self.db[collection].count_documents({}) for collection in COLLECTION_KEYS)
+        logger.info(f"Benchmark loaded {streamed['movies']} movies ({documents} documents) in {movies_seconds:.2f}s")
+
+        assets = await self._download_assets() if self.assets else {}
+
+        return {
+            "year": self.year,
+            "max_concurrency": self.max_concurrency,
+            "adaptive": self.adaptive,
+            "final_concurrency": {name: int(controller.limit) for name, controller in self.controllers.items()},
+            "ids": len(ids),
+            "ids_seconds": round(ids_seconds, 3),
+            "ids_per_second": round(len(ids) / ids_seconds, 1) if ids_seconds else 0.0,
+            "movies": streamed["movies"],
+            "movies_seconds": round(movies_seconds, 3),
+            "movies_per_second": round(streamed["movies"] / movies_seconds, 1) if movies_seconds else 0.0,
+            "documents": documents,
+            "load_seconds": round(streamed["load_seconds"], 3),
+            "documents_per_second": round(documents / streamed["load_seconds"], 1) if streamed["load_seconds"] else 0.0,
+            "peak_rss_mb": round(get_peak_rss_mb(), 1),
+            **assets,
+        }
+
+    async def _download_assets(self) -> Dict[str, Any]:
+        with tempfile.TemporaryDirectory() as directory:
+            store = AssetStore(root=directory)
+            start = time.perf_counter()
+            report = await RunAssets(db=self.db, store=store, include_images=True, max_concurrency=self.max_concurrency, controller=self._get_controller("assets")).download_all_async()
+            seconds = time.perf_counter() - start
+            store.close()
+        logger.info(f"Benchmark downloaded {report['downloaded']} images in {seconds:.2f}s")
+        return {
+            "assets": report["downloaded"],
+            "assets_seconds": round(seconds, 3),
+            "assets_per_second": round(report["downloaded"] / seconds, 1) if seconds else 0.0,
+            "asset_mb_per_second": round(report["bytes"] / 1024 ** 2 / seconds, 1) if seconds else 0.0,
+        }
+
+    def run(self) -> Dict[str, Any]:
+        return asyncio.run(self.run_async())
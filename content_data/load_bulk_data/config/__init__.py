@@ -1 +1 @@
-from .config import Config
\ No newline at end of file
+from .config import Config, get_config
\ No newline at end of file
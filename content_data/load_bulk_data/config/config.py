@@ -4,15 +4,22 @@ This module contains configuration settings to fetch Data from TMDB.
 
 # imports
 import os
+import threading
 from copy import deepcopy
-from dotenv import load_dotenv
-from typing import Tuple, Dict, Any
-from pymongo import MongoClient
+from typing import Tuple, Dict, Any, Optional
 from pymongo.database import Database
-load_dotenv()
 
 # local imports
 from .endpoint_config import endpoint_config
+from ..utils.rate_limiter import RateLimiter, get_rate_limiter
+from ..utils.response_cache import ResponseCache, get_response_cache
+from ..utils.mongo_clients import get_mongo_client, get_motor_client
+from ..utils.concurrency import ConcurrencyController
+from ..load_assets.asset_store import AssetStore, DEFAULT_DIR as DEFAULT_ASSET_DIR
+from ...base_log import load_env
+
+_config = None
+_config_lock = threading.Lock()
 
 
 class Config:
@@ -26,16 +33,34 @@ class Config:
         endpoint = "discover"
         type = "movies"
         url, headers, params = config.get_tmdb_config(endpoint, type)
+
+    The modules of the pipelines share the configuration of the process returned by :func:`get_config`,
+    which is only read from the environment on its first use.
     """
 
 
     def __init__(self) -> None:
+        load_env()
         self.tmdb_api_key = os.getenv("TMDB_API_KEY")
+        self.tmdb_base_url = os.getenv("TMDB_BASE_URL", endpoint_config["base_url"])
+        self.tmdb_image_base_url = os.getenv("TMDB_IMAGE_BASE_URL", endpoint_config["image_base_url"])
+        self.tmdb_asset_dir = os.getenv("TMDB_ASSET_DIR")
         self.mongo_username = os.getenv("MONGO_USER")
         self.mongo_password = os.getenv("MONGO_PASSWORD")
         self.mongo_host = os.getenv("MONGO_HOST")
-        self.mongo_port = int(os.getenv("MONGO_PORT"))
+        self.mongo_port = int(os.getenv("MONGO_PORT", 27017))
         self.mongo_db = os.getenv("MONGO_DB")
+        self.mongo_max_pool_size = int(os.getenv("MONGO_MAX_POOL_SIZE", 100))
+        self.mongo_min_pool_size = int(os.getenv("MONGO_MIN_POOL_SIZE", 0))
+        self.mongo_write_concern = os.getenv("MONGO_WRITE_CONCERN", "1")
+        self.mongo_journal = os.getenv("MONGO_JOURNAL")
+        self.tmdb_rate_limit = float(os.getenv("TMDB_RATE_LIMIT", 40))
+        self.tmdb_rate_burst = int(os.getenv("TMDB_RATE_BURST", 40))
+        self.tmdb_cache_dir = os.getenv("TMDB_CACHE_DIR")
+        self.tmdb_cache_max_mb = int(os.getenv("TMDB_CACHE_MAX_MB", 2048))
+        self.tmdb_adaptive_concurrency = os.getenv("TMDB_ADAPTIVE_CONCURRENCY", "true").lower() == "true"
+        self.tmdb_min_concurrency = int(os.getenv("TMDB_MIN_CONCURRENCY", 2))
+        self.tmdb_max_concurrency = int(os.getenv("TMDB_MAX_CONCURRENCY", 50))
 
         required_vars = {
             "TMDB_API_KEY": self.tmdb_api_key
@@ -60,7 +85,7 @@ class Config:
             config = Config()
             schema, partition_field, partition_type = config.load_bq_schema("table_name_here")
         """
-        base_url = endpoint_config["base_url"]
+        base_url = self.tmdb_base_url
 
         endpoint_type = endpoint_config["endpoints"][endpoint][type]
         endpoint_path = endpoint_type.get("path")
@@ -72,7 +97,7 @@ class Config:
 
         headers = endpoint_type.get("headers")
 
-        params = endpoint_type.get("params", {})
+        params = deepcopy(endpoint_type.get("params", {}))
 
         params["api_key"] = self.tmdb_api_key
         return url, headers, params
@@ -96,6 +121,89 @@ class Config:
         updated_params.update(kwargs)
         return updated_params
     
+    # method to get the shared TMDB rate limiter
+    def get_rate_limiter(self) -> RateLimiter:
+        """
+        This method provides us with the process wide rate limiter which every TMDB request goes through.
+        The budget can be tuned with these optional environment variables:-
+            ```
+            TMDB_RATE_LIMIT=<requests_per_second>  # defaults to 40
+            TMDB_RATE_BURST=<max_burst_requests>   # defaults to 40
+            ```
+
+        To get the rate limiter use::
+
+            config = Config()
+            limiter = config.get_rate_limiter()
+        """
+        return get_rate_limiter(rate=self.tmdb_rate_limit, burst=self.tmdb_rate_burst)
+
+    # method to get the shared TMDB response cache
+    def get_response_cache(self) -> Optional[ResponseCache]:
+        """
+        This method provides us with the process wide on-disk cache of the TMDB responses.
+        The cache is optional, it is enabled by setting these environment variables:-
+            ```
+            TMDB_CACHE_DIR=<dir_to_keep_the_cache_in>
+            TMDB_CACHE_MAX_MB=<size_cap_in_mb>  # defaults to 2048
+            ```
+
+        To get the response cache (`None` when disabled) and the TTL of an endpoint use::
+
+            config = Config()
+            cache = config.get_response_cache()
+            ttl = config.get_cache_ttl("details", "movies")
+        """
+        if not self.tmdb_cache_dir:
+            return None
+        path = os.path.join(self.tmdb_cache_dir, "responses.sqlite3")
+        return get_response_cache(path=path, max_bytes=self.tmdb_cache_max_mb * 1024 ** 2)
+
+    def get_cache_ttl(self, endpoint: str, type: str) -> int:
+        """
+        Returns the seconds for which the responses of an endpoint are cached, as per its `cache_ttl` in the endpoint configuration.
+        """
+        return endpoint_config["endpoints"][endpoint][type].get("cache_ttl", 0)
+
+    # method to get the local store of the TMDB images
+    def get_asset_store(self) -> AssetStore:
+        """
+        This method provides us with the content-addressed store the posters, backdrops and logos are downloaded into.
+        The images are fetched from the image CDN of TMDB, both can be set with these optional environment variables:-
+            ```
+            TMDB_IMAGE_BASE_URL=<image_cdn_url>  # defaults to https://image.tmdb.org/t/p
+            TMDB_ASSET_DIR=<dir_to_keep_the_images_in>  # defaults to content_data/tmdb_assets
+            ```
+
+        To get the asset store use::
+
+            config = Config()
+            store = config.get_asset_store()
+            path = store.get_path("w500", "/kqjL17yufvn9OVLyXYpvtyrFfak.jpg")
+        """
+        return AssetStore(root=self.tmdb_asset_dir or DEFAULT_ASSET_DIR)
+
+    # method to get an adaptive concurrency controller
+    def get_concurrency_controller(self, name: str, initial: int = 10) -> Optional[ConcurrencyController]:
+        """
+        This method provides us with a new AIMD concurrency controller for a stage (e.g. `ids` or `movie_details`),
+        which adapts the requests in flight to the latency and the errors of TMDB.
+        It is enabled by default and can be tuned with these optional environment variables:-
+            ```
+            TMDB_ADAPTIVE_CONCURRENCY=<true|false>  # defaults to true
+            TMDB_MIN_CONCURRENCY=<min_in_flight>    # defaults to 2
+            TMDB_MAX_CONCURRENCY=<max_in_flight>    # defaults to 50
+            ```
+
+        To get the controller (`None` when disabled, the stages then use their fixed `max_concurrency`) use::
+
+            config = Config()
+            controller = config.get_concurrency_controller("movie_details", initial=10)
+        """
+        if not self.tmdb_adaptive_concurrency:
+            return None
+        return ConcurrencyController(name=name, initial=initial, min_limit=self.tmdb_min_concurrency, max_limit=self.tmdb_max_concurrency)
+
     # method to get the mongoDB client
     def get_mongo_db(self) -> Database:
         """
@@ -113,20 +221,66 @@ class Config:
             MONGO_DB=<your_mongoDB_db>
             ```
 
+        The client is created lazily on the first call and shared by the whole process,
+        its pool and write concern can be tuned with these optional environment variables:-
+            ```
+            MONGO_MAX_POOL_SIZE=<max_connections>   # defaults to 100
+            MONGO_MIN_POOL_SIZE=<min_connections>   # defaults to 0
+            MONGO_WRITE_CONCERN=<w>                 # e.g. 0, 1 or majority, defaults to 1
+            MONGO_JOURNAL=<true|false>              # optional
+            ```
+
         To get the database use::
 
             config = config()
             db = config.get_mongo_db()
         """
-        connection_string = f"mongodb://{self.mongo_username}:{self.mongo_password}@{self.mongo_host}:{self.mongo_port}/{self.mongo_db}"
-        client = MongoClient(connection_string)
+        client = get_mongo_client(self._get_mongo_connection_string(), **self._get_mongo_client_options())
         db = client[self.mongo_db]
         return db
 
+    # method to get the async mongoDB database
+    def get_async_mongo_db(self) -> Any:
+        """
+        This method provides us with the async (motor) Database object of the MongoDB,
+        so that the loaders running inside the event loop can write while the fetches are in flight.
+        It uses the same settings as :meth:`get_mongo_db` and must be called from within the event loop.
+
+        **NOTE: This needs the optional `motor` package.**
+
+        To get the async database use::
 
+            config = Config()
+            async_db = config.get_async_mongo_db()
+        """
+        client = get_motor_client(self._get_mongo_connection_string(), **self._get_mongo_client_options())
+        return client[self.mongo_db]
+
+    def _get_mongo_connection_string(self) -> str:
+        return f"mongodb://{self.mongo_username}:{self.mongo_password}@{self.mongo_host}:{self.mongo_port}/{self.mongo_db}"
 
+    def _get_mongo_client_options(self) -> Dict[str, Any]:
+        write_concern = int(self.mongo_write_concern) if self.mongo_write_concern.isdigit() else self.mongo_write_concern
+        options = {
+            "maxPoolSize": self.mongo_max_pool_size,
+            "minPoolSize": self.mongo_min_pool_size,
+            "w": write_concern,
+        }
+        if self.mongo_journal is not None:
+            options["journal"] = self.mongo_journal.lower() == "true"
+        return options
 
 
+def get_config() -> Config:
+    """
+    Get the shared configuration of the process, it is read from the environment on the first call,
+    hence importing the pipelines neither reads the `.env` file nor fails on missing variables.
+    """
+    global _config
+    with _config_lock:
+        if _config is None:
+            _config = Config()
+        return _config
 
 
 if __name__ == "__main__":
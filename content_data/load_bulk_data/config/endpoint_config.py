@@ -1,10 +1,13 @@
 endpoint_config = {
     "base_url": "https://api.themoviedb.org/3",
+    # the posters, backdrops and logos are served by the image CDN as <image_base_url>/<size><file_path>
+    "image_base_url": "https://image.tmdb.org/t/p",
     "endpoints":{
         "discover":{
             "movies":{
                 "path": "/discover/movie",
                 "bq_table":"raw_movies",
+                "cache_ttl": 86400,
                 "headers": {
                     "Accept": "application/json"
                 },
@@ -20,6 +23,7 @@ endpoint_config = {
             "tv_shows":{
                 "path": "/discover/tv",
                 "bq_table":"raw_tv_shows",
+                "cache_ttl": 86400,
                 "headers": {
                     "Accept": "application/json"
                 },
@@ -36,6 +40,7 @@ endpoint_config = {
         "genre":{
             "movies":{
                 "path": "/genre/movie/list",
+                "cache_ttl": 2592000,
                 "headers":{
                     "Accept":"application/json"
                 },
@@ -46,6 +51,7 @@ endpoint_config = {
             },
             "tv_shows":{
                 "path": "/genre/tv/list",
+                "cache_ttl": 2592000,
                 "headers":{
                     "Accept":"application/json"
                 },
@@ -55,18 +61,47 @@ endpoint_config = {
                 }
             }
         },
+        "changes":{
+            "movies":{
+                "path": "/movie/changes",
+                "headers":{
+                    "Accept":"application/json"
+                },
+                "params":{
+                    "page": "{{page}}",
+                    "start_date": "{{start_date}}",
+                    "end_date": "{{end_date}}",
+                    "api_key": "{{tmdb_api_key}}"
+                }
+            },
+            "tv_shows":{
+                "path": "/tv/changes",
+                "headers":{
+                    "Accept":"application/json"
+                },
+                "params":{
+                    "page": "{{page}}",
+                    "start_date": "{{start_date}}",
+                    "end_date": "{{end_date}}",
+                    "api_key": "{{tmdb_api_key}}"
+                }
+            }
+        },
         "details":{
             "movies":{
                 "path": "/movie",
+                "cache_ttl": 604800,
                 "headers":{
                     "Accept":"application/json"
                 },
                 "params":{
-                    "api_key": "{{tmdb_api_key}}"
+                    "api_key": "{{tmdb_api_key}}",
+                    "append_to_response": "credits,images,videos"
                 }
             },
             "tv_shows":{
                 "path": "/tv",
+                "cache_ttl": 604800,
                 "headers":{
                     "Accept":"application/json"
                 },
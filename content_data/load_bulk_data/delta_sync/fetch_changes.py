@@ -0,0 +1,105 @@
+"""
+This file contains the functionality to fetch the ids of the movies or tv_shows changed on TMDB
+in a time window, using the `/changes` endpoints.
+The TMDB settings are read from the shared configuration of the process (`get_config()`) when the requests are made.
+"""
+
+# external imports
+import httpx
+import random
+import asyncio
+from typing import List, Dict, Any, Optional, Tuple
+
+# local imports
+from ...base_log import Logger
+from ..config.config import get_config
+from ..utils.tmdb_http import tmdb_get_async
+from ..utils.metrics import get_metrics, get_endpoint_label
+
+logger = Logger('fetch_changes').get_logger()
+
+RETRIES = 3
+BACKOFF = 1
+
+
+class FetchChangesError(Exception):
+    """
+    Raised when a changes request still fails after its retries.
+    `response` is the last response of TMDB, `None` when the last attempt failed without one (e.g. a timeout).
+    """
+    def __init__(self, message: str, response: Optional[httpx.Response] = None) -> None:
+        super().__init__(message)
+        self.response = response
+
+
+class FetchChanges:
+    """
+    This class contains methods to fetch the changed movie and tv_show ids from TMDB.
+    It uses the shared `Config` (`get_config()`) to access configuration and endpoint settings for TMDB.
+    It sets configurations as follows:
+
+        - `self.url`: TMDB API endpoint for fetching changes.
+        - `self.headers`: TMDB API headers.
+        - `self.default_params`: TMDB API default parameters.
+        - `self.page`: Page number for fetching changes.
+        - `self.start_date`: Start date of the window (TMDB allows at most 14 days per window).
+        - `self.end_date`: End date of the window.
+        - `self.type`: Which changes to fetch (movies or tv_shows). Defaults to `movies`.
+        - `self.client`: Shared `httpx.AsyncClient`.
+
+    #### Notes:
+
+        - The changes are never cached, as they are only valid for the moment they are fetched.
+        - Like the discover pages, every request is retried `RETRIES` times with a jittered exponential backoff on errors,
+        non-`200` responses and timeouts (a `429` first waits for the `Retry-After` of TMDB in the shared rate limiter),
+        then `FetchChangesError` is raised.
+
+    #### Example Usage:
+
+        >>> async with httpx.AsyncClient() as client:
+        ...     changes, total_pages = await FetchChanges(page=1, start_date="2024-01-01", end_date="2024-01-14", client=client).fetch_changes_async()
+    """
+    def __init__(self, page: int = 1, start_date: str = None, end_date: str = None, type: str = "movies", client: httpx.AsyncClient = None):
+        self.type = type
+        self.client = client
+        self.url, self.headers, self.default_params = get_config().get_tmdb_config(endpoint="changes", type=self.type)
+        self.page = page
+        self.start_date = start_date
+        self.end_date = end_date
+
+    async def fetch_changes_async(self) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        Fetch a page of changes from TMDB.
+
+        Returns:
+            Tuple[List[Dict[str, Any]], int]: The changed ids having metadata, and the total pages of the window.
+        """
+        params = get_config().set_tmdb_params(params=self.default_params, page=self.page, start_date=self.start_date, end_date=self.end_date)
+        for attempt in range(1, RETRIES + 1):
+            try:
+                # 429s are retried by the shared rate limiter as per the Retry-After of TMDB
+                response = await tmdb_get_async(self.client, self.url, limiter=get_config().get_rate_limiter(), headers=self.headers, params=params)
+                if response.status_code != 200:
+                    raise FetchChangesError(f"{response.status_code} - {response.text}", response=response)
+                data = response.json()
+                return data.get('results', []), data.get('total_pages', 1)
+            except Exception as e:
+                await asyncio.sleep(self._on_failure(attempt, e))
+
+    def _describe(self) -> str:
+        return f"page {self.page} of the changes from {self.start_date} to {self.end_date}"
+
+    def _on_failure(self, attempt: int, error: Exception) -> float:
+        """
+        Log a failed attempt, raise `FetchChangesError` once the retries are exhausted.
+
+        Returns:
+            float: Seconds to wait before the next attempt.
+        """
+        logger.warning(f"⚠️ Attempt {attempt} failed for {self._describe()}: {error}")
+        if attempt == RETRIES:
+            logger.error(f"❌ Giving up after {RETRIES} attempts for {self._describe()}")
+            get_metrics().inc("tmdb_give_ups_total", endpoint=get_endpoint_label(self.url), reason="error")
+            raise FetchChangesError(f"Failed to fetch {self._describe()}: {error}", response=getattr(error, "response", None)) from error
+        get_metrics().inc("tmdb_retries_total", endpoint=get_endpoint_label(self.url), reason="error")
+        return BACKOFF * 2 ** (attempt - 1) + random.uniform(0, 0.5)
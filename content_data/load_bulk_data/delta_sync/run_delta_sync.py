@@ -0,0 +1,164 @@
+"""
+This file contains the functionality to incrementally refresh the content data,
+using the `/movie/changes` feed of TMDB instead of re-pulling whole years.
+
+The day up to which the content is in sync (the high-water mark) is stored in the `pipeline_state`
+collection of MongoDB. Every run reads the changes from the high-water mark up to today,
+re-fetches only the changed movies and upserts them into the existing collections.
+"""
+
+# external imports
+import time
+import httpx
+import asyncio
+from datetime import date, datetime, timedelta, timezone
+from typing import List, Tuple, Set
+from pymongo.database import Database
+
+# local imports
+from .fetch_changes import FetchChanges
+from ..load_mongo.mongo_loader import MongoLoader
+from ..load_movie_details.run_movie_details import RunMovieDetails
+from ..utils.id_set import IDSet
+from ..utils.metrics import get_metrics
+from ..utils.concurrency import ConcurrencyController
+from ..utils.dead_letters import DeadLetterStore
+from ...base_log import Logger
+
+logger = Logger('run_delta_sync').get_logger()
+
+MAX_WINDOW_DAYS = 14
+STATE_COLLECTION = "pipeline_state"
+
+
+class RunDeltaSync:
+    """
+    This class refreshes the movies changed on TMDB in a time window.
+    It sets configurations as follows:
+
+        - `self.db`: MongoDB database holding the content collections.
+        - `self.start_date`: Start of the window. Defaults to the stored high-water mark (or yesterday on the first run).
+        - `self.end_date`: End of the window. Defaults to today (UTC).
+        - `self.include_new`: Whether changed movies not in the `movies` collection yet are loaded too. Defaults to `False`.
+        - `self.batch_size`: Number of movies fetched before they are loaded. Defaults to `500`.
+        - `self.max_concurrency`: Number of requests in flight. Defaults to `10`.
+        - `self.controller`: Optional `ConcurrencyController` of the details stage, replacing `max_concurrency` for the changed movies.
+        - `self.dead_letters`: Optional `DeadLetterStore` the changed movies which could not be fetched are recorded in (without a year).
+
+    #### Notes:
+
+        - TMDB serves at most 14 days of changes per request, longer windows are split.
+        - The high-water mark only advances once the whole window is processed,
+        a run that crashes is simply repeated from the same day.
+        - Changed movies which could not be fetched (e.g. removed from TMDB) are logged, and recorded in the dead letters if given.
+        Without dead letters the high-water mark is held back, the next run fetches the window again.
+        - The cached responses of the changed movies are revalidated with TMDB, a fresh cache entry is stale by definition.
+
+    #### Example Usage:
+
+        >>> obj = RunDeltaSync(db=config.get_mongo_db())
+        >>> loaded = obj.run()
+    """
+    def __init__(self, db: Database, start_date: str = None, end_date: str = None, include_new: bool = False, batch_size: int = 500, max_concurrency: int = 10, loader: MongoLoader = None, controller: ConcurrencyController = None, dead_letters: DeadLetterStore = None) -> None:
+        self.db = db
+        self.state_key = "delta_sync_movies"
+        self.end_date = end_date or datetime.now(timezone.utc).date().isoformat()
+        self.start_date = start_date or self.get_high_water_mark() or (date.fromisoformat(self.end_date) - timedelta(days=1)).isoformat()
+        self.include_new = include_new
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.controller = controller
+        self.dead_letters = dead_letters
+        self.loader = loader or MongoLoader(db=db)
+
+    def get_high_water_mark(self) -> str:
+        state = self.db[STATE_COLLECTION].find_one({"_id": self.state_key})
+        return state.get("high_water_mark") if state else None
+
+    def set_high_water_mark(self, high_water_mark: str) -> None:
+        self.db[STATE_COLLECTION].update_one(
+            {"_id": self.state_key},
+            {"$set": {"high_water_mark": high_water_mark, "updated_at": datetime.now(timezone.utc)}},
+            upsert=True,
+        )
+        logger.info(f"High-water mark set to {high_water_mark}")
+
+    def _get_windows(self) -> List[Tuple[str, str]]:
+        start, end = date.fromisoformat(self.start_date), date.fromisoformat(self.end_date)
+        windows = []
+        while start <= end:
+            window_end = min(start + timedelta(days=MAX_WINDOW_DAYS - 1), end)
+            windows.append((start.isoformat(), window_end.isoformat()))
+            start = window_end + timedelta(days=1)
+        return windows
+
+    async def _fetch_window(self, start_date: str, end_date: str, client: httpx.AsyncClient, semaphore: asyncio.Semaphore) -> Set[int]:
+        async def fetch_page(page: int):
+            waiting = time.perf_counter()
+            async with semaphore:
+                get_metrics().observe("semaphore_wait_seconds", time.perf_counter() - waiting, stage="changes")
+                return await FetchChanges(page=page, start_date=start_date, end_date=end_date, client=client).fetch_changes_async()
+
+        results, total_pages = await fetch_page(1)
+        pages = await asyncio.gather(*[fetch_page(page) for page in range(2, total_pages + 1)])
+        for page_results, _ in pages:
+            results.extend(page_results)
+        logger.info(f"Fetched {len(results)} changes from {start_date} to {end_date} in {total_pages} pages")
+        return {change["id"] for change in results if change.get("id") is not None}
+
+    async def fetch_changed_ids_async(self) -> IDSet:
+        """
+        Fetch the ids of the movies changed in the window.
+        Unless `include_new` is set, only the movies already in the `movies` collection are kept.
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with httpx.AsyncClient(timeout=httpx.Timeout(30.0, pool=None)) as client:
+            windows = await asyncio.gather(*[self._fetch_window(start, end, client, semaphore) for start, end in self._get_windows()])
+        changed_ids = IDSet()
+        for window in windows:
+            changed_ids.update(window)
+
+        if not self.include_new and changed_ids:
+            existing = self.loader.get_existing_ids(changed_ids)
+            logger.info(f"{len(existing)} of {len(changed_ids)} changed movies are in the movies collection")
+            changed_ids = existing
+        return changed_ids
+
+    async def run_async(self) -> int:
+        """
+        Re-fetch and upsert the changed movies, then advance the high-water mark.
+
+        Returns:
+            int: Number of movies loaded.
+        """
+        logger.info(f"Syncing the changes from {self.start_date} to {self.end_date}")
+        changed_ids = await self.fetch_changed_ids_async()
+
+        queue = asyncio.Queue(maxsize=self.batch_size)
+        producer = asyncio.create_task(RunMovieDetails(movie_ids=changed_ids, max_concurrency=self.max_concurrency, controller=self.controller, dead_letters=self.dead_letters, revalidate=True).stream_movies(queue))
+        batch = []
+        loaded = 0
+        fetched_ids = set()
+        while (movie := await queue.get()) is not RunMovieDetails.END_OF_STREAM:
+            fetched_ids.add(movie["id"])
+            batch.append(movie)
+            if len(batch) >= self.batch_size:
+                loaded += await asyncio.to_thread(self.loader.load_movies, batch)
+                batch = []
+        if batch:
+            loaded += await asyncio.to_thread(self.loader.load_movies, batch)
+        await producer
+
+        logger.info(f"Loaded {loaded} of {len(changed_ids)} changed movies")
+        missing = [movie_id for movie_id in changed_ids if movie_id not in fetched_ids]
+        if missing:
+            logger.error(f"❌ {len(missing)} changed movies could not be fetched: {missing[:100]}")
+            # without the dead letters the failed changes would be lost once the mark moves past them
+            if self.dead_letters is None:
+                logger.error(f"❌ High-water mark not advanced to {self.end_date}, the window is fetched again on the next run")
+                return loaded
+        self.set_high_water_mark(self.end_date)
+        return loaded
+
+    def run(self) -> int:
+        return asyncio.run(self.run_async())
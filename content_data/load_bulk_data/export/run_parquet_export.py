@@ -0,0 +1,236 @@
+"""
+This file contains the export of the content collections to Parquet files, for bulk loads into the BigQuery warehouse.
+
+An export reads only the documents loaded since the last export (their `updated_at`, stamped by the loaders)
+and writes them to Parquet files partitioned the Hive way by `release_year`:
+
+    tmdb_exports/
+        movies/release_year=2024/part-20240601T020000-00000.parquet
+        images/release_year=2024/part-20240601T020000-00000.parquet
+        people/part-20240601T020000-00000.parquet      # a person spans many years, the files are split by count
+        manifests/20240601T020000.json                 # the files, rows and BigQuery table of every export
+
+The changed ids are planned per partition first (the images and videos take the `release_year` of their movie),
+then the partitions are written in parallel, each streaming its documents through a projected cursor keyed on
+the unique TMDB id index. The export time less `lag` is stored as the high-water mark in the `pipeline_state` collection
+once all the files are written, a failed export is simply repeated.
+
+The loaders stamp `updated_at` on the client when they build a batch, which may be committed well after,
+hence an export only reads up to `lag` (an hour by default) before its start. A batch stamped before
+the mark but committed after the export read the collection is still found by the next export,
+as long as no load takes longer than the lag.
+"""
+
+# external imports
+import os
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from pymongo.database import Database
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+# local imports
+from .schemas import EXPORTS, get_projection, get_schema, to_row
+from ..utils.id_set import IDSet
+from ..utils.metrics import get_metrics
+from ...base_log import Logger
+
+logger = Logger('run_parquet_export').get_logger()
+
+content_data_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+DEFAULT_DIR = os.path.join(content_data_dir, "tmdb_exports")
+STATE_COLLECTION = "pipeline_state"
+# the Hive partition of the documents without a release year (or whose movie is not loaded)
+NULL_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+
+
+class RunParquetExport:
+    """
+    This class exports the documents of the content collections changed since the last export to Parquet files.
+    It sets configurations as follows:
+
+        - `self.db`: MongoDB database holding the content collections.
+        - `self.exports`: Exports to run (`movies`, `people`, `images`, `videos`), see `EXPORTS`. Defaults to all of them.
+        - `self.root`: Directory of the files. Defaults to `content_data/tmdb_exports`.
+        - `self.full`: Whether every document is exported, ignoring the high-water mark. Defaults to `False`.
+        - `self.max_workers`: Number of partitions written in parallel. Defaults to `4`.
+        - `self.batch_size`: Number of documents read per cursor and written per row group. Defaults to `10000`.
+        - `self.rows_per_file`: Number of rows per file of the exports which are not partitioned. Defaults to `100000`.
+        - `self.compression`: Parquet compression codec. Defaults to `snappy`.
+        - `self.lag`: How long before its start an export reads up to, it must exceed the longest load. Defaults to an hour.
+
+    #### Notes:
+        - Every export has its own high-water mark (`_id: "parquet_export_<export>"`), the first export is a full one.
+        - The documents stamped within `lag` of the export (or while it runs) are left for the next one,
+        their `updated_at` is after the high-water mark.
+        - A changed document is exported again in full, the warehouse keeps the row with the latest `updated_at`.
+        - The files are written under a temporary name and renamed once complete, a crash never leaves half a file.
+
+    #### Example Usage:
+
+        >>> obj = RunParquetExport(db=config.get_mongo_db(), exports=["movies", "images"], max_workers=8)
+        >>> manifest = obj.run()
+        >>> manifest["exports"]["movies"]["rows"]
+        9135
+    """
+    def __init__(self, db: Database, exports: List[str] = None, root: str = DEFAULT_DIR, full: bool = False, max_workers: int = 4, batch_size: int = 10_000, rows_per_file: int = 100_000, compression: str = "snappy", lag: timedelta = timedelta(hours=1)) -> None:
+        if pq is None:
+            raise ImportError("The Parquet export needs pyarrow, install it with `pip install pyarrow`.")
+        self.db = db
+        self.exports = exports or list(EXPORTS)
+        self.root = Path(root)
+        self.full = full
+        self.max_workers = max_workers
+        self.batch_size = batch_size
+        self.rows_per_file = rows_per_file
+        self.compression = compression
+        self.lag = lag
+
+    def get_high_water_mark(self, export: str) -> Optional[datetime]:
+        state = self.db[STATE_COLLECTION].find_one({"_id": f"parquet_export_{export}"})
+        return state.get("high_water_mark") if state else None
+
+    def set_high_water_mark(self, export: str, high_water_mark: datetime) -> None:
+        self.db[STATE_COLLECTION].update_one(
+            {"_id": f"parquet_export_{export}"},
+            {"$set": {"high_water_mark": high_water_mark, "updated_at": datetime.now(timezone.utc)}},
+            upsert=True,
+        )
+
+    def _get_filter(self, export: str, until: datetime) -> Dict[str, Any]:
+        since = None if self.full else self.get_high_water_mark(export)
+        if since is None:
+            # the documents loaded before the loaders stamped them have no `updated_at`
+            return {"$or": [{"updated_at": {"$lt": until}}, {"updated_at": {"$exists": False}}]}
+        return {"updated_at": {"$gte": since, "$lt": until}}
+
+    def _get_years(self, movie_ids: IDSet) -> Dict[Optional[int], IDSet]:
+        """
+        Group movie ids by the `release_year` of their movie.
+        """
+        years: Dict[Optional[int], IDSet] = {}
+        found = IDSet()
+        for chunk in movie_ids.chunks(self.batch_size):
+            for movie in self.db["movies"].find({"id": {"$in": chunk}}, {"id": 1, "release_year": 1, "_id": 0}):
+                years.setdefault(movie.get("release_year"), IDSet()).add(movie["id"])
+                found.add(movie["id"])
+        missing = movie_ids.difference(found)
+        if len(missing):
+            years.setdefault(None, IDSet()).update(missing)
+        return years
+
+    def plan(self, export: str, until: datetime) -> Dict[Any, IDSet]:
+        """
+        Find the ids of the documents of an export changed since its last export, grouped by partition.
+
+        Returns:
+            Dict[Any, IDSet]: The changed ids per `release_year` for the partitioned exports, per file index for the others.
+        """
+        spec = EXPORTS[export]
+        key = spec["key"]
+        query = self._get_filter(export, until)
+        if export == "movies":
+            years: Dict[Optional[int], IDSet] = {}
+            for doc in self.db[spec["collection"]].find(query, {"id": 1, "release_year": 1, "_id": 0}):
+                years.setdefault(doc.get("release_year"), IDSet()).add(doc["id"])
+            return years
+
+        ids = IDSet(doc[key] for doc in self.db[spec["collection"]].find(query, {key: 1, "_id": 0}) if doc.get(key) is not None)
+        if spec["partitioned"]:
+            return self._get_years(ids)
+        return {index: ids[start:start + self.rows_per_file] for index, start in enumerate(range(0, len(ids), self.rows_per_file))}
+
+    def _get_path(self, export: str, partition: Any, export_id: str) -> Path:
+        if not EXPORTS[export]["partitioned"]:
+            return self.root / export / f"part-{export_id}-{partition:05d}.parquet"
+        directory = f"release_year={NULL_PARTITION if partition is None else partition}"
+        return self.root / export / directory / f"part-{export_id}-00000.parquet"
+
+    @staticmethod
+    def _to_table(export: str, rows: List[Dict[str, Any]], schema: "pa.Schema") -> "pa.Table":
+        try:
+            return pa.Table.from_pylist(rows, schema=schema)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # a document not matching the schema is left out rather than failing its whole partition
+            tables = []
+            for row in rows:
+                try:
+                    tables.append(pa.Table.from_pylist([row], schema=schema))
+                except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+                    logger.error(f"❌ {export} document {row.get(EXPORTS[export]['key'])} does not match the schema: {e}")
+            return pa.concat_tables(tables) if tables else schema.empty_table()
+
+    def export_partition(self, export: str, partition: Any, ids: IDSet, export_id: str) -> Tuple[str, int]:
+        """
+        Write the documents of a partition to its Parquet file, a row group per batch read.
+
+        Returns:
+            Tuple[str, int]: The path of the file relative to the root, and its number of rows.
+        """
+        spec = EXPORTS[export]
+        schema = get_schema(export)
+        projection = get_projection(export)
+        path = self._get_path(export, partition, export_id)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_name(path.name + ".part")
+
+        rows = 0
+        start = time.perf_counter()
+        with pq.ParquetWriter(temp_path, schema, compression=self.compression) as writer:
+            for chunk in ids.chunks(self.batch_size):
+                docs = [to_row(export, doc) for doc in self.db[spec["collection"]].find({spec["key"]: {"$in": chunk}}, projection)]
+                table = self._to_table(export, docs, schema)
+                writer.write_table(table)
+                rows += table.num_rows
+        os.replace(temp_path, path)
+
+        metrics = get_metrics()
+        metrics.inc("export_rows_total", rows, export=export)
+        metrics.inc("export_bytes_total", path.stat().st_size, export=export)
+        metrics.observe("export_partition_seconds", time.perf_counter() - start, export=export)
+        return str(path.relative_to(self.root)), rows
+
+    def run(self) -> Dict[str, Any]:
+        """
+        Run the exports, the partitions of all of them are written by the same pool of workers.
+
+        Returns:
+            Dict[str, Any]: The manifest of the export, also written to `manifests/<export_id>.json`.
+        """
+        started_at = datetime.now(timezone.utc)
+        export_id = started_at.strftime("%Y%m%dT%H%M%S")
+        # the batches stamped before `until` but still being written are committed within the lag
+        until = started_at - self.lag
+        manifest = {"export_id": export_id, "until": until.isoformat(), "exports": {}}
+
+        tasks = []
+        for export in self.exports:
+            partitions = self.plan(export, until)
+            logger.info(f"Exporting {sum(len(ids) for ids in partitions.values())} changed {export} documents in {len(partitions)} partitions")
+            manifest["exports"][export] = {"bq_table": EXPORTS[export]["bq_table"], "partitioned": EXPORTS[export]["partitioned"], "rows": 0, "files": []}
+            tasks.extend((export, partition, ids) for partition, ids in partitions.items() if len(ids))
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = list(executor.map(lambda task: (task[0], *self.export_partition(*task, export_id)), tasks))
+        for export, path, rows in results:
+            manifest["exports"][export]["files"].append(path)
+            manifest["exports"][export]["rows"] += rows
+
+        # the marks only move once every file of the export is written
+        for export in self.exports:
+            self.set_high_water_mark(export, until)
+        manifest_path = self.root / "manifests" / f"{export_id}.json"
+        manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(manifest_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=4)
+        exported = ", ".join(f"{spec['rows']} {export}" for export, spec in manifest["exports"].items())
+        logger.info(f"Exported {exported}, manifest written to {manifest_path}")
+        return manifest
@@ -0,0 +1,166 @@
+"""
+This file contains the exports of the content collections to the warehouse, and the Parquet schemas of their files.
+
+Every export declares the collection it reads, the TMDB id the documents are keyed on, the BigQuery table its files
+are loaded into, whether its files are partitioned by `release_year`, and the Arrow schema of its rows.
+The schemas are explicit rather than inferred, hence every file of a table has the same columns and types
+whatever the documents of its partition hold, and the nested arrays (genres, images, videos, credits)
+are written as repeated records BigQuery loads as they are.
+
+The Arrow types are only built when `pyarrow` is installed (`pip install pyarrow`), see `get_schema`.
+"""
+
+# external imports
+from typing import Any, Dict, Optional
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+# local imports
+from ..config.endpoint_config import endpoint_config
+
+# export -> collection, key, BigQuery table and partitioning
+EXPORTS: Dict[str, Dict[str, Any]] = {
+    "movies": {
+        "collection": "movies",
+        "key": "id",
+        "bq_table": endpoint_config["endpoints"]["discover"]["movies"]["bq_table"],
+        "partitioned": True,
+    },
+    "people": {
+        # the normalized credits, one document per person
+        "collection": "persons",
+        "key": "id",
+        "bq_table": "raw_people",
+        "partitioned": False,
+    },
+    "images": {
+        "collection": "images",
+        "key": "movie_id",
+        "bq_table": "raw_movie_images",
+        "partitioned": True,
+    },
+    "videos": {
+        "collection": "videos",
+        "key": "id",
+        "bq_table": "raw_movie_videos",
+        "partitioned": True,
+    },
+}
+
+
+def _get_schemas() -> Dict[str, "pa.Schema"]:
+    image = pa.struct([
+        ("file_path", pa.string()),
+        ("aspect_ratio", pa.float64()),
+        ("height", pa.int64()),
+        ("width", pa.int64()),
+        ("iso_639_1", pa.string()),
+        ("vote_average", pa.float64()),
+        ("vote_count", pa.int64()),
+    ])
+    video = pa.struct([
+        ("id", pa.string()),
+        ("key", pa.string()),
+        ("name", pa.string()),
+        ("site", pa.string()),
+        ("type", pa.string()),
+        ("size", pa.int64()),
+        ("official", pa.bool_()),
+        ("iso_639_1", pa.string()),
+        ("iso_3166_1", pa.string()),
+        ("published_at", pa.string()),
+    ])
+    return {
+        # `release_year` is the partition of the files, hence not a column of them
+        "movies": pa.schema([
+            ("id", pa.int64()),
+            ("title", pa.string()),
+            ("adult", pa.bool_()),
+            ("backdrop_path", pa.string()),
+            ("poster_path", pa.string()),
+            ("release_date", pa.string()),
+            ("overview", pa.string()),
+            ("tagline", pa.string()),
+            ("runtime", pa.int64()),
+            ("genres", pa.list_(pa.struct([("id", pa.int64()), ("name", pa.string())]))),
+            ("production_companies", pa.list_(pa.struct([("id", pa.int64()), ("name", pa.string()), ("logo_path", pa.string()), ("origin_country", pa.string())]))),
+            ("production_countries", pa.list_(pa.struct([("iso_3166_1", pa.string()), ("name", pa.string())]))),
+            ("popularity", pa.float64()),
+            ("vote_average", pa.float64()),
+            ("vote_count", pa.int64()),
+            ("status", pa.string()),
+            ("original_language", pa.string()),
+            ("budget", pa.int64()),
+            ("revenue", pa.int64()),
+            ("trailer", video),
+            ("updated_at", pa.timestamp("ms", tz="UTC")),
+        ]),
+        "people": pa.schema([
+            ("id", pa.int64()),
+            ("name", pa.string()),
+            ("gender", pa.int64()),
+            ("known_for_department", pa.string()),
+            ("profile_path", pa.string()),
+            ("popularity", pa.float64()),
+            ("movie_ids", pa.list_(pa.int64())),
+            # the `credits.<movie_id>` references, flattened into one record per film reference
+            ("credits", pa.list_(pa.struct([
+                ("movie_id", pa.int64()),
+                ("role", pa.string()),
+                ("character", pa.string()),
+                ("order", pa.int64()),
+                ("job", pa.string()),
+                ("department", pa.string()),
+            ]))),
+            ("updated_at", pa.timestamp("ms", tz="UTC")),
+        ]),
+        "images": pa.schema([
+            ("movie_id", pa.int64()),
+            ("backdrops", pa.list_(image)),
+            ("logos", pa.list_(image)),
+            ("posters", pa.list_(image)),
+            ("updated_at", pa.timestamp("ms", tz="UTC")),
+        ]),
+        "videos": pa.schema([
+            ("id", pa.int64()),
+            ("results", pa.list_(video)),
+            ("updated_at", pa.timestamp("ms", tz="UTC")),
+        ]),
+    }
+
+
+_schemas: Optional[Dict[str, "pa.Schema"]] = None
+
+
+def get_schema(export: str) -> "pa.Schema":
+    """
+    Get the Arrow schema of the rows of an export.
+    """
+    global _schemas
+    if pa is None:
+        raise ImportError("The Parquet export needs pyarrow, install it with `pip install pyarrow`.")
+    if _schemas is None:
+        _schemas = _get_schemas()
+    return _schemas[export]
+
+
+def get_projection(export: str) -> Dict[str, int]:
+    """
+    Get the projection of the cursors of an export, only the fields of its schema are read from MongoDB.
+    """
+    return {"_id": 0, **{name: 1 for name in get_schema(export).names}}
+
+
+def to_row(export: str, doc: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Shape a document into a row of its export, e.g. the film references of a person keyed by movie id become a list.
+    """
+    if export == "people":
+        doc["credits"] = [
+            {"movie_id": int(movie_id), **reference}
+            for movie_id, references in (doc.get("credits") or {}).items() for reference in references
+        ]
+    return doc
@@ -0,0 +1,154 @@
+"""
+This file contains the functionality to split a year into balanced date ranges
+for fetching ids from TMDB.
+
+TMDB only serves the first 500 pages of any discover query, so a date range that
+reports more pages than that can not be fetched completely. The `DatePartitioner`
+recursively bisects such ranges (down to single days) and merges adjacent small ranges
+so that every work unit has a similar number of pages.
+
+Every probe is the first discover page of its range, its ids are kept with the work units
+(`probed_pages`) so the fetch stage does not request the same page again.
+"""
+
+# external imports
+import httpx
+import asyncio
+import calendar
+from datetime import date, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+# local imports
+from .fetch_ids import FetchIDs
+from ...base_log import Logger
+
+logger = Logger('date_partitioner').get_logger()
+
+RESULTS_PER_PAGE = 20
+
+
+class DatePartitioner:
+    """
+    This class contains methods to partition a year into date ranges for fetching ids.
+    It uses the `FetchIDs` module to probe the number of results in a date range.
+    It sets configurations as follows:
+
+        - `self.year`: Year to partition.
+        - `self.type`: Which ids to probe (movies or tv_shows). Defaults to `movies`.
+        - `self.max_pages`: Maximum pages a single date range may have. Defaults to `500` (TMDB limit).
+        - `self.target_pages`: Page budget of a work unit while merging small ranges. Defaults to `50`.
+        - `self.client`: Shared `httpx.AsyncClient` used to probe TMDB.
+        - `self.probe`: Async callable taking `(start_date, end_date)` and returning the total results in that range
+        along with the ids of its first page.
+        - `self.probed_pages`: Ids of the work unit pages the probes already fetched, keyed by `(start_date, end_date, page)`,
+        set by `get_work_units`.
+
+    #### Notes:
+
+        - Ranges are first split month wise, every month that exceeds `max_pages` is bisected until
+        it fits or is a single day. A single day that still exceeds `max_pages` is kept and capped.
+        - Adjacent ranges are merged as long as the merged range stays within `target_pages`.
+        - All months are probed concurrently on the shared client.
+        - Every probe is retried like a discover page, a probe which still fails raises `FetchIDsError`
+        and the year is partitioned again on the next run.
+        - A work unit which is a single probed range has its page 1 in `probed_pages`. A work unit merged
+        from ranges of a single page each has all its ids probed, they are spread over its pages in order.
+        The pages of the other merged work units differ from the probed ones and are all fetched.
+
+    #### Example Usage:
+
+        >>> partitioner = DatePartitioner(year=2024, type="movies", max_pages=500, target_pages=50, client=client)
+        >>> work_units = await partitioner.get_work_units()
+        >>> work_units[0]
+        ('2024-01-01', '2024-01-09', 48)
+    """
+    def __init__(self, year: int, type: str = "movies", max_pages: int = 500, target_pages: int = 50, client: httpx.AsyncClient = None, probe: Callable[[str, str], Awaitable[Tuple[int, List[int]]]] = None) -> None:
+        self.year = year
+        self.type = type
+        self.max_pages = max_pages
+        self.target_pages = min(target_pages, max_pages)
+        self.client = client
+        self.probe = probe or self._probe_first_page
+        self.probed_pages: Dict[Tuple[str, str, int], List[int]] = {}
+
+    async def _probe_first_page(self, start_date: str, end_date: str) -> Tuple[int, List[int]]:
+        data = await FetchIDs(start_date=start_date, end_date=end_date, type=self.type, client=self.client).get_first_page_async()
+        return data.get('total_results', 0), [result.get("id") for result in data.get('results', [])]
+
+    @staticmethod
+    def _pages(total_results: int) -> int:
+        return max(1, -(-total_results // RESULTS_PER_PAGE))
+
+    def get_month_ranges(self) -> List[Tuple[date, date]]:
+        """
+        Get the month wise date ranges of the year, taking leap years into account.
+
+        Returns:
+            List[Tuple[date, date]]: First and last day of each month.
+        """
+        month_ranges = []
+        for month in range(1, 13):
+            last_day = calendar.monthrange(self.year, month)[1]
+            month_ranges.append((date(self.year, month, 1), date(self.year, month, last_day)))
+        return month_ranges
+
+    async def _split(self, start: date, end: date) -> List[Tuple[date, date, int, List[int]]]:
+        total_results, first_ids = await self.probe(start.isoformat(), end.isoformat())
+        pages = self._pages(total_results)
+
+        if pages <= self.max_pages:
+            return [(start, end, total_results, first_ids)]
+
+        if start == end:
+            logger.error(f"Total pages {pages} exceeds the limit of {self.max_pages} on a single day: {start}. Only first {self.max_pages} pages will be fetched.")
+            return [(start, end, self.max_pages * RESULTS_PER_PAGE, first_ids)]
+
+        mid = start + timedelta(days=(end - start).days // 2)
+        logger.info(f"Total pages {pages} exceeds the limit of {self.max_pages}. Splitting Date Range: {start} to {end}")
+        left, right = await asyncio.gather(self._split(start, mid), self._split(mid + timedelta(days=1), end))
+        return left + right
+
+    def _merge(self, ranges: List[Tuple[date, date, int, List[int]]]) -> List[Tuple[date, date, int, Optional[List[int]], bool]]:
+        """
+        Merge adjacent ranges within `target_pages`, along with their probed ids.
+        The probed ids are all the ids of a range when it is complete (every part had a single page),
+        only those of its page 1 when it is a single range of several pages, else they are unknown (`None`).
+        """
+        merged = []
+        for start, end, total_results, first_ids in ranges:
+            complete = self._pages(total_results) == 1
+            if merged:
+                last_start, _, last_results, last_ids, last_complete = merged[-1]
+                if self._pages(last_results + total_results) <= self.target_pages:
+                    complete = complete and last_complete
+                    merged[-1] = (last_start, end, last_results + total_results, last_ids + first_ids if complete else None, complete)
+                    continue
+            merged.append((start, end, total_results, first_ids, complete))
+        return merged
+
+    @staticmethod
+    def _get_probed_pages(start: str, end: str, total_pages: int, ids: Optional[List[int]], complete: bool) -> Dict[Tuple[str, str, int], List[int]]:
+        if ids is None:
+            return {}
+        if not complete:
+            return {(start, end, 1): ids}
+        return {(start, end, page): ids[(page - 1) * RESULTS_PER_PAGE:page * RESULTS_PER_PAGE] for page in range(1, total_pages + 1)}
+
+    async def get_work_units(self) -> List[Tuple[str, str, int]]:
+        """
+        Partition the year into balanced work units.
+
+        Returns:
+            List[Tuple[str, str, int]]: `(start_date, end_date, total_pages)` for each work unit.
+        """
+        months = await asyncio.gather(*[self._split(start, end) for start, end in self.get_month_ranges()])
+        ranges = [date_range for month in months for date_range in month]
+
+        work_units = []
+        self.probed_pages = {}
+        for start, end, total_results, ids, complete in self._merge(ranges):
+            work_unit = (start.isoformat(), end.isoformat(), min(self._pages(total_results), self.max_pages))
+            work_units.append(work_unit)
+            self.probed_pages.update(self._get_probed_pages(*work_unit, ids, complete))
+        logger.info(f"Partitioned year {self.year} into {len(work_units)} work units, {len(self.probed_pages)} of their pages were fetched by the probes")
+        return work_units
@@ -1,27 +1,43 @@
 """
 This file contains the functionality to fetch ids of movies or tv_shows from TMDB.
-
-It contains global constants:
-    - `CONFIG`: Configuration object to access BigQuery and TMDB settings.
+The TMDB settings are read from the shared configuration of the process (`get_config()`) when the requests are made.
 """
 
 # external imports
+import time
+import httpx
+import random
 import requests
-from dotenv import load_dotenv
-from typing import List, Dict, Any
+import asyncio
+from typing import List, Dict, Any, Optional, Union
 
 # local imports
 from ...base_log import Logger
-from ..config.config import Config
-load_dotenv()
+from ..config.config import get_config
+from ..utils.tmdb_http import tmdb_get, tmdb_get_async
+from ..utils.concurrency import ConcurrencyController
+from ..utils.metrics import get_metrics, get_endpoint_label
 
-CONFIG = Config()
 logger = Logger('fetch_ids').get_logger()
 
+RETRIES = 3
+BACKOFF = 1
+
+
+class FetchIDsError(Exception):
+    """
+    Raised when a discover request still fails after its retries.
+    `response` is the last response of TMDB, `None` when the last attempt failed without one (e.g. a timeout).
+    """
+    def __init__(self, message: str, response: Optional[Union[httpx.Response, requests.Response]] = None) -> None:
+        super().__init__(message)
+        self.response = response
+
+
 class FetchIDs:
     """
     This class contains methods to fetch movie and tv_show ids from TMDB.
-    It uses the Config() module to access configuration and endpoint settings for TMDB.
+    It uses the shared `Config` (`get_config()`) to access configuration and endpoint settings for TMDB.
     It sets configurations as follows:
 
         - `self.url`: TMDB API endpoint for fetching ids.
@@ -31,6 +47,8 @@ class FetchIDs:
         - `self.start_date`: Start date for fetching ids.
         - `self.end_date`: End date for fetching ids.
         - `self.type`: This will tell the program which ids to fetch (movies or tv_shows). Defaults to `movies`.
+        - `self.client`: Shared `httpx.AsyncClient` used by the async methods.
+        - `self.controller`: Optional `ConcurrencyController` of the stage, the outcome of every async request is reported to it.
         - `self._set_params()`: Sets the parameters for fetching ids.
         - `self.total_page_params`: Parameters for fetching total pages.
         - `self.dynamic_params`: Parameters for fetching ids dynamically.
@@ -38,16 +56,26 @@ class FetchIDs:
     #### Notes:
 
         - The class relies on a Config helper (`config.Config`) to supply TMDB endpoint details, keeping secrets out of the source code.
+        - Like the movie details, every request is retried `RETRIES` times with a jittered exponential backoff on errors,
+        non-`200` responses and timeouts, then `FetchIDsError` is raised.
     
     #### Example Usage:
 
         >>> raw_movies = FetchIDs(page=1, start_date="2020-01-01", end_date="2020-12-31", type="movies")
         >>> total_pages = raw_movies.get_total_pages()
         >>> movies = raw_movies.fetch_ids()
+
+    The async methods `get_total_results_async` and `fetch_ids_async` do the same using a shared client::
+
+        >>> async with httpx.AsyncClient() as client:
+        ...     movies = await FetchIDs(page=1, start_date="2020-01-01", end_date="2020-12-31", client=client).fetch_ids_async()
     """
-    def __init__(self, page: int = None, start_date: str = None, end_date: str = None, type:str = "movies"):
+    def __init__(self, page: int = None, start_date: str = None, end_date: str = None, type:str = "movies", client: httpx.AsyncClient = None, controller: ConcurrencyController = None):
         self.type = type
-        self.url, self.headers, self.default_params = CONFIG.get_tmdb_config(endpoint="discover", type=self.type)
+        self.client = client
+        self.controller = controller
+        self.url, self.headers, self.default_params = get_config().get_tmdb_config(endpoint="discover", type=self.type)
+        self.cache_ttl = get_config().get_cache_ttl(endpoint="discover", type=self.type)
         self.page = page
         self.start_date = start_date
         self.end_date = end_date
@@ -101,14 +129,53 @@ class FetchIDs:
             >>> tv_show_ids = FetchIDS(page=1, start_date="2020-01-01", end_date="2020-12-31", type="tv_shows")
             >>> total_pages = tv_show_ids.get_total_pages()
         """
-        url = self.url
-        params = CONFIG.set_tmdb_params(params=self.default_params, **self.total_page_params)
-        response = requests.get(url, params=params)
-        if response.status_code == 200:
-            return response.json().get('total_pages', 1)
-        else:
-            logger.error(f"Failed to fetch total pages: {response.status_code} - {response.text}")
-            raise Exception(f"Failed to fetch total pages: {response.status_code} - {response.text}")
+        return self._get_first_page().get('total_pages', 1)
+
+    def get_total_results(self) -> int:
+        """
+        Get the total number of results for the given date range.
+
+        Returns:
+            int: Total number of results.
+
+        Examples:
+
+            >>> movie_ids = FetchIDs(page=1, start_date="2020-01-01", end_date="2020-01-31")
+            >>> total_results = movie_ids.get_total_results()
+        """
+        return self._get_first_page().get('total_results', 0)
+
+    def _get_first_page(self) -> Dict[str, Any]:
+        return self._get(self.total_page_params, headers=None)
+
+    def _describe(self, params: Dict[str, Any]) -> str:
+        return f"page {params.get('page')} of {self.start_date} to {self.end_date}"
+
+    def _on_failure(self, attempt: int, params: Dict[str, Any], error: Exception) -> float:
+        """
+        Log a failed attempt, raise `FetchIDsError` once the retries are exhausted.
+
+        Returns:
+            float: Seconds to wait before the next attempt.
+        """
+        logger.warning(f"⚠️ Attempt {attempt} failed for {self._describe(params)}: {error}")
+        if attempt == RETRIES:
+            logger.error(f"❌ Giving up after {RETRIES} attempts for {self._describe(params)}")
+            get_metrics().inc("tmdb_give_ups_total", endpoint=get_endpoint_label(self.url), reason="error")
+            raise FetchIDsError(f"Failed to fetch {self._describe(params)}: {error}", response=getattr(error, "response", None)) from error
+        get_metrics().inc("tmdb_retries_total", endpoint=get_endpoint_label(self.url), reason="error")
+        return BACKOFF * 2 ** (attempt - 1) + random.uniform(0, 0.5)
+
+    def _get(self, params: Dict[str, Any], headers: Dict[str, str]) -> Dict[str, Any]:
+        params = get_config().set_tmdb_params(params=self.default_params, **params)
+        for attempt in range(1, RETRIES + 1):
+            try:
+                response = tmdb_get(self.url, limiter=get_config().get_rate_limiter(), cache=get_config().get_response_cache(), ttl=self.cache_ttl, headers=headers, params=params)
+                if response.status_code != 200:
+                    raise FetchIDsError(f"{response.status_code} - {response.text}", response=response)
+                return response.json()
+            except Exception as e:
+                time.sleep(self._on_failure(attempt, params, e))
     
     def fetch_ids(self) -> List[Dict[str, Any]]:
         """
@@ -125,11 +192,46 @@ class FetchIDs:
             >>> tv_show_ids = FetchIDS(page=1, start_date="2020-01-01", end_date="2020-12-31", type="tv_shows")
             >>> ids = tv_show_ids.fetch_ids()
         """
-        url = self.url
-        params = CONFIG.set_tmdb_params(params=self.default_params, **self.dynamic_params)
-        response = requests.get(url, headers=self.headers, params=params)
-        if response.status_code == 200:
-            return response.json().get('results', [])
-        else:
-            logger.error(f"Failed to fetch data: {response.status_code} - {response.text}")
-            raise Exception(f"Failed to fetch data: {response.status_code} - {response.text}")
\ No newline at end of file
+        return self._get(self.dynamic_params, headers=self.headers).get('results', [])
+
+    async def _get_async(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        params = get_config().set_tmdb_params(params=self.default_params, **params)
+        for attempt in range(1, RETRIES + 1):
+            try:
+                # 429s are retried by the shared rate limiter as per the Retry-After of TMDB
+                response = await tmdb_get_async(self.client, self.url, limiter=get_config().get_rate_limiter(), cache=get_config().get_response_cache(), ttl=self.cache_ttl, headers=self.headers, params=params, controller=self.controller)
+                if response.status_code != 200:
+                    raise FetchIDsError(f"{response.status_code} - {response.text}", response=response)
+                return response.json()
+            except Exception as e:
+                await asyncio.sleep(self._on_failure(attempt, params, e))
+
+    async def get_total_results_async(self) -> int:
+        """
+        Get the total number of results for the given date range using the shared async client.
+
+        Returns:
+            int: Total number of results.
+        """
+        data = await self.get_first_page_async()
+        return data.get('total_results', 0)
+
+    async def get_first_page_async(self) -> Dict[str, Any]:
+        """
+        Get the first page of the given date range using the shared async client,
+        its `total_results` along with the `results` of page 1.
+
+        Returns:
+            Dict[str, Any]: The first discover page.
+        """
+        return await self._get_async(self.total_page_params)
+
+    async def fetch_ids_async(self) -> List[Dict[str, Any]]:
+        """
+        Fetch ids from TMDB using the shared async client.
+
+        Returns:
+            List[Dict[str, Any]]: List of ids having metadata.
+        """
+        data = await self._get_async(self.dynamic_params)
+        return data.get('results', [])
@@ -7,78 +7,173 @@ This file will use the methods of `MovieIDs` class from the `movie_ids` module.
 
 # external imports
 import time
-from typing import List, Tuple
-from concurrent.futures import ThreadPoolExecutor
+import httpx
+import asyncio
+from typing import Dict, List, Optional, Tuple
 
 # local imports
 from .fetch_ids import FetchIDs
-from ...base_log import Logger 
+from .date_partitioner import DatePartitioner
+from ..utils.id_set import IDSet
+from ..utils.concurrency import ConcurrencyController
+from ..utils.metrics import get_metrics
+from ..utils.progress_store import ProgressStore
+from ..utils.dead_letters import DeadLetterStore, get_cause
+from ...base_log import Logger, ProgressLogger
 
 logger = Logger('run_fetch_ids').get_logger()
+progress = ProgressLogger(logger, "Fetched {count} pages of ids")
 
 class RunFetchIDs:
-    def __init__(self, year:int, type:str = "movies") -> None:
+    """
+    This class fetches the ids for a whole year.
+    The pages of all the date ranges are scheduled together on a single pooled `httpx.AsyncClient`,
+    the number of requests in flight is bounded by `max_concurrency`.
+
+    When a `ProgressStore` is given, the work units and every completed page are checkpointed,
+    a rerun of the same year only fetches the pages which are missing.
+
+    The pages the partitioning probes already fetched (see `DatePartitioner.probed_pages`) are taken
+    as completed, hence the page 1 of a work unit is not requested twice.
+
+    When a `ConcurrencyController` is given, it replaces the fixed `max_concurrency`,
+    the number of pages in flight then adapts to the latency and the errors of TMDB.
+
+    When a `DeadLetterStore` is given, the pages which fail are recorded in it with their cause,
+    `fetch_pages_async` re-drives them from the retry sweep.
+
+    The ids are collected into an `IDSet` as the pages arrive, hence the result is sorted and deduplicated
+    (the same movie may show up on several pages while TMDB reorders the results).
+
+    #### Example Usage:
+
+        >>> obj = RunFetchIDs(year=2024, type="movies", max_concurrency=10)
+        >>> ids = obj.fetch_yearly_data()
+        >>> ids, fetched = asyncio.run(obj.fetch_pages_async([("2024-01-01", "2024-01-31", 7)]))
+    """
+    def __init__(self, year:int, type:str = "movies", max_pages:int = 500, target_pages:int = 50, max_concurrency:int = 10, progress_store: ProgressStore = None, controller: ConcurrencyController = None, dead_letters: DeadLetterStore = None) -> None:
         self.type = type
         self.year = year
-        self.date_ranges = self._get_date_ranges()
+        self.max_pages = max_pages
+        self.target_pages = target_pages
+        self.max_concurrency = max_concurrency
+        self.progress_store = progress_store
+        self.controller = controller
+        self.dead_letters = dead_letters
+        self.date_ranges = None
+        self.probed_pages: Dict[Tuple[str, str, int], List[int]] = {}
     
-    def _get_date_ranges(self) -> List[Tuple[str, str]]:
-        year = self.year
-        date_ranges = [
-            (f"{year}-01-01", f"{year}-01-31"),
-            (f"{year}-02-01", f"{year}-02-28"),
-            (f"{year}-03-01", f"{year}-03-31"),
-            (f"{year}-04-01", f"{year}-04-30"),
-            (f"{year}-05-01", f"{year}-05-31"),
-            (f"{year}-06-01", f"{year}-06-30"),
-            (f"{year}-07-01", f"{year}-07-31"),
-            (f"{year}-08-01", f"{year}-08-31"),
-            (f"{year}-09-01", f"{year}-09-30"),
-            (f"{year}-10-01", f"{year}-10-31"),
-            (f"{year}-11-01", f"{year}-11-30"),
-            (f"{year}-12-01", f"{year}-12-31")
-        ]
+    async def _get_date_ranges(self, client: httpx.AsyncClient) -> List[Tuple[str, str, int]]:
+        """
+        Partition the year into balanced date ranges, each having at most `max_pages` pages.
+        """
+        if self.progress_store:
+            date_ranges = await asyncio.to_thread(self.progress_store.get_work_units, self.year, self.type)
+            if date_ranges:
+                logger.info(f"Resuming {len(date_ranges)} work units of year {self.year} from the progress store")
+                return date_ranges
+
+        partitioner = DatePartitioner(year=self.year, type=self.type, max_pages=self.max_pages, target_pages=self.target_pages, client=client)
+        date_ranges = await partitioner.get_work_units()
+        self.probed_pages = partitioner.probed_pages
+        if self.progress_store:
+            await asyncio.to_thread(self.progress_store.save_work_units, self.year, self.type, date_ranges)
+            await asyncio.to_thread(self.progress_store.mark_pages_completed, self.year, self.type, self.probed_pages)
         return date_ranges
 
+    async def _fetch_page(self, page: int, start_date: str, end_date: str, client: httpx.AsyncClient, semaphore: asyncio.Semaphore) -> Optional[List[int]]:
+        waiting = time.perf_counter()
+        async with self.controller.slot() if self.controller else semaphore:
+            get_metrics().observe("semaphore_wait_seconds", time.perf_counter() - waiting, stage="ids")
+            try:
+                results = await FetchIDs(page=page, start_date=start_date, end_date=end_date, type=self.type, client=client, controller=self.controller).fetch_ids_async()
+                ids = [data.get("id") for data in results]
+                progress.update()
+                get_metrics().inc("items_total", len(ids), stage="ids")
+                error = None
+            except Exception as e:
+                logger.error(f"Error on page {page} of {start_date} to {end_date} fetching ids: {e}")
+                error = e
+        # checkpointed or recorded once the slot is released, from a worker thread
+        if error is None:
+            if self.progress_store:
+                await asyncio.to_thread(self.progress_store.mark_page_completed, self.year, self.type, start_date, end_date, page, ids)
+            return ids
+        if self.dead_letters is not None:
+            await asyncio.to_thread(self._record_failure, page, start_date, end_date, error)
+        return None
+
+    def _record_failure(self, page: int, start_date: str, end_date: str, error: Exception) -> None:
+        cause, status_code = get_cause(error)
+        payload = {"type": self.type, "start_date": start_date, "end_date": end_date, "page": page}
+        self.dead_letters.add("page", f"{self.year}:{self.type}:{start_date}:{end_date}:{page}", payload, cause=cause, year=self.year, status_code=status_code)
+
+    def _get_client(self) -> httpx.AsyncClient:
+        max_connections = self.controller.max_limit if self.controller else self.max_concurrency
+        limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        return httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(30.0, pool=None))
+
+    async def fetch_yearly_data_async(self) -> IDSet:
+        """
+        Fetch ids for all the date ranges of the year concurrently.
+
+        Returns:
+            IDSet: The sorted, deduplicated ids of the year.
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self._get_client() as client:
+            # partitioning probes TMDB, hence it is done lazily on the first run
+            if self.date_ranges is None:
+                self.date_ranges = await self._get_date_ranges(client)
+
+            completed = await asyncio.to_thread(self.progress_store.get_completed_pages, self.year, self.type) if self.progress_store else {}
+            completed = {**self.probed_pages, **completed}
+
+            ids = IDSet()
+            tasks = []
+            skipped = 0
+            for start_date, end_date, total_pages in self.date_ranges:
+                logger.info(f"Fetching ids from {start_date} to {end_date}, total pages to fetch: {total_pages}")
+                for page in range(1, total_pages + 1):
+                    key = (start_date, end_date, page)
+                    if key in completed:
+                        ids.update(completed.pop(key))
+                        skipped += 1
+                    else:
+                        tasks.append(self._collect_page(ids, page, start_date, end_date, client, semaphore))
+            if skipped:
+                logger.info(f"Skipping {skipped} pages completed on earlier runs or by the partitioning probes")
+
+            await asyncio.gather(*tasks)
+            progress.flush()
+
+        logger.info(f"Collected {len(ids)} unique ids of year {self.year} ({ids.nbytes / 1024 ** 2:.1f} MB)")
+        return ids
+
+    async def _collect_page(self, ids: IDSet, page: int, start_date: str, end_date: str, client: httpx.AsyncClient, semaphore: asyncio.Semaphore) -> None:
+        ids.update(await self._fetch_page(page, start_date, end_date, client, semaphore) or [])
+
+    async def fetch_pages_async(self, pages: List[Tuple[str, str, int]]) -> Tuple[IDSet, List[Tuple[str, str, int]]]:
+        """
+        Fetch the given `(start_date, end_date, page)` of the year, e.g. the failed pages re-driven by the retry sweep.
+
+        Returns:
+            Tuple[IDSet, List[Tuple[str, str, int]]]: The ids of the pages fetched, and which of the pages were fetched.
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self._get_client() as client:
+            results = await asyncio.gather(*[self._fetch_page(page, start_date, end_date, client, semaphore) for start_date, end_date, page in pages])
+        progress.flush()
+        ids = IDSet()
+        for page_ids in results:
+            ids.update(page_ids or [])
+        return ids, [page for page, page_ids in zip(pages, results) if page_ids is not None]
 
-    def fetch_yearly_data(self) -> List:
+    def fetch_yearly_data(self) -> IDSet:
         """
         Fetch ids for multiple date ranges.
         """
-        all_ids = []
-        for start_date, end_date in self.date_ranges:
-            logger.info(f"Fetching ids from {start_date} to {end_date}")
-            obj = FetchIDs(start_date=start_date, end_date=end_date, type=self.type)
-
-            # Step-1: Fetch total pages
-            total_pages = obj.get_total_pages()
-            
-            if total_pages >= 500:
-                logger.error(f"Total pages {total_pages} exceeds the limit of 500. Skipping Date Range: {start_date} to {end_date}")
-                continue
-            logger.info(f"Total pages to fetch: {total_pages}")
-            
-            # Step-2: Fetch ids
-            with ThreadPoolExecutor(max_workers=10) as executor:
-                futures = [executor.submit(FetchIDs(page=page, start_date=start_date, end_date=end_date, type=self.type).fetch_ids) for page in range(1, total_pages + 1)]
-                count = 0
-                for future in futures:
-                    try:
-                        ids = future.result()
-                        all_ids.extend(ids)
-                        time.sleep(0.5)
-                        count += 1  # Sleep to avoid hitting API rate limits
-                        logger.info(f"Fetched {len(ids)} ids on page {count}")
-                    except Exception as e:
-                        count += 1
-                        logger.error(f"Error on page {count} fetching ids: {e}")
-            
-        if all_ids:
-            ids_list = []
-            for data in all_ids:
-                id = data.get("id")
-                ids_list.append(id)
-        return ids_list
+        return asyncio.run(self.fetch_yearly_data_async())
 
 
 
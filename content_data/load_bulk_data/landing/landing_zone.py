@@ -0,0 +1,190 @@
+"""
+This file contains the landing zone of the raw movie payloads fetched from TMDB.
+
+Every fetched movie (as returned by `MovieDetails.get_complied_data`, fetched without projection) is appended
+as one JSON line to compressed NDJSON chunks, partitioned by year:
+
+    tmdb_landing/
+        year=2024/
+            movies-20240601T020000-00000.ndjson.gz
+            movies-20240601T020000-00001.ndjson.gz
+        year=unknown/    # movies without a release date, landed without a year
+
+Every `write` appends its movies as a complete gzip member (or zstd frame) and closes the file,
+hence what was written survives a crash of the run, and a chunk is rotated after `chunk_size` movies.
+The replay (`landing/run_replay.py`) streams the chunks back through the projection and the loads
+without calling TMDB, e.g. to re-apply a schema change or a loader fix at disk speed.
+"""
+
+# external imports
+import os
+import io
+import gzip
+import json
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+# local imports
+from ..load_mongo.mongo_loader import get_release_year
+from ..load_mongo.projection import loads
+from ..utils.metrics import get_metrics
+from ...base_log import Logger
+
+try:
+    import orjson
+    dumps: Callable[[Any], bytes] = orjson.dumps
+except ImportError:
+    dumps = lambda obj: json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = Logger('landing_zone').get_logger()
+
+content_data_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+DEFAULT_DIR = os.path.join(content_data_dir, "tmdb_landing")
+EXTENSIONS = {"gzip": ".ndjson.gz", "zstd": ".ndjson.zst"}
+UNKNOWN_YEAR = "unknown"
+# raised by a member (or frame) cut short by a crash
+READ_ERRORS = (EOFError, ValueError, gzip.BadGzipFile) + ((zstandard.ZstdError,) if zstandard else ())
+
+
+class LandingZone:
+    """
+    This class appends the raw fetched movies to compressed NDJSON chunks partitioned by year, and reads them back.
+    It sets configurations as follows:
+
+        - `self.root`: Directory of the landing zone. Defaults to `content_data/tmdb_landing`.
+        - `self.compression`: `gzip` or `zstd` (needs `pip install zstandard`). Defaults to `gzip`.
+        - `self.chunk_size`: Number of movies per chunk before a new chunk is started. Defaults to `10000`.
+
+    #### Notes:
+        - The chunks of a run are named after the time the run started, hence reading the chunks of a year
+        in name order replays its movies in the order they were fetched, the latest copy of a movie last.
+        - Chunks of both compressions may sit in the same partition, each is read as per its extension.
+        - Writes may come from several threads, they are serialized by a lock.
+
+    #### Example Usage:
+
+        >>> landing = LandingZone(compression="zstd", chunk_size=10_000)
+        >>> landing.write(movies, year=2024)
+        >>> for batch in landing.read_batches(2024, batch_size=500):
+        ...     loader.load_movies([project_movie(movie) for movie in batch], 2024)
+    """
+    def __init__(self, root: str = DEFAULT_DIR, compression: str = "gzip", chunk_size: int = 10_000) -> None:
+        if compression not in EXTENSIONS:
+            raise ValueError(f"Unknown compression {compression}, use one of {', '.join(EXTENSIONS)}.")
+        if compression == "zstd" and zstandard is None:
+            raise ImportError("The zstd landing zone needs zstandard, install it with `pip install zstandard`.")
+        self.root = Path(root)
+        self.compression = compression
+        self.chunk_size = chunk_size
+        self.run_id = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+        self._lock = threading.Lock()
+        # partition -> (index of the open chunk, movies written into it)
+        self._chunks: Dict[str, List[int]] = {}
+
+    @staticmethod
+    def _get_partition(year: Optional[int]) -> str:
+        return f"year={UNKNOWN_YEAR if year is None else year}"
+
+    def _get_chunk(self, partition: str, movies: int) -> Path:
+        chunk = self._chunks.setdefault(partition, [0, 0])
+        if chunk[1] and chunk[1] + movies > self.chunk_size:
+            chunk[0] += 1
+            chunk[1] = 0
+        chunk[1] += movies
+        directory = self.root / partition
+        directory.mkdir(parents=True, exist_ok=True)
+        return directory / f"movies-{self.run_id}-{chunk[0]:05d}{EXTENSIONS[self.compression]}"
+
+    def _compress(self, data: bytes) -> bytes:
+        if self.compression == "zstd":
+            return zstandard.ZstdCompressor(level=3).compress(data)
+        return gzip.compress(data, compresslevel=6)
+
+    def write(self, movies: List[Optional[Dict[str, Any]]], year: int = None) -> int:
+        """
+        Append the movies to the chunks of their year. Without a `year` each movie lands in the year of its release date.
+
+        Returns:
+            int: Number of movies written.
+        """
+        partitions: Dict[str, List[bytes]] = {}
+        for movie in movies:
+            if not movie:
+                continue
+            movie_year = year if year is not None else get_release_year(movie.get("details") or {})
+            partitions.setdefault(self._get_partition(movie_year), []).append(dumps(movie) + b"\n")
+
+        written = 0
+        for partition, lines in partitions.items():
+            data = self._compress(b"".join(lines))
+            with self._lock:
+                # a complete member (or frame) per write, chunks holding several of them are still valid files
+                with open(self._get_chunk(partition, len(lines)), "ab") as f:
+                    f.write(data)
+            written += len(lines)
+            get_metrics().inc("landing_bytes_written_total", len(data), compression=self.compression)
+            get_metrics().inc("landing_movies_written_total", len(lines))
+        return written
+
+    def get_years(self) -> List[Optional[int]]:
+        """
+        Get the years of the partitions of the landing zone, `None` for the movies landed without a year.
+        """
+        if not self.root.exists():
+            return []
+        years = []
+        for directory in sorted(self.root.glob("year=*")):
+            value = directory.name.split("=", 1)[1]
+            years.append(None if value == UNKNOWN_YEAR else int(value))
+        return sorted(years, key=lambda year: (year is None, year))
+
+    def get_chunks(self, year: Optional[int]) -> List[Path]:
+        """
+        Get the chunks of a year, in the order they were written.
+        """
+        directory = self.root / self._get_partition(year)
+        return sorted(path for path in directory.glob("movies-*") if any(path.name.endswith(ext) for ext in EXTENSIONS.values()))
+
+    @staticmethod
+    def _open(path: Path) -> io.BufferedIOBase:
+        if path.name.endswith(EXTENSIONS["zstd"]):
+            if zstandard is None:
+                raise ImportError("Reading zstd chunks needs zstandard, install it with `pip install zstandard`.")
+            return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), read_across_frames=True, closefd=True))
+        return gzip.open(path, "rb")
+
+    def read_chunk(self, path: Path) -> Iterator[Dict[str, Any]]:
+        """
+        Stream the movies of a chunk line by line. A member cut short by a crash ends the chunk with a warning.
+        """
+        with self._open(path) as f:
+            try:
+                for line in f:
+                    if line.strip():
+                        yield loads(line)
+            except READ_ERRORS as e:
+                logger.warning(f"⚠️ {path.name} ends with an incomplete write, the rest of it is skipped: {e}")
+
+    def read(self, year: Optional[int]) -> Iterator[Dict[str, Any]]:
+        """
+        Stream the movies landed for a year, chunk after chunk.
+        """
+        for path in self.get_chunks(year):
+            yield from self.read_chunk(path)
+
+    def read_batches(self, year: Optional[int], batch_size: int = 500) -> Iterator[List[Dict[str, Any]]]:
+        batch = []
+        for movie in self.read(year):
+            batch.append(movie)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
@@ -0,0 +1,73 @@
+"""
+This file contains the replay of the landing zone into MongoDB.
+
+The raw movies landed by the pipelines are streamed back chunk by chunk, projected as per the current
+`PROJECTIONS` and loaded by the `MongoLoader` in batches, without a single request to TMDB.
+Hence a change of the schema, of the projection or of the loader is re-applied to whole years at disk speed.
+"""
+
+# external imports
+import time
+from typing import Dict, List, Optional
+
+# local imports
+from .landing_zone import LandingZone
+from ..load_mongo.mongo_loader import MongoLoader
+from ..load_mongo.projection import project_movie
+from ..utils.metrics import get_metrics
+from ...base_log import Logger
+
+logger = Logger('run_replay').get_logger()
+
+
+class RunReplay:
+    """
+    This class loads the movies of the landing zone into MongoDB.
+    It sets configurations as follows:
+
+        - `self.loader`: `MongoLoader` the movies are loaded with.
+        - `self.landing`: `LandingZone` to replay. Defaults to the landing zone of `content_data/tmdb_landing`.
+        - `self.years`: Years to replay, `None` in the list for the movies landed without a year. Defaults to every year landed.
+        - `self.batch_size`: Number of movies loaded at once. Defaults to `500`.
+
+    #### Notes:
+        - Only a batch of movies is held in memory at a time, the chunks are decompressed as they are read.
+        - A movie landed several times is loaded once per copy, the upserts keep the latest one.
+        - The movies landed without a year are loaded with the year of their release date.
+
+    #### Example Usage:
+
+        >>> obj = RunReplay(loader=MongoLoader(db=config.get_mongo_db()), years=[2023, 2024])
+        >>> report = obj.run()
+        {2023: 9871, 2024: 9135}
+    """
+    def __init__(self, loader: MongoLoader, landing: LandingZone = None, years: List[Optional[int]] = None, batch_size: int = 500) -> None:
+        self.loader = loader
+        self.landing = landing or LandingZone()
+        self.years = years
+        self.batch_size = batch_size
+
+    def replay_year(self, year: Optional[int]) -> int:
+        """
+        Load the movies landed for a year.
+
+        Returns:
+            int: Number of movies loaded.
+        """
+        loaded = 0
+        start = time.perf_counter()
+        for batch in self.landing.read_batches(year, self.batch_size):
+            loaded += self.loader.load_movies([project_movie(movie) for movie in batch], year)
+            get_metrics().inc("items_total", len(batch), stage="replay")
+        logger.info(f"Replayed {loaded} movies of year {year if year is not None else 'unknown'} in {time.perf_counter() - start:.1f}s")
+        return loaded
+
+    def run(self) -> Dict[Optional[int], int]:
+        """
+        Replay every selected year.
+
+        Returns:
+            Dict[Optional[int], int]: Number of movies loaded per year.
+        """
+        years = self.landing.get_years() if self.years is None else self.years
+        return {year: self.replay_year(year) for year in years}
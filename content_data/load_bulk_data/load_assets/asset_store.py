@@ -0,0 +1,176 @@
+"""
+This file contains the content-addressed local store of the TMDB images (posters, backdrops and logos).
+
+Every downloaded file is stored once under the SHA-256 of its bytes (`objects/<2 hex>/<62 hex><ext>`),
+hence the same image reached from several paths or sizes takes the space of a single file.
+A SQLite index maps every `(size, file_path)` of TMDB to the digest of its file, it records the completed
+downloads so reruns skip them, and it is what the frontend looks a path up in to serve it locally.
+"""
+
+# external imports
+import os
+import sqlite3
+import hashlib
+import tempfile
+import threading
+from pathlib import Path
+from typing import BinaryIO, Iterable, Optional, Set, Tuple
+
+# local imports
+from ...base_log import Logger
+
+logger = Logger('asset_store').get_logger()
+
+content_data_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+DEFAULT_DIR = os.path.join(content_data_dir, "tmdb_assets")
+# paths looked up per query, below the variable limit of SQLite
+CHUNK_SIZE = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS assets (
+    size TEXT NOT NULL,
+    file_path TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    bytes INTEGER NOT NULL,
+    content_type TEXT,
+    downloaded_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (size, file_path)
+);
+CREATE INDEX IF NOT EXISTS assets_digest ON assets (digest);
+"""
+
+
+class PendingAsset:
+    """
+    A file being written into the store, hashed chunk by chunk as it is written to a temporary file.
+    It is moved to its content address by :meth:`AssetStore.commit`, or thrown away by :meth:`discard`.
+    """
+    def __init__(self, directory: str, ext: str) -> None:
+        fd, self.path = tempfile.mkstemp(dir=directory, suffix=".part")
+        self.file: BinaryIO = os.fdopen(fd, "wb")
+        self.ext = ext
+        self.bytes = 0
+        self._hash = hashlib.sha256()
+
+    def write(self, chunk: bytes) -> None:
+        self._hash.update(chunk)
+        self.file.write(chunk)
+        self.bytes += len(chunk)
+
+    @property
+    def digest(self) -> str:
+        return self._hash.hexdigest()
+
+    def discard(self) -> None:
+        if not self.file.closed:
+            self.file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class AssetStore:
+    """
+    This class stores the TMDB images on the local disk, addressed by their content.
+    It sets configurations as follows:
+
+        - `self.root`: Directory of the store. Defaults to `content_data/tmdb_assets`.
+        - `self.index_path`: SQLite index of the stored `(size, file_path)`, `<root>/assets.sqlite3`.
+
+    #### Notes:
+        - The files are first written to `<root>/tmp` and moved to their address once complete,
+        hence a crashed download never leaves a partial file behind a digest.
+        - The same store is shared by the event loop and the worker threads, a single connection is guarded by a lock.
+
+    #### Example Usage:
+
+        >>> store = AssetStore()
+        >>> pending = store.open("/kqjL17yufvn9OVLyXYpvtyrFfak.jpg")
+        >>> pending.write(chunk)
+        >>> store.commit("w500", "/kqjL17yufvn9OVLyXYpvtyrFfak.jpg", pending, content_type="image/jpeg")
+        >>> store.get_path("w500", "/kqjL17yufvn9OVLyXYpvtyrFfak.jpg")
+        '.../tmdb_assets/objects/3f/...jpg'
+    """
+    def __init__(self, root: str = DEFAULT_DIR) -> None:
+        self.root = root
+        self.index_path = os.path.join(root, "assets.sqlite3")
+        Path(root, "objects").mkdir(parents=True, exist_ok=True)
+        Path(root, "tmp").mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.index_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def _get_object_path(self, digest: str, ext: str) -> str:
+        return os.path.join(self.root, "objects", digest[:2], f"{digest[2:]}{ext}")
+
+    def get_completed(self, assets: Iterable[Tuple[str, str]]) -> Set[Tuple[str, str]]:
+        """
+        Get which of the `(size, file_path)` are already stored.
+        """
+        assets = set(assets)
+        file_paths = list({file_path for _, file_path in assets})
+        stored = set()
+        with self._lock:
+            for start in range(0, len(file_paths), CHUNK_SIZE):
+                chunk = file_paths[start:start + CHUNK_SIZE]
+                rows = self._conn.execute(f"SELECT size, file_path FROM assets WHERE file_path IN ({','.join('?' * len(chunk))})", chunk).fetchall()
+                stored.update(tuple(row) for row in rows)
+        return assets & stored
+
+    def get_path(self, size: str, file_path: str) -> Optional[str]:
+        """
+        Get the local file of a TMDB image, `None` if it is not stored.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT digest FROM assets WHERE size = ? AND file_path = ?", (size, file_path)).fetchone()
+        if row is None:
+            return None
+        return self._get_object_path(row[0], os.path.splitext(file_path)[1])
+
+    def open(self, file_path: str) -> PendingAsset:
+        """
+        Start writing the file of a TMDB image, see :class:`PendingAsset`.
+        """
+        return PendingAsset(os.path.join(self.root, "tmp"), os.path.splitext(file_path)[1])
+
+    def commit(self, size: str, file_path: str, pending: PendingAsset, content_type: str = None) -> str:
+        """
+        Move a completely written file to its content address and record it in the index.
+        A file whose content is already stored is dropped, the path then points to the existing copy.
+
+        Returns:
+            str: The local path of the file.
+        """
+        pending.file.flush()
+        os.fsync(pending.file.fileno())
+        pending.file.close()
+        digest = pending.digest
+        path = self._get_object_path(digest, pending.ext)
+        if os.path.exists(path):
+            os.remove(pending.path)
+        else:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            os.replace(pending.path, path)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO assets (size, file_path, digest, bytes, content_type) VALUES (?, ?, ?, ?, ?)",
+                (size, file_path, digest, pending.bytes, content_type),
+            )
+            self._conn.commit()
+        return path
+
+    def get_stats(self) -> Tuple[int, int, int]:
+        """
+        Returns:
+            Tuple[int, int, int]: Number of `(size, file_path)` stored, number of distinct files and their total bytes.
+        """
+        with self._lock:
+            paths, = self._conn.execute("SELECT COUNT(*) FROM assets").fetchone()
+            files, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM (SELECT digest, MAX(bytes) AS bytes FROM assets GROUP BY digest)").fetchone()
+        return paths, files, total
@@ -0,0 +1,217 @@
+"""
+This file contains the functionality to download the posters, backdrops and logos of the loaded movies
+from the image CDN of TMDB into the local `AssetStore`, as the asset stage of the pipeline.
+
+It contains global constants:
+    - `DEFAULT_SIZES`: The sizes downloaded for every kind of image.
+"""
+
+# external imports
+import time
+import httpx
+import random
+import asyncio
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from pymongo.database import Database
+
+# local imports
+from .asset_store import AssetStore
+from ..config.config import get_config
+from ..utils.metrics import get_metrics
+from ..utils.concurrency import ConcurrencyController
+from ...base_log import Logger, ProgressLogger
+
+logger = Logger('run_assets').get_logger()
+progress = ProgressLogger(logger, "✅ Successfully downloaded {count} images")
+
+# kind of image -> sizes of the image CDN to download (see the `/configuration` endpoint of TMDB for the available sizes)
+DEFAULT_SIZES = {
+    "poster": ["w342"],
+    "backdrop": ["w780"],
+    "logo": ["w185"],
+}
+# bytes read from the response at once
+CHUNK_SIZE = 64 * 1024
+# bytes buffered before they are written to disk from a worker thread
+FLUSH_SIZE = 1024 * 1024
+
+
+class RunAssets:
+    """
+    This class downloads the images of the movies loaded into MongoDB.
+    It sets configurations as follows:
+
+        - `self.db`: MongoDB database holding the `movies` (and `images`) collections.
+        - `self.store`: `AssetStore` to download into. Defaults to `get_config().get_asset_store()`.
+        - `self.sizes`: Sizes to download per kind of image (`poster`, `backdrop`, `logo`). Defaults to `DEFAULT_SIZES`.
+        - `self.year`: Only the movies of this release year, all of them if `None`.
+        - `self.include_images`: Whether every poster, backdrop and logo of the `images` collection is downloaded,
+        else only the `poster_path` and `backdrop_path` of the `movies`. Defaults to `False`.
+        - `self.max_concurrency`: Number of downloads in flight. Defaults to `10`.
+        - `self.controller`: Optional `ConcurrencyController` replacing `max_concurrency`.
+
+    #### Notes:
+        - The paths are deduplicated before downloading, and the ones already in the store are skipped,
+        hence rerunning the stage only downloads the new images.
+        - Every response is streamed to disk while it is hashed, at most `FLUSH_SIZE` of it is held in memory.
+        The files are opened, written and committed from worker threads, and the store is read from one,
+        hence the disk never holds up the downloads in flight.
+        - The image CDN is not the API, hence the downloads don't take tokens from the rate limiter of TMDB.
+
+    #### Example Usage:
+
+        >>> obj = RunAssets(db=config.get_mongo_db(), year=2024, sizes={"poster": ["w342", "w500"], "backdrop": ["w780"]})
+        >>> report = obj.run()
+        >>> get_config().get_asset_store().get_path("w342", "/kqjL17yufvn9OVLyXYpvtyrFfak.jpg")
+    """
+    def __init__(self, db: Database, store: AssetStore = None, sizes: Dict[str, List[str]] = None, year: int = None, include_images: bool = False, max_concurrency: int = 10, controller: ConcurrencyController = None) -> None:
+        self.db = db
+        self.store = store or get_config().get_asset_store()
+        self.sizes = sizes or DEFAULT_SIZES
+        self.year = year
+        self.include_images = include_images
+        self.controller = controller
+        self.max_concurrency = controller.max_limit if controller else max_concurrency
+        self.semaphore = asyncio.Semaphore(max_concurrency) if controller is None else None
+        self.base_url = get_config().tmdb_image_base_url
+
+    def _get_file_paths(self) -> Iterable[Tuple[str, str]]:
+        """
+        Yield the `(kind, file_path)` of the images of the selected movies.
+        """
+        query = {"release_year": self.year} if self.year is not None else {}
+        movie_ids = []
+        for movie in self.db["movies"].find(query, {"id": 1, "poster_path": 1, "backdrop_path": 1, "_id": 0}):
+            movie_ids.append(movie["id"])
+            yield "poster", movie.get("poster_path")
+            yield "backdrop", movie.get("backdrop_path")
+
+        if self.include_images:
+            images_query = {"movie_id": {"$in": movie_ids}} if self.year is not None else {}
+            projection = {"posters.file_path": 1, "backdrops.file_path": 1, "logos.file_path": 1, "_id": 0}
+            for doc in self.db["images"].find(images_query, projection):
+                for kind in ("poster", "backdrop", "logo"):
+                    for image in doc.get(f"{kind}s") or []:
+                        yield kind, image.get("file_path")
+
+    def get_assets(self) -> List[Tuple[str, str]]:
+        """
+        Get the `(size, file_path)` to download, deduplicated, in the order they were found.
+        """
+        assets = {}
+        for kind, file_path in self._get_file_paths():
+            if not file_path:
+                continue
+            for size in self.sizes.get(kind, []):
+                assets[(size, file_path)] = None
+        return list(assets)
+
+    def _get_client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            timeout=httpx.Timeout(30.0, pool=None),
+            limits=httpx.Limits(max_connections=self.max_concurrency, max_keepalive_connections=self.max_concurrency),
+            follow_redirects=True,
+        )
+
+    async def _stream_to_store(self, size: str, file_path: str, client: httpx.AsyncClient) -> int:
+        """
+        Stream an image into the store.
+
+        Returns:
+            int: Bytes downloaded.
+
+        Raises:
+            httpx.HTTPStatusError: When the CDN does not answer with a `200`.
+        """
+        start = time.perf_counter()
+        pending = None
+        try:
+            async with client.stream("GET", f"{self.base_url}/{size}{file_path}") as response:
+                if self.controller is not None:
+                    self.controller.record(time.perf_counter() - start, congested=response.status_code == 429 or response.status_code >= 500)
+                response.raise_for_status()
+                pending = await asyncio.to_thread(self.store.open, file_path)
+                buffer, buffered = [], 0
+                async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                    buffer.append(chunk)
+                    buffered += len(chunk)
+                    if buffered >= FLUSH_SIZE:
+                        await asyncio.to_thread(pending.write, b"".join(buffer))
+                        buffer, buffered = [], 0
+                if buffer:
+                    await asyncio.to_thread(pending.write, b"".join(buffer))
+            # the file is fsynced before it is moved to its address, off the event loop
+            await asyncio.to_thread(self.store.commit, size, file_path, pending, response.headers.get("Content-Type"))
+        except httpx.TimeoutException:
+            if self.controller is not None:
+                self.controller.record(time.perf_counter() - start, congested=True)
+            raise
+        finally:
+            if pending is not None:
+                await asyncio.to_thread(pending.discard)
+        get_metrics().observe("asset_download_seconds", time.perf_counter() - start, size=size)
+        return pending.bytes
+
+    async def _download(self, size: str, file_path: str, client: httpx.AsyncClient) -> Optional[int]:
+        retries = 3
+        backoff = 1
+
+        for attempt in range(1, retries + 1):
+            waiting = time.perf_counter()
+            try:
+                async with self.controller.slot() if self.controller else self.semaphore:
+                    get_metrics().observe("semaphore_wait_seconds", time.perf_counter() - waiting, stage="assets")
+                    downloaded = await self._stream_to_store(size, file_path, client)
+                progress.update()
+                get_metrics().inc("assets_downloaded_total", size=size)
+                get_metrics().inc("asset_bytes_total", downloaded, size=size)
+                return downloaded
+
+            except Exception as e:
+                # a missing image is not coming back on a retry
+                if isinstance(e, httpx.HTTPStatusError) and e.response.status_code == 404:
+                    logger.warning(f"⚠️ Image {size}{file_path} not found on the CDN")
+                    get_metrics().inc("asset_give_ups_total", size=size, reason="not_found")
+                    return None
+                logger.warning(f"⚠️ Attempt {attempt} failed for image {size}{file_path}: {e}")
+                if attempt == retries:
+                    logger.error(f"❌ Giving up after {retries} attempts for image {size}{file_path}")
+                    get_metrics().inc("asset_give_ups_total", size=size, reason="error")
+                    return None
+                await asyncio.sleep(backoff * 2 ** (attempt - 1) + random.uniform(0, 0.5))
+
+    async def download_all_async(self) -> Dict[str, Any]:
+        """
+        Download the images which are not in the store yet.
+
+        Returns:
+            Dict[str, Any]: Number of images found, skipped (already stored), downloaded and failed, and the bytes downloaded.
+        """
+        assets = await asyncio.to_thread(self.get_assets)
+        completed = await asyncio.to_thread(self.store.get_completed, assets)
+        pending = [asset for asset in assets if asset not in completed]
+        logger.info(f"{len(assets)} images found, {len(completed)} already stored, {len(pending)} to download")
+
+        report = {"images": len(assets), "skipped": len(completed), "downloaded": 0, "failed": 0, "bytes": 0}
+        queue = iter(pending)
+
+        async def worker(client: httpx.AsyncClient) -> None:
+            # all the workers share the same iterator, hence each image is downloaded once
+            for size, file_path in queue:
+                downloaded = await self._download(size, file_path, client)
+                if downloaded is not None:
+                    report["downloaded"] += 1
+                    report["bytes"] += downloaded
+                else:
+                    report["failed"] += 1
+
+        try:
+            async with self._get_client() as client:
+                await asyncio.gather(*[worker(client) for _ in range(min(self.max_concurrency, len(pending)))])
+        finally:
+            progress.flush()
+        logger.info(f"Downloaded {report['downloaded']} images ({report['bytes'] / 1024 ** 2:.1f} MB), {report['failed']} failed")
+        return report
+
+    def run(self) -> Dict[str, Any]:
+        return asyncio.run(self.download_all_async())
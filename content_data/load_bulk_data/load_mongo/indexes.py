@@ -0,0 +1,95 @@
+"""
+This file contains the declared indexes of the content collections and the manager which creates them.
+
+The unique indexes on the TMDB ids are what the upserts of the loaders are keyed on, hence they are created
+before the first load. The read indexes only serve the queries of the frontend, hence they are created
+after the load, so the bulk loads of a backfill don't maintain them document by document.
+"""
+
+# external imports
+from typing import Any, Dict, List, Optional
+from pymongo import ASCENDING, DESCENDING
+from pymongo.database import Database
+from pymongo.errors import OperationFailure
+
+# local imports
+from ...base_log import Logger
+
+logger = Logger('indexes').get_logger()
+
+# collection -> declared indexes, `unique` ones are needed by the loads, the others by the reads
+INDEXES: Dict[str, List[Dict[str, Any]]] = {
+    "movies": [
+        {"keys": [("id", ASCENDING)], "name": "id_unique", "unique": True},
+        {"keys": [("release_year", ASCENDING), ("popularity", DESCENDING)], "name": "release_year_popularity"},
+        {"keys": [("genres.id", ASCENDING), ("popularity", DESCENDING)], "name": "genre_popularity"},
+        {"keys": [("popularity", DESCENDING)], "name": "popularity"},
+    ],
+    "images": [
+        {"keys": [("movie_id", ASCENDING)], "name": "movie_id_unique", "unique": True},
+    ],
+    "videos": [
+        {"keys": [("id", ASCENDING)], "name": "id_unique", "unique": True},
+    ],
+    "people": [
+        {"keys": [("id", ASCENDING)], "name": "id_unique", "unique": True},
+    ],
+    "persons": [
+        {"keys": [("id", ASCENDING)], "name": "id_unique", "unique": True},
+        {"keys": [("movie_ids", ASCENDING)], "name": "movie_ids", "load": True},
+        {"keys": [("popularity", DESCENDING)], "name": "popularity"},
+    ],
+    "top_movies": [
+        {"keys": [("movies.id", ASCENDING)], "name": "movies_id", "load": True},
+    ],
+    "genre_movies": [
+        {"keys": [("movie_ids", ASCENDING)], "name": "movie_ids", "load": True},
+        {"keys": [("genre_id", ASCENDING), ("release_year", ASCENDING)], "name": "genre_id_release_year"},
+    ],
+}
+
+
+class IndexManager:
+    """
+    This class creates the declared `INDEXES` of the content collections, idempotently.
+    It sets configurations as follows:
+
+        - `self.db`: MongoDB database holding the collections.
+
+    #### Notes:
+        - The existing indexes are listed first and only the missing ones are created,
+        hence it is cheap to call after every load.
+        - `load_only=True` only creates the indexes the loads rely on: the unique ones, and the ones
+        the incremental updates find their targets with (marked `load`).
+        - A unique index which cannot be created (duplicate documents) is logged, not raised.
+
+    #### Example Usage:
+
+        >>> manager = IndexManager(db=config.get_mongo_db())
+        >>> manager.ensure_indexes(load_only=True)  # before the first load
+        >>> manager.ensure_indexes()                # after the load
+    """
+    def __init__(self, db: Database) -> None:
+        self.db = db
+
+    def ensure_indexes(self, collections: Optional[List[str]] = None, load_only: bool = False) -> List[str]:
+        """
+        Create the missing declared indexes of the collections, all of them if `None`.
+
+        Returns:
+            List[str]: `<collection>.<index>` of the indexes created.
+        """
+        created = []
+        for collection in collections or INDEXES:
+            existing = self.db[collection].index_information()
+            for index in INDEXES.get(collection, []):
+                if index["name"] in existing or (load_only and not (index.get("unique") or index.get("load"))):
+                    continue
+                try:
+                    self.db[collection].create_index(index["keys"], unique=index.get("unique", False), name=index["name"])
+                    created.append(f"{collection}.{index['name']}")
+                except OperationFailure as e:
+                    logger.error(f"❌ Could not create the index {index['name']} on {collection}, remove the duplicate documents first: {e}")
+        if created:
+            logger.info(f"Created the indexes {', '.join(created)}")
+        return created
@@ -0,0 +1,348 @@
+"""
+This file contains the functionality to load the fetched TMDB data into MongoDB
+as the part of ELT pipeline.
+
+Every collection is loaded with unordered `bulk_write` batches of `ReplaceOne(upsert=True)`
+keyed on the TMDB id, hence reruns and partial reloads never duplicate a document
+and a bad document does not abort the rest of its batch.
+Every document written is stamped with its `updated_at` (on the client, when its batch is built),
+the Parquet export only exports what changed since its last run, up to a lag covering the batches still being written.
+"""
+
+# external imports
+import time
+import asyncio
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from pymongo import ReplaceOne
+from pymongo.database import Database
+from pymongo.errors import BulkWriteError
+
+# local imports
+from .people import PeopleNormalizer, PERSONS_COLLECTION
+from .indexes import IndexManager
+from .read_models import ReadModels
+from ..utils.id_set import IDSet
+from ..utils.metrics import get_metrics, get_written
+from ...base_log import Logger
+
+logger = Logger('mongo_loader').get_logger()
+
+# collection name -> TMDB id the documents are keyed on
+COLLECTION_KEYS = {
+    "movies": "id",
+    "images": "movie_id",
+    "videos": "id",
+    "people": "id",
+    PERSONS_COLLECTION: "id",
+}
+
+DETAIL_KEYS = [
+    'id', 'title', 'adult', 'backdrop_path', 'poster_path',
+    'release_date', 'release_year', 'overview', 'tagline',
+    'runtime', 'genres', 'cast', 'director', 'production_companies',
+    'popularity', 'vote_average', 'vote_count', 'status',
+    'original_language', 'production_countries', 'budget', 'revenue', 'trailer'
+]
+
+TRAILER_LANGUAGE = "en"
+
+
+def select_trailer(videos: Optional[Dict[str, Any]], language: str = TRAILER_LANGUAGE) -> Optional[Dict[str, Any]]:
+    """
+    Select the best trailer of a movie from its videos payload.
+    The trailers are ranked by being official, being in the given language,
+    their size (resolution) and finally being the most recently published.
+
+    Returns:
+        Optional[Dict[str, Any]]: The best trailer, `None` if the movie has no trailer.
+    """
+    trailers = [video for video in (videos or {}).get("results") or [] if video.get("type") == "Trailer"]
+    if not trailers:
+        return None
+    return max(trailers, key=lambda video: (
+        bool(video.get("official")),
+        video.get("iso_639_1") == language,
+        video.get("size") or 0,
+        video.get("published_at") or "",
+    ))
+
+
+def get_release_year(detail: Dict[str, Any]) -> Optional[int]:
+    release_date = detail.get("release_date") or ""
+    return int(release_date[:4]) if release_date[:4].isdigit() else None
+
+
+class MongoLoader:
+    """
+    This class contains the methods to load movie details, images, videos and credits into MongoDB.
+    It sets configurations as follows:
+
+        - `self.db`: MongoDB database to load into.
+        - `self.async_db`: Optional async (motor) handle of the same database, used by the `*_async` methods.
+        - `self.batch_size`: Number of documents per `bulk_write`. Defaults to `1000`.
+        - `self.max_workers`: Number of batches written in parallel. Defaults to `4`.
+        - `self.read_models`: Whether the `top_movies` and `genre_movies` read models are refreshed
+        with every batch of details (see `load_mongo/read_models.py`). Defaults to `True`.
+        - `self.raw_credits`: Whether the raw credits of every movie are still loaded into `people`,
+        besides being normalized into `persons` (see `load_mongo/people.py`). Defaults to `False`.
+
+    #### Notes:
+        - `ensure_indexes` creates the unique index on the TMDB id of every collection (see `load_mongo/indexes.py`),
+        it is called once before the first load. The read indexes are created by `IndexManager` after the load.
+        - Every load method returns the number of documents upserted or replaced.
+        - `get_new_ids` removes the ids already loaded, so reruns only fetch the details of new movies.
+        - The `*_async` methods write through `async_db` without blocking the event loop,
+        so the batches are written while the fetches are in flight.
+
+    #### Example Usage:
+
+        >>> loader = MongoLoader(db=config.get_mongo_db(), batch_size=1000, max_workers=4)
+        >>> loader.load_details(details, year=2024, videos=videos)
+        >>> loader.load_images(images)
+        >>> loader.load_videos(videos)
+        >>> loader.load_credits(credits)
+
+        >>> loader = MongoLoader(db=config.get_mongo_db(), async_db=config.get_async_mongo_db())
+        >>> await loader.load_movies_async(movies, year=2024)
+    """
+    def __init__(self, db: Database, batch_size: int = 1000, max_workers: int = 4, async_db: Any = None, raw_credits: bool = False, read_models: bool = True) -> None:
+        self.db = db
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.raw_credits = raw_credits
+        self.people = PeopleNormalizer(db=db, batch_size=batch_size)
+        self.read_models = ReadModels(db=db) if read_models else None
+        self.async_db = async_db
+        self._indexed = False
+
+    @property
+    def async_db(self) -> Any:
+        return self._async_db
+
+    @async_db.setter
+    def async_db(self, async_db: Any) -> None:
+        # the drivers set the async handle once the event loop runs, the normalizer writes through the same one
+        self._async_db = async_db
+        self.people.async_db = async_db
+        if self.read_models is not None:
+            self.read_models.async_db = async_db
+
+    def ensure_indexes(self) -> None:
+        """
+        Create the indexes the loads rely on (the unique index on the TMDB id of every collection), if they don't exist yet.
+        """
+        IndexManager(self.db).ensure_indexes(list(COLLECTION_KEYS), load_only=True)
+        self._indexed = True
+
+    def get_existing_ids(self, ids: Iterable[int], collection: str = "movies", chunk_size: int = 10_000) -> IDSet:
+        """
+        Get which of the ids are already in the collection.
+        Only the TMDB id is projected, hence the `$in` queries are answered from its unique index without reading the documents.
+        """
+        if not self._indexed:
+            self.ensure_indexes()
+        key = COLLECTION_KEYS[collection]
+        ids = ids if isinstance(ids, IDSet) else IDSet(ids)
+        existing = IDSet()
+        for chunk in ids.chunks(chunk_size):
+            existing.update(doc[key] for doc in self.db[collection].find({key: {"$in": chunk}}, {key: 1, "_id": 0}))
+        return existing
+
+    def get_new_ids(self, ids: Iterable[int], collection: str = "movies") -> IDSet:
+        """
+        Get the ids which are not in the collection yet.
+        """
+        ids = ids if isinstance(ids, IDSet) else IDSet(ids)
+        new_ids = ids.difference(self.get_existing_ids(ids, collection))
+        logger.info(f"{len(ids) - len(new_ids)} of {len(ids)} ids are already in {collection}, {len(new_ids)} left")
+        return new_ids
+
+    def _get_batches(self, collection: str, docs: List[Dict[str, Any]]) -> Tuple[str, List[List[Dict[str, Any]]]]:
+        if not self._indexed:
+            self.ensure_indexes()
+        key = COLLECTION_KEYS[collection]
+        docs = [doc for doc in docs if doc and doc.get(key) is not None]
+        return key, [docs[i:i + self.batch_size] for i in range(0, len(docs), self.batch_size)]
+
+    @staticmethod
+    def _get_operations(key: str, docs: List[Dict[str, Any]]) -> List[ReplaceOne]:
+        updated_at = datetime.now(timezone.utc)
+        return [ReplaceOne({key: doc[key]}, {**doc, "updated_at": updated_at}, upsert=True) for doc in docs]
+
+    @staticmethod
+    def _handle_errors(collection: str, key: str, docs: List[Dict[str, Any]], error: BulkWriteError) -> int:
+        result = error.details
+        for write_error in result.get("writeErrors", [])[:5]:
+            logger.error(f"❌ Failed to load {collection} document {key}={docs[write_error['index']].get(key)}: {write_error.get('errmsg')}")
+        logger.error(f"❌ {len(result.get('writeErrors', []))} documents of the batch failed to load into {collection}")
+        return get_written(result)
+
+    @staticmethod
+    def _record_write(collection: str, written: int, seconds: float) -> int:
+        metrics = get_metrics()
+        metrics.observe("mongo_write_seconds", seconds, collection=collection)
+        metrics.inc("mongo_documents_written_total", written, collection=collection)
+        return written
+
+    def _write_batch(self, collection: str, key: str, docs: List[Dict[str, Any]]) -> int:
+        start = time.perf_counter()
+        try:
+            result = self.db[collection].bulk_write(self._get_operations(key, docs), ordered=False)
+        except BulkWriteError as e:
+            return self._record_write(collection, self._handle_errors(collection, key, docs, e), time.perf_counter() - start)
+        return self._record_write(collection, get_written(result.bulk_api_result), time.perf_counter() - start)
+
+    async def _write_batch_async(self, collection: str, key: str, docs: List[Dict[str, Any]]) -> int:
+        start = time.perf_counter()
+        try:
+            result = await self.async_db[collection].bulk_write(self._get_operations(key, docs), ordered=False)
+        except BulkWriteError as e:
+            return self._record_write(collection, self._handle_errors(collection, key, docs, e), time.perf_counter() - start)
+        return self._record_write(collection, get_written(result.bulk_api_result), time.perf_counter() - start)
+
+    def bulk_upsert(self, collection: str, docs: List[Dict[str, Any]]) -> int:
+        """
+        Upsert the documents into the collection, keyed on its TMDB id, in parallel batches.
+
+        Returns:
+            int: Number of documents upserted or replaced.
+        """
+        key, batches = self._get_batches(collection, docs)
+        if not batches:
+            return 0
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            loaded = sum(executor.map(lambda batch: self._write_batch(collection, key, batch), batches))
+        logger.info(f"Loaded {loaded} documents into {collection} in {len(batches)} batches")
+        return loaded
+
+    async def bulk_upsert_async(self, collection: str, docs: List[Dict[str, Any]]) -> int:
+        """
+        Upsert the documents into the collection through the async handle, at most `max_workers` batches at a time.
+
+        Returns:
+            int: Number of documents upserted or replaced.
+        """
+        if self.async_db is None:
+            raise ValueError("MongoLoader needs an async_db for the async write path.")
+        key, batches = self._get_batches(collection, docs)
+        if not batches:
+            return 0
+
+        semaphore = asyncio.Semaphore(self.max_workers)
+
+        async def write(batch: List[Dict[str, Any]]) -> int:
+            async with semaphore:
+                return await self._write_batch_async(collection, key, batch)
+
+        loaded = sum(await asyncio.gather(*[write(batch) for batch in batches]))
+        logger.info(f"Loaded {loaded} documents into {collection} in {len(batches)} batches")
+        return loaded
+
+    def _prepare_details(self, details: List[Dict[str, Any]], year: int = None, videos: List[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        videos_by_id = {video["id"]: video for video in videos or [] if video}
+        filtered_docs = []
+        for detail in details:
+            if not detail:
+                continue
+            detail['release_year'] = year or get_release_year(detail)
+
+            # Filter fields from details
+            filtered_doc = {k: detail.get(k) for k in DETAIL_KEYS if k in detail}
+            filtered_doc["trailer"] = select_trailer(videos_by_id.get(detail["id"]))
+            filtered_docs.append(filtered_doc)
+        return filtered_docs
+
+    def _prepare_images(self, images: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        fixed_docs = []
+        for doc in images:
+            if not doc:
+                continue
+            transformed = {k: v for k, v in doc.items() if k != "id"}
+            transformed["movie_id"] = doc["id"]
+            fixed_docs.append(transformed)
+        return fixed_docs
+
+    @staticmethod
+    def _split_movies(movies: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], ...]:
+        movies = [movie for movie in movies if movie]
+        details = [movie.get("details") for movie in movies]
+        credits = [movie.get("credits") for movie in movies]
+        images = [movie.get("images") for movie in movies]
+        videos = [movie.get("videos") for movie in movies]
+        return movies, details, credits, images, videos
+
+    def load_details(self, details: List[Dict[str, Any]], year: int = None, videos: List[Dict[str, Any]] = None) -> int:
+        """
+        Load the movie details, the trailer of each movie is selected from the `videos` fetched along with it.
+        Without a `year` the release year of each movie is taken from its release date.
+        """
+        movies = self._prepare_details(details, year=year, videos=videos)
+        loaded = self.bulk_upsert("movies", movies)
+        if self.read_models is not None:
+            self.read_models.refresh(movies)
+        return loaded
+
+    def load_images(self, images: List[Dict[str, Any]]) -> int:
+        return self.bulk_upsert("images", self._prepare_images(images))
+
+    def load_videos(self, videos: List[Dict[str, Any]]) -> int:
+        return self.bulk_upsert("videos", videos)
+
+    def load_credits(self, credits: List[Dict[str, Any]]) -> int:
+        """
+        Merge the credits into one document per person in `persons`, and load them as they are into `people` if `raw_credits` is set.
+        """
+        if self.raw_credits:
+            self.bulk_upsert("people", credits)
+        return self.people.normalize(credits)
+
+    def load_movies(self, movies: List[Dict[str, Any]], year: int = None) -> int:
+        """
+        Split the fetched movies (as returned by `MovieDetails.get_complied_data`) and load them into every collection.
+
+        Returns:
+            int: Number of movies loaded.
+        """
+        movies, details, credits, images, videos = self._split_movies(movies)
+        self.load_details(details, year=year, videos=videos)
+        self.load_images(images)
+        self.load_videos(videos)
+        self.load_credits(credits)
+        return len(movies)
+
+    async def load_details_async(self, details: List[Dict[str, Any]], year: int = None, videos: List[Dict[str, Any]] = None) -> int:
+        movies = self._prepare_details(details, year=year, videos=videos)
+        loaded = await self.bulk_upsert_async("movies", movies)
+        if self.read_models is not None:
+            await self.read_models.refresh_async(movies)
+        return loaded
+
+    async def load_images_async(self, images: List[Dict[str, Any]]) -> int:
+        return await self.bulk_upsert_async("images", self._prepare_images(images))
+
+    async def load_videos_async(self, videos: List[Dict[str, Any]]) -> int:
+        return await self.bulk_upsert_async("videos", videos)
+
+    async def load_credits_async(self, credits: List[Dict[str, Any]]) -> int:
+        if self.raw_credits:
+            await self.bulk_upsert_async("people", credits)
+        return await self.people.normalize_async(credits)
+
+    async def load_movies_async(self, movies: List[Dict[str, Any]], year: int = None) -> int:
+        """
+        Same as :meth:`load_movies`, the four collections are written concurrently through the async handle.
+
+        Returns:
+            int: Number of movies loaded.
+        """
+        movies, details, credits, images, videos = self._split_movies(movies)
+        await asyncio.gather(
+            self.load_details_async(details, year=year, videos=videos),
+            self.load_images_async(images),
+            self.load_videos_async(videos),
+            self.load_credits_async(credits),
+        )
+        return len(movies)
@@ -0,0 +1,235 @@
+"""
+This file contains the normalization of the TMDB credits into one document per person.
+
+The credits of a movie list its cast and crew with the whole profile of every person, hence loading them as they are
+repeats the profile of an actor in every movie they played in, and finding the movies of a person scans every cast.
+Instead the credits of every batch are merged per person into the `persons` collection:
+
+    {
+        "id": 287,                      # TMDB person id
+        "name": "Brad Pitt", "gender": 2, "known_for_department": "Acting", "profile_path": "/...jpg", "popularity": 12.3,
+        "movie_ids": [550, 1422, ...],  # person -> movies index (multikey)
+        "credits": {                    # compact film references keyed by movie id
+            "550": [{"role": "cast", "character": "Tyler Durden", "order": 1}],
+            "1422": [{"role": "crew", "job": "Producer", "department": "Production"}],
+        },
+        "updated_at": datetime(...),    # last load touching the person, for the Parquet export
+    }
+
+Reloading a movie replaces its references (`credits.<movie_id>` is set, never appended to) and the people
+no longer credited on it are detached from it, hence the loads stay idempotent. A person left without any movie
+is deleted, the `persons` collection (and its export) only holds people credited somewhere.
+"""
+
+# external imports
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+from pymongo import UpdateMany, UpdateOne
+from pymongo.database import Database
+from pymongo.errors import BulkWriteError
+
+# local imports
+from .indexes import IndexManager
+from ..utils.metrics import get_metrics, get_written
+from ...base_log import Logger
+
+logger = Logger('people').get_logger()
+
+PERSONS_COLLECTION = "persons"
+# profile fields of a person, the same in every credit of the person
+PERSON_KEYS = ["name", "gender", "known_for_department", "profile_path", "popularity"]
+# role -> fields of the credit kept in the film reference
+REFERENCE_KEYS = {
+    "cast": ["character", "order"],
+    "crew": ["job", "department"],
+}
+
+
+def get_person_updates(credits: Iterable[Optional[Dict[str, Any]]]) -> Dict[int, Dict[str, Any]]:
+    """
+    Merge the cast and crew of the movies into one update per person.
+
+    Returns:
+        Dict[int, Dict[str, Any]]: The profile, movie ids and film references of every person, keyed by person id.
+    """
+    people: Dict[int, Dict[str, Any]] = {}
+    for movie_credits in credits:
+        if not movie_credits or movie_credits.get("id") is None:
+            continue
+        movie_id = movie_credits["id"]
+        for role, keys in REFERENCE_KEYS.items():
+            for credit in movie_credits.get(role) or []:
+                person_id = credit.get("id")
+                if person_id is None:
+                    continue
+                person = people.setdefault(person_id, {"profile": {}, "credits": {}})
+                person["profile"].update({k: credit[k] for k in PERSON_KEYS if k in credit})
+                reference = {"role": role, **{k: credit[k] for k in keys if k in credit}}
+                person["credits"].setdefault(str(movie_id), []).append(reference)
+    return people
+
+
+class PeopleNormalizer:
+    """
+    This class merges the credits of the loaded movies into the `persons` collection, one document per person.
+    It sets configurations as follows:
+
+        - `self.db`: MongoDB database to load into.
+        - `self.async_db`: Optional async (motor) handle of the same database, used by `normalize_async`.
+        - `self.batch_size`: Number of update operations per `bulk_write`. Defaults to `1000`.
+
+    #### Notes:
+        - The updates of a batch of movies are merged per person first, a person credited in several movies
+        of the batch gets a single upsert.
+        - The filmography of a person is a single read of its document by the unique `id` index,
+        the people of a movie are found through the multikey index on `movie_ids`.
+        - The people detached from reloaded movies are written after the upserts, when any of them is left
+        with no movie (`movie_ids: []`, found through the same index) it is deleted.
+
+    #### Example Usage:
+
+        >>> normalizer = PeopleNormalizer(db=config.get_mongo_db())
+        >>> normalizer.normalize(credits)
+        >>> normalizer.get_filmography(287)
+        [550, 1422, ...]
+    """
+    def __init__(self, db: Database, batch_size: int = 1000, async_db: Any = None) -> None:
+        self.db = db
+        self.async_db = async_db
+        self.batch_size = batch_size
+        self._indexed = False
+
+    def ensure_indexes(self) -> None:
+        IndexManager(self.db).ensure_indexes([PERSONS_COLLECTION], load_only=True)
+        self._indexed = True
+
+    def _get_operations(self, credits: List[Optional[Dict[str, Any]]]) -> List[Union[UpdateOne, UpdateMany]]:
+        operations = []
+        updated_at = datetime.now(timezone.utc)
+        for person_id, person in get_person_updates(credits).items():
+            fields = {**person["profile"], **{f"credits.{movie_id}": references for movie_id, references in person["credits"].items()}, "updated_at": updated_at}
+            movie_ids = [int(movie_id) for movie_id in person["credits"]]
+            operations.append(UpdateOne(
+                {"id": person_id},
+                {"$set": fields, "$addToSet": {"movie_ids": {"$each": movie_ids}}},
+                upsert=True,
+            ))
+        return operations
+
+    @staticmethod
+    def _get_detach_operations(credits: List[Optional[Dict[str, Any]]]) -> List[UpdateMany]:
+        """
+        Detach the people no longer credited on a reloaded movie.
+        """
+        operations = []
+        updated_at = datetime.now(timezone.utc)
+        for movie_credits in credits:
+            if not movie_credits or movie_credits.get("id") is None:
+                continue
+            movie_id = movie_credits["id"]
+            person_ids = list({credit.get("id") for role in REFERENCE_KEYS for credit in movie_credits.get(role) or []})
+            operations.append(UpdateMany(
+                {"movie_ids": movie_id, "id": {"$nin": person_ids}},
+                {"$pull": {"movie_ids": movie_id}, "$unset": {f"credits.{movie_id}": ""}, "$set": {"updated_at": updated_at}},
+            ))
+        return operations
+
+    def _get_writes(self, credits: List[Optional[Dict[str, Any]]]) -> Iterator[Tuple[List[Union[UpdateOne, UpdateMany]], bool]]:
+        """
+        Get the batches of operations to write, and whether they detach people.
+        """
+        for batch in self._get_batches(self._get_operations(credits)):
+            yield batch, False
+        for batch in self._get_batches(self._get_detach_operations(credits)):
+            yield batch, True
+
+    @staticmethod
+    def _log_orphans(deleted: int) -> None:
+        if deleted:
+            logger.info(f"Deleted {deleted} persons no longer credited on any movie")
+
+    def _get_batches(self, operations: List[Union[UpdateOne, UpdateMany]]) -> Iterator[List[Union[UpdateOne, UpdateMany]]]:
+        for start in range(0, len(operations), self.batch_size):
+            yield operations[start:start + self.batch_size]
+
+    @staticmethod
+    def _record_write(written: int, seconds: float) -> int:
+        metrics = get_metrics()
+        metrics.observe("mongo_write_seconds", seconds, collection=PERSONS_COLLECTION)
+        metrics.inc("mongo_documents_written_total", written, collection=PERSONS_COLLECTION)
+        return written
+
+    def normalize(self, credits: List[Optional[Dict[str, Any]]]) -> int:
+        """
+        Merge the credits of the movies into the `persons` collection.
+
+        Returns:
+            int: Number of person documents upserted or updated.
+        """
+        if not self._indexed:
+            self.ensure_indexes()
+        written = detached = 0
+        for batch, detaching in self._get_writes(credits):
+            start = time.perf_counter()
+            try:
+                result = self.db[PERSONS_COLLECTION].bulk_write(batch, ordered=False).bulk_api_result
+            except BulkWriteError as e:
+                result = e.details
+                logger.error(f"❌ {len(result.get('writeErrors', []))} person updates of the batch failed: {result.get('writeErrors', [])[:1]}")
+            written += self._record_write(get_written(result), time.perf_counter() - start)
+            detached += result.get("nMatched", 0) if detaching else 0
+        if detached:
+            self._log_orphans(self.db[PERSONS_COLLECTION].delete_many({"movie_ids": []}).deleted_count)
+        logger.info(f"Normalized the credits of {len([c for c in credits if c])} movies into {written} persons")
+        return written
+
+    async def normalize_async(self, credits: List[Optional[Dict[str, Any]]]) -> int:
+        """
+        Same as :meth:`normalize`, written through the async handle.
+        """
+        if self.async_db is None:
+            raise ValueError("PeopleNormalizer needs an async_db for the async write path.")
+        if not self._indexed:
+            self.ensure_indexes()
+        written = detached = 0
+        for batch, detaching in self._get_writes(credits):
+            start = time.perf_counter()
+            try:
+                result = (await self.async_db[PERSONS_COLLECTION].bulk_write(batch, ordered=False)).bulk_api_result
+            except BulkWriteError as e:
+                result = e.details
+                logger.error(f"❌ {len(result.get('writeErrors', []))} person updates of the batch failed: {result.get('writeErrors', [])[:1]}")
+            written += self._record_write(get_written(result), time.perf_counter() - start)
+            detached += result.get("nMatched", 0) if detaching else 0
+        if detached:
+            self._log_orphans((await self.async_db[PERSONS_COLLECTION].delete_many({"movie_ids": []})).deleted_count)
+        logger.info(f"Normalized the credits of {len([c for c in credits if c])} movies into {written} persons")
+        return written
+
+    def backfill(self, source: str = "people", batch_size: int = 500) -> int:
+        """
+        Normalize the raw credits documents loaded into the `source` collection before this stage existed.
+
+        Returns:
+            int: Number of movies whose credits were normalized.
+        """
+        movies = 0
+        batch = []
+        for movie_credits in self.db[source].find({}, {"_id": 0}):
+            batch.append(movie_credits)
+            if len(batch) >= batch_size:
+                self.normalize(batch)
+                movies += len(batch)
+                batch = []
+        if batch:
+            self.normalize(batch)
+            movies += len(batch)
+        return movies
+
+    def get_filmography(self, person_id: int) -> List[int]:
+        """
+        Get the ids of the movies of a person.
+        """
+        person = self.db[PERSONS_COLLECTION].find_one({"id": person_id}, {"movie_ids": 1, "_id": 0})
+        return (person or {}).get("movie_ids", [])
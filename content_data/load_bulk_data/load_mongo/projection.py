@@ -0,0 +1,82 @@
+"""
+This file contains the projection of the TMDB payloads onto the fields stored in MongoDB.
+
+The payloads are projected right after they are decoded, so the fields no collection stores
+(e.g. `belongs_to_collection`, `spoken_languages` or the `original_name` of every cast member)
+are dropped before the movies wait on the queue for their batch to be loaded.
+
+It contains the helpers:
+    - `loads`: Decodes a JSON payload, using `orjson` when it is installed.
+    - `project`: Projects the payload of a resource (`details`, `credits`, `images` or `videos`).
+    - `project_movie`: Projects every resource of a fetched movie, e.g. the raw movies replayed from the landing zone.
+"""
+
+# external imports
+import json
+from typing import Any, Callable, Dict, Optional, Union
+
+# local imports
+from .mongo_loader import DETAIL_KEYS
+
+try:
+    import orjson
+    loads: Callable[[Union[bytes, str]], Any] = orjson.loads
+except ImportError:
+    loads = json.loads
+
+# resource -> kept top level fields, and the kept fields of the items of its list fields (`None` keeps the items whole)
+PROJECTIONS: Dict[str, Dict[str, Any]] = {
+    "details": {
+        "fields": DETAIL_KEYS,
+        "items": {},
+    },
+    "credits": {
+        "fields": ["id", "cast", "crew"],
+        "items": {
+            "cast": ["id", "name", "character", "order", "gender", "known_for_department", "profile_path", "popularity", "credit_id"],
+            "crew": ["id", "name", "job", "department", "gender", "known_for_department", "profile_path", "popularity", "credit_id"],
+        },
+    },
+    "images": {
+        "fields": ["id", "backdrops", "logos", "posters"],
+        "items": {},
+    },
+    "videos": {
+        "fields": ["id", "results"],
+        "items": {},
+    },
+}
+
+
+def project(resource: str, payload: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    Keep only the fields of the payload which are stored for the resource.
+
+    Returns:
+        Optional[Dict[str, Any]]: The projected payload, `None` if the payload is `None`.
+    """
+    if payload is None:
+        return None
+    projection = PROJECTIONS[resource]
+    projected = {}
+    for field in projection["fields"]:
+        if field not in payload:
+            continue
+        value = payload[field]
+        item_fields = projection["items"].get(field)
+        if item_fields is not None and isinstance(value, list):
+            value = [{k: item[k] for k in item_fields if k in item} for item in value]
+        projected[field] = value
+    return projected
+
+
+def project_movie(movie: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    Project the details, credits, images and videos of a movie (as returned by `MovieDetails.get_complied_data`).
+
+    Returns:
+        Optional[Dict[str, Any]]: The projected movie, `None` if the movie is `None`.
+    """
+    if movie is None:
+        return None
+    return {**movie, **{resource: project(resource, movie.get(resource)) for resource in PROJECTIONS}}
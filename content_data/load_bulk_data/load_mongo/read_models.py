@@ -0,0 +1,254 @@
+"""
+This file contains the precomputed read models of the frontend, kept up to date from every batch of movies loaded.
+
+    - `top_movies`: the top-N movies by popularity of every year (`_id: "year:2024"`) and of every genre (`_id: "genre:18"`),
+    each entry holding what a listing shows (`id`, `title`, `popularity`, `vote_average`, `poster_path`, `release_date`).
+    - `genre_movies`: the ids of the movies of a genre, bucketed by release year (`_id: "18:2024"`) to bound the document size.
+
+Instead of aggregating the whole `movies` collection after every load, the batch just loaded is merged in:
+its movies are pulled from the lists they were in and pushed into the lists of their year and genres
+(`$push` with `$sort` and `$slice` keeps only the top-N). The entries the top-N dropped earlier are not kept around,
+hence a full list a reloaded movie falls out of (or drops in) is refilled from `movies` with an indexed query,
+the runner-up takes its place. `rebuild` recomputes everything from `movies`.
+"""
+
+# external imports
+import time
+import asyncio
+from typing import Any, Dict, List, Optional, Set, Tuple, Union
+from pymongo import UpdateMany, UpdateOne
+from pymongo.database import Database
+from pymongo.errors import BulkWriteError
+
+# local imports
+from .indexes import IndexManager
+from ..utils.metrics import get_metrics, get_written
+from ...base_log import Logger
+
+logger = Logger('read_models').get_logger()
+
+TOP_MOVIES_COLLECTION = "top_movies"
+GENRE_MOVIES_COLLECTION = "genre_movies"
+TOP_N = 100
+ENTRY_KEYS = ["id", "title", "popularity", "vote_average", "poster_path", "release_date"]
+
+Operation = Union[UpdateMany, UpdateOne]
+
+
+def get_top_keys(movie: Dict[str, Any]) -> List[str]:
+    """
+    Get the `_id`s of the top lists a movie belongs to.
+    """
+    keys = [f"year:{movie['release_year']}"] if movie.get("release_year") is not None else []
+    return keys + [f"genre:{genre['id']}" for genre in movie.get("genres") or [] if genre.get("id") is not None]
+
+
+def get_genre_keys(movie: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """
+    Get the `_id`s and fields of the genre buckets a movie belongs to.
+    """
+    return {
+        f"{genre['id']}:{movie.get('release_year')}": {"genre_id": genre["id"], "name": genre.get("name"), "release_year": movie.get("release_year")}
+        for genre in movie.get("genres") or [] if genre.get("id") is not None
+    }
+
+
+class ReadModels:
+    """
+    This class maintains the `top_movies` and `genre_movies` read models.
+    It sets configurations as follows:
+
+        - `self.db`: MongoDB database holding the `movies` collection.
+        - `self.async_db`: Optional async (motor) handle of the same database, used by `refresh_async`.
+        - `self.top_n`: Number of movies kept in every top list. Defaults to `100`.
+
+    #### Notes:
+        - `refresh` takes the movie documents as loaded into `movies` (with their `release_year`),
+        the `MongoLoader` calls it with every batch of details it loads.
+        - A reloaded movie is first pulled from every list, hence a changed year or genre moves it.
+        - A full list which loses a member, or whose member drops in popularity, is refilled from `movies`
+        (`release_year_popularity` and `genre_popularity` indexes), the first load of a movie never refills.
+
+    #### Example Usage:
+
+        >>> read_models = ReadModels(db=config.get_mongo_db(), top_n=100)
+        >>> read_models.refresh(movies)
+        >>> read_models.get_top_movies(year=2024)[:10]
+        >>> read_models.get_genre_movie_ids(18, year=2024)
+    """
+    def __init__(self, db: Database, top_n: int = TOP_N, async_db: Any = None) -> None:
+        self.db = db
+        self.async_db = async_db
+        self.top_n = top_n
+        self._indexed = False
+
+    def ensure_indexes(self) -> None:
+        IndexManager(self.db).ensure_indexes([TOP_MOVIES_COLLECTION, GENRE_MOVIES_COLLECTION], load_only=True)
+        self._indexed = True
+
+    def _get_top_operations(self, movies: List[Dict[str, Any]]) -> List[Operation]:
+        movie_ids = [movie["id"] for movie in movies]
+        lists: Dict[str, List[Dict[str, Any]]] = {}
+        for movie in movies:
+            entry = {k: movie.get(k) for k in ENTRY_KEYS}
+            entry["popularity"] = entry["popularity"] or 0
+            for key in get_top_keys(movie):
+                lists.setdefault(key, []).append(entry)
+
+        # the pull must run before the pushes, the operations are written in order
+        operations: List[Operation] = [UpdateMany({"movies.id": {"$in": movie_ids}}, {"$pull": {"movies": {"id": {"$in": movie_ids}}}})]
+        for key, entries in lists.items():
+            operations.append(UpdateOne(
+                {"_id": key},
+                {"$push": {"movies": {"$each": entries, "$sort": {"popularity": -1}, "$slice": self.top_n}}},
+                upsert=True,
+            ))
+        return operations
+
+    def _get_stale_keys(self, movies: List[Dict[str, Any]]) -> Set[str]:
+        """
+        Find the full top lists whose runner-up may have been dropped by the batch: a member of the list
+        moved to another year or genre, or its popularity went down.
+        """
+        new = {movie["id"]: (set(get_top_keys(movie)), movie.get("popularity") or 0) for movie in movies}
+        stale = set()
+        query = {"movies.id": {"$in": list(new)}}
+        for doc in self.db[TOP_MOVIES_COLLECTION].find(query, {"movies.id": 1, "movies.popularity": 1}):
+            if len(doc["movies"]) < self.top_n:
+                # a list which is not full holds every movie of its year or genre
+                continue
+            for entry in doc["movies"]:
+                if entry["id"] in new:
+                    keys, popularity = new[entry["id"]]
+                    if doc["_id"] not in keys or popularity < (entry.get("popularity") or 0):
+                        stale.add(doc["_id"])
+                        break
+        return stale
+
+    def _refill(self, keys: Set[str]) -> None:
+        """
+        Recompute the given top lists from `movies`.
+        """
+        projection = {k: 1 for k in ENTRY_KEYS}
+        projection["_id"] = 0
+        operations = []
+        for key in keys:
+            kind, value = key.split(":", 1)
+            query = {"release_year": int(value)} if kind == "year" else {"genres.id": int(value)}
+            entries = [
+                {**{k: movie.get(k) for k in ENTRY_KEYS}, "popularity": movie.get("popularity") or 0}
+                for movie in self.db["movies"].find(query, projection).sort("popularity", -1).limit(self.top_n)
+            ]
+            operations.append(UpdateOne({"_id": key}, {"$set": {"movies": entries}}))
+        if operations:
+            start = time.perf_counter()
+            result = self.db[TOP_MOVIES_COLLECTION].bulk_write(operations, ordered=False).bulk_api_result
+            self._record_write(TOP_MOVIES_COLLECTION, result, time.perf_counter() - start)
+            get_metrics().inc("read_model_refills_total", len(operations))
+            logger.info(f"Refilled {len(operations)} top lists from movies")
+
+    def _get_genre_operations(self, movies: List[Dict[str, Any]]) -> List[Operation]:
+        buckets: Dict[str, Dict[str, Any]] = {}
+        operations: List[Operation] = []
+        for movie in movies:
+            keys = get_genre_keys(movie)
+            for key, fields in keys.items():
+                buckets.setdefault(key, {"fields": fields, "movie_ids": []})["movie_ids"].append(movie["id"])
+            # detach the movie from the buckets of the genres (or year) it no longer has
+            operations.append(UpdateMany({"movie_ids": movie["id"], "_id": {"$nin": list(keys)}}, {"$pull": {"movie_ids": movie["id"]}}))
+        for key, bucket in buckets.items():
+            operations.append(UpdateOne(
+                {"_id": key},
+                {"$set": bucket["fields"], "$addToSet": {"movie_ids": {"$each": bucket["movie_ids"]}}},
+                upsert=True,
+            ))
+        return operations
+
+    @staticmethod
+    def _record_write(collection: str, result: Dict[str, Any], seconds: float) -> None:
+        metrics = get_metrics()
+        metrics.observe("mongo_write_seconds", seconds, collection=collection)
+        metrics.inc("mongo_documents_written_total", get_written(result), collection=collection)
+
+    def _get_writes(self, movies: List[Optional[Dict[str, Any]]]) -> List[Tuple[str, List[Operation], bool]]:
+        movies = [movie for movie in movies if movie and movie.get("id") is not None]
+        if not movies:
+            return []
+        return [
+            (TOP_MOVIES_COLLECTION, self._get_top_operations(movies), True),
+            (GENRE_MOVIES_COLLECTION, self._get_genre_operations(movies), False),
+        ]
+
+    def refresh(self, movies: List[Optional[Dict[str, Any]]]) -> None:
+        """
+        Merge a batch of loaded movies into the read models.
+        """
+        if not self._indexed:
+            self.ensure_indexes()
+        writes = self._get_writes(movies)
+        stale = self._get_stale_keys([movie for movie in movies if movie and movie.get("id") is not None]) if writes else set()
+        for collection, operations, ordered in writes:
+            start = time.perf_counter()
+            try:
+                result = self.db[collection].bulk_write(operations, ordered=ordered).bulk_api_result
+            except BulkWriteError as e:
+                result = e.details
+                logger.error(f"❌ Failed to refresh {collection}: {result.get('writeErrors', [])[:1]}")
+            self._record_write(collection, result, time.perf_counter() - start)
+        self._refill(stale)
+
+    async def refresh_async(self, movies: List[Optional[Dict[str, Any]]]) -> None:
+        """
+        Same as :meth:`refresh`, written through the async handle.
+        """
+        if self.async_db is None:
+            raise ValueError("ReadModels needs an async_db for the async write path.")
+        if not self._indexed:
+            self.ensure_indexes()
+        writes = self._get_writes(movies)
+        # the refills are rare, they go through the sync handle from a worker thread
+        stale = await asyncio.to_thread(self._get_stale_keys, [movie for movie in movies if movie and movie.get("id") is not None]) if writes else set()
+        for collection, operations, ordered in writes:
+            start = time.perf_counter()
+            try:
+                result = (await self.async_db[collection].bulk_write(operations, ordered=ordered)).bulk_api_result
+            except BulkWriteError as e:
+                result = e.details
+                logger.error(f"❌ Failed to refresh {collection}: {result.get('writeErrors', [])[:1]}")
+            self._record_write(collection, result, time.perf_counter() - start)
+        if stale:
+            await asyncio.to_thread(self._refill, stale)
+
+    def rebuild(self) -> None:
+        """
+        Recompute the read models from the whole `movies` collection, replacing the incremental ones.
+        """
+        for collection in (TOP_MOVIES_COLLECTION, GENRE_MOVIES_COLLECTION):
+            self.db.drop_collection(collection)
+        self._indexed = False
+        projection = {k: 1 for k in ENTRY_KEYS + ["release_year", "genres"]}
+        projection["_id"] = 0
+        batch = []
+        for movie in self.db["movies"].find({}, projection):
+            batch.append(movie)
+            if len(batch) >= 10_000:
+                self.refresh(batch)
+                batch = []
+        if batch:
+            self.refresh(batch)
+        logger.info(f"Rebuilt the read models from {self.db['movies'].count_documents({})} movies")
+
+    def get_top_movies(self, year: int = None, genre_id: int = None) -> List[Dict[str, Any]]:
+        """
+        Get the top-N movies by popularity of a year or of a genre.
+        """
+        key = f"year:{year}" if year is not None else f"genre:{genre_id}"
+        doc = self.db[TOP_MOVIES_COLLECTION].find_one({"_id": key})
+        return (doc or {}).get("movies", [])
+
+    def get_genre_movie_ids(self, genre_id: int, year: int = None) -> List[int]:
+        """
+        Get the ids of the movies of a genre, of a single release year if given.
+        """
+        query = {"genre_id": genre_id, **({"release_year": year} if year is not None else {})}
+        return [movie_id for doc in self.db[GENRE_MOVIES_COLLECTION].find(query, {"movie_ids": 1}) for movie_id in doc.get("movie_ids", [])]
@@ -1,25 +1,26 @@
 """
 This file contains the functionality to fetch all the movie details from TMDB
 as the part of ELT pipeline.
-
-It contains global constants:
-    - `CONFIG`: Configuration object to access MongoDB and TMDB settings.
+The TMDB settings are read from the shared configuration of the process (`get_config()`) when the requests are made.
 """
 
 # external imports
 import httpx
 import asyncio
 import random
-from dotenv import load_dotenv
-from typing import Dict, Any
-load_dotenv()
+from typing import Any, Dict, List
 
 # local imports
-from ..config.config import Config
-from ...base_log import Logger
+from ..config.config import get_config
+from ..load_mongo.projection import loads, project
+from ..utils.metrics import get_metrics, get_endpoint_label
+from ..utils.tmdb_http import tmdb_get_async
+from ..utils.concurrency import ConcurrencyController
+from ..utils.profiler import get_profiler
+from ...base_log import Logger, ProgressLogger
 
 logger = Logger('run_movie_details').get_logger()
-CONFIG = Config()
+progress = ProgressLogger(logger, "✅ Successfully fetched {count} movie details responses")
 
 class MovieDetails:
     """
@@ -40,6 +41,19 @@ class MovieDetails:
         - `fetch_movie_videos`
     These methods are called in the `get_complied_data` method and the data is stored in a dictionary with all the details combined.
 
+    By default the `details` entry of `endpoint_config.py` asks TMDB to `append_to_response` the credits, images and videos,
+    hence a single request is made per movie and the combined payload is split back into the same mapping.
+    Any sub-resource missing from the combined payload (e.g. when it exceeds the response size limits of TMDB)
+    is fetched from its own endpoint as a fallback. Pass `append_to_response=False` to always fetch the four endpoints separately.
+    The fallbacks are only for a movie whose details were fetched: when the combined request fails, the details are
+    requested on their own (unless TMDB answered `404`), and the sub-resources only once they came through.
+
+    Every response is decoded (with `orjson` when installed) and projected straight away onto the fields stored in MongoDB,
+    as per the `PROJECTIONS` of `load_mongo/projection.py`. Pass `project=False` to keep the whole payloads.
+
+    Pass `revalidate=True` to revalidate the cached responses with TMDB even when they are fresh,
+    e.g. for the movies the changes feed reports as changed.
+
     This is the framing module for each of the details we need for a single move. 
     This module is a backbone of the `run_movie_details` file which will fetch multiple movie details asynchronously.
     
@@ -50,32 +64,73 @@ class MovieDetails:
     #### See Also:
         - `endpoint_config.py` – maps TMDB endpoint types to paths.
     """
-    def __init__(self, movie_id:int=None, client: httpx.AsyncClient=None) -> None:
-        self.url, self.headers, self.default_params = CONFIG.get_tmdb_config(endpoint="details", type="movies")
+    def __init__(self, movie_id:int=None, client: httpx.AsyncClient=None, append_to_response: bool = True, project: bool = True, controller: ConcurrencyController = None, revalidate: bool = False) -> None:
+        self.url, self.headers, self.default_params = get_config().get_tmdb_config(endpoint="details", type="movies")
+        self.cache_ttl = get_config().get_cache_ttl(endpoint="details", type="movies")
+        appended = self.default_params.pop("append_to_response", "")
+        self.appended = [name for name in appended.split(",") if name] if append_to_response else []
         self.movie_id = movie_id
         self.client = client
+        self.project = project
+        self.controller = controller
+        self.revalidate = revalidate
+        # the error the last request given up on failed with, and the parts of the movie which could not be fetched
+        self.error: Exception = None
+        self.failed: List[str] = []
+
+    def _project(self, endpoint: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Project the payload of an endpoint, the sub-resources appended to the details are projected on their own.
+        """
+        if not self.project or not isinstance(payload, dict):
+            return payload
+        if endpoint:
+            return project(endpoint.strip("/"), payload)
+        appended = {name: project(name, payload[name]) for name in self.appended if isinstance(payload.get(name), dict)}
+        return {**project("details", payload), **appended}
     
-    async def _fetch(self, endpoint: str = "") -> Dict[str, Any]:
+    async def _fetch(self, endpoint: str = "", **kwargs) -> Dict[str, Any]:
         url = f"{self.url}/{self.movie_id}{endpoint}"
-        params = CONFIG.set_tmdb_params(params=self.default_params)
+        params = get_config().set_tmdb_params(params=self.default_params, **kwargs)
         retries = 3
         backoff = 1
 
         for attempt in range(1, retries + 1):
             try:
-                response = await self.client.get(url, headers=self.headers, params=params)
+                # 429s are retried by the shared rate limiter as per the Retry-After of TMDB
+                response = await tmdb_get_async(self.client, url, limiter=get_config().get_rate_limiter(), cache=get_config().get_response_cache(), ttl=self.cache_ttl, headers=self.headers, params=params, controller=self.controller, revalidate=self.revalidate)
                 response.raise_for_status()
-                logger.info(f"✅ Successfully fetched {endpoint}/details of movie_id: {self.movie_id} (attempt {attempt})")
-                return response.json()
+                # a line per request would slow down the event loop, hence the successes are logged as periodic progress
+                progress.update()
+                if attempt > 1:
+                    logger.info(f"✅ Successfully fetched {endpoint}/details of movie_id: {self.movie_id} (attempt {attempt})")
+                profiler = get_profiler()
+                with profiler.timed("json_decode"):
+                    payload = loads(response.content)
+                with profiler.timed("projection"):
+                    return self._project(endpoint, payload)
 
             except Exception as e:
                 logger.warning(f"⚠️ Attempt {attempt} failed for movie_id={self.movie_id}: {e}")
+                # a movie TMDB does not have (e.g. deleted) is not found on the next attempts either
+                if self._is_not_found(e):
+                    logger.error(f"❌ movie_id={self.movie_id} was not found on TMDB")
+                    get_metrics().inc("tmdb_give_ups_total", endpoint=get_endpoint_label(url), reason="not_found")
+                    self.error = e
+                    return None
                 if attempt == retries:
                     logger.error(f"❌ Giving up after {retries} attempts for movie_id={self.movie_id}")
+                    get_metrics().inc("tmdb_give_ups_total", endpoint=get_endpoint_label(url), reason="error")
+                    self.error = e
                     return None
+                get_metrics().inc("tmdb_retries_total", endpoint=get_endpoint_label(url), reason="error")
                 sleep_time = backoff * 2 ** (attempt - 1) + random.uniform(0, 0.5)
                 await asyncio.sleep(sleep_time)
     
+    @staticmethod
+    def _is_not_found(error: Exception) -> bool:
+        return getattr(getattr(error, "response", None), "status_code", None) == 404
+
     async def fetch_movie_details(self) -> Dict[str, Any]:
         return await self._fetch()
     
@@ -88,22 +143,61 @@ class MovieDetails:
     async def fetch_movie_videos(self) -> Dict[str, Any]:
         return await self._fetch("/videos")
         
+    async def fetch_movie_appended(self) -> Dict[str, Any]:
+        return await self._fetch(append_to_response=",".join(self.appended))
+
+    def _split_appended(self, details: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Split the `append_to_response` payload back into details and its sub-resources.
+        The sub-resources of the combined payload have no `id` of their own, hence the movie id is added to them
+        to keep them identical to the responses of the separate endpoints.
+        """
+        mapping = {"credits": None, "images": None, "videos": None}
+        for name in self.appended:
+            sub_resource = details.pop(name, None)
+            if isinstance(sub_resource, dict):
+                mapping[name] = {"id": details.get("id"), **sub_resource}
+        mapping["details"] = details
+        return mapping
+
     async def get_complied_data(self) -> Dict[str, Any]:
-        details, credits, images, videos = await asyncio.gather(
-            self.fetch_movie_details(),
-            self.fetch_movie_credits(),
-            self.fetch_movie_images(),
-            self.fetch_movie_videos(),
-        )
-        try:
-            mapping ={
-                "id": details.get("id"),
-                "details": details,
-                "credits": credits,
-                "images": images,
-                "videos": videos
-            }
-            return mapping
-        except Exception as e:
-            logger.error(f"❌ Error fetching movie details: {e}")
-            return None
\ No newline at end of file
+        fetchers = {
+            "credits": self.fetch_movie_credits,
+            "images": self.fetch_movie_images,
+            "videos": self.fetch_movie_videos,
+        }
+        if self.appended:
+            details = await self.fetch_movie_appended()
+            if details is not None:
+                data = self._split_appended(details)
+            else:
+                # the details alone may still come through (e.g. the combined payload is too large), unless the movie is not found
+                details = None if self._is_not_found(self.error) else await self.fetch_movie_details()
+                data = {"details": details, "credits": None, "images": None, "videos": None}
+            # fall back to the separate endpoints for the sub-resources missing from the combined payload,
+            # a movie without details is given up on rather than requested for every sub-resource
+            missing = [name for name in fetchers if data[name] is None] if data["details"] is not None else []
+            if missing:
+                logger.warning(f"⚠️ {', '.join(missing)} missing from the combined response of movie_id: {self.movie_id}, fetching separately")
+                results = await asyncio.gather(*[fetchers[name]() for name in missing])
+                data.update(zip(missing, results))
+            details, credits, images, videos = data["details"], data["credits"], data["images"], data["videos"]
+        else:
+            details, credits, images, videos = await asyncio.gather(
+                self.fetch_movie_details(),
+                self.fetch_movie_credits(),
+                self.fetch_movie_images(),
+                self.fetch_movie_videos(),
+            )
+        mapping = {
+            "details": details,
+            "credits": credits,
+            "images": images,
+            "videos": videos
+        }
+        self.failed = [name for name, value in mapping.items() if value is None]
+        # without its details there is no movie to load, the failure is kept by the caller (see `RunMovieDetails`)
+        if details is None:
+            logger.error(f"❌ Could not fetch the details of movie_id: {self.movie_id}")
+            return None
+        return {"id": details.get("id"), **mapping}
\ No newline at end of file
@@ -7,35 +7,118 @@ This file will use the methods of `MovieDetails` class from the `movie_details`
 """
 
 # external imports
+import time
 import httpx
 import asyncio
 from typing import List, Dict, Any
-import os
-import json
 
 
 # local imports
-from .fetch_movie_details import MovieDetails
+from .fetch_movie_details import MovieDetails, progress
+from ..utils.metrics import get_metrics
+from ..utils.concurrency import ConcurrencyController
+from ..utils.dead_letters import DeadLetterStore, get_cause
+from ..landing.landing_zone import LandingZone
 from ...base_log import Logger
 
 logger = Logger('run_movie_details').get_logger()
 
 class RunMovieDetails:
-    def __init__(self, movie_ids: List[int]) -> None:
+    """
+    This class fetches the details of multiple movies asynchronously on a single pooled `httpx.AsyncClient`.
+
+    `fetch_all_movies` gathers all the movies in memory, while `stream_movies` puts every fetched movie
+    on a bounded `asyncio.Queue` as soon as it arrives. In streaming mode only `max_concurrency` workers exist,
+    they pull the ids one by one, hence the memory depends on the queue size rather than the number of ids.
+
+    When a `ConcurrencyController` is given, it replaces the fixed `max_concurrency`, the number of movies in flight
+    then grows while TMDB answers quickly and is cut on `429`s, `5xx`s, timeouts and latency spikes.
+
+    When a `DeadLetterStore` is given, every movie whose details, credits, images or videos could not be fetched
+    is recorded in it with the cause of the failure (and the `year` it belongs to), for the retry sweep to re-drive.
+
+    Pass `project=False` to keep the whole payloads of TMDB, e.g. to append them to the `LandingZone` as they were fetched,
+    and `revalidate=True` to revalidate even the fresh cached responses with TMDB, e.g. for the movies known to have changed.
+
+    #### Example Usage:
+
+        >>> obj = RunMovieDetails(movie_ids=[155, 550], max_concurrency=10)
+        >>> movies = asyncio.run(obj.main())
+
+        >>> obj = RunMovieDetails(movie_ids=[155, 550], controller=ConcurrencyController(name="movie_details", min_limit=2, max_limit=50))
+
+        >>> queue = asyncio.Queue(maxsize=500)
+        >>> producer = asyncio.create_task(obj.stream_movies(queue))
+        >>> while (movie := await queue.get()) is not RunMovieDetails.END_OF_STREAM:
+        ...     ...
+    """
+    END_OF_STREAM = object()
+
+    def __init__(self, movie_ids: List[int], max_concurrency: int = 10, controller: ConcurrencyController = None, dead_letters: DeadLetterStore = None, year: int = None, project: bool = True, revalidate: bool = False) -> None:
         self.movie_ids = movie_ids
-        self.semaphore = asyncio.Semaphore(10)
+        self.controller = controller
+        self.dead_letters = dead_letters
+        self.year = year
+        self.project = project
+        self.revalidate = revalidate
+        # with a controller, its upper bound is the most movies that may ever be in flight
+        self.max_concurrency = controller.max_limit if controller else max_concurrency
+        # the controller hands out the slots when given, the semaphore is only the fixed bound
+        self.semaphore = asyncio.Semaphore(max_concurrency) if controller is None else None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        # a movie in flight holds one connection for its combined request, and up to three
+        # while the sub-resources missing from it are fetched concurrently as fallbacks
+        return httpx.AsyncClient(limits=httpx.Limits(max_connections=self.max_concurrency * 3, max_keepalive_connections=self.max_concurrency))
 
     async def fetch_all_movies(self) -> List[Dict[str, Any]]:
-        async with httpx.AsyncClient(limits=httpx.Limits(max_connections=200, max_keepalive_connections=50)) as client:
+        async with self._get_client() as client:
             tasks = [
                 self._fetch_movie(movie_id, client) for movie_id in self.movie_ids
             ]
-            return await asyncio.gather(*tasks)
+            results = await asyncio.gather(*tasks)
+        progress.flush()
+        return results
+
+    async def stream_movies(self, queue: asyncio.Queue) -> None:
+        """
+        Fetch the movies and put each of them on the `queue`, followed by `END_OF_STREAM` once all are fetched.
+        Movies whose details could not be fetched are skipped (and recorded in the dead letters). Putting on a full queue waits,
+        so the fetching slows down to the speed of the consumer.
+        """
+        movie_ids = iter(self.movie_ids)
+
+        async def worker(client: httpx.AsyncClient) -> None:
+            # all the workers share the same iterator, hence each id is fetched once
+            for movie_id in movie_ids:
+                movie = await self._fetch_movie(movie_id, client)
+                if movie is not None:
+                    await queue.put(movie)
+                    get_metrics().set_gauge("queue_depth", queue.qsize(), stage="movie_details")
+
+        try:
+            async with self._get_client() as client:
+                await asyncio.gather(*[worker(client) for _ in range(self.max_concurrency)])
+        finally:
+            progress.flush()
+            await queue.put(self.END_OF_STREAM)
 
     async def _fetch_movie(self, movie_id: int, client: httpx.AsyncClient) -> Dict[str, Any]:
-        async with self.semaphore:
-            movie = MovieDetails(movie_id=movie_id, client=client)
-            return await movie.get_complied_data()
+        waiting = time.perf_counter()
+        async with self.controller.slot() if self.controller else self.semaphore:
+            get_metrics().observe("semaphore_wait_seconds", time.perf_counter() - waiting, stage="movie_details")
+            movie = MovieDetails(movie_id=movie_id, client=client, project=self.project, controller=self.controller, revalidate=self.revalidate)
+            data = await movie.get_complied_data()
+        if data is not None:
+            get_metrics().inc("items_total", stage="movies")
+        if movie.failed and self.dead_letters is not None:
+            # written from a worker thread, the failures don't hold up the event loop
+            await asyncio.to_thread(self._record_failure, movie_id, movie)
+        return data
+
+    def _record_failure(self, movie_id: int, movie: MovieDetails) -> None:
+        cause, status_code = get_cause(movie.error)
+        self.dead_letters.add("movie", movie_id, {"movie_id": movie_id}, cause=f"{', '.join(movie.failed)}: {cause}", year=self.year, status_code=status_code)
 
     async def main(self):
         results = await self.fetch_all_movies()
@@ -44,17 +127,11 @@ class RunMovieDetails:
     
 
 if __name__ == "__main__":
-    # import pandas as pd
-    # movie_ids = pd.read_csv(r"C:\Users\karti\Documents\dvd_rental\data\temp\movies_id.csv")["id"].tolist()
     movie_ids = [155]
-    
-    obj = RunMovieDetails(movie_ids=movie_ids)
+
+    obj = RunMovieDetails(movie_ids=movie_ids, project=False)
     movies = asyncio.run(obj.main())
-    
-    # # let's store this data into a json file
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    output_path = os.path.join(script_dir, "movie_details.json")
-    with open(output_path, "w", encoding="utf-8") as f:
-        f.write('{"results": ')
-        json.dump(movies, f, indent=4)
-        f.write('}')
\ No newline at end of file
+
+    # append the raw payloads to the landing zone, partitioned by their release year, see `landing/run_replay.py` to load them
+    written = LandingZone().write(movies)
+    logger.info(f"Total {written} movies written to the landing zone")
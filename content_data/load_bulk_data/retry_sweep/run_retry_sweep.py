@@ -0,0 +1,170 @@
+"""
+This file contains the retry sweep, which re-drives the pages and movies recorded in the `DeadLetterStore`
+once the main run has finished.
+
+The sweep runs apart from the main path, with its own (lower) concurrency and rate limit, in batches:
+    - the failed discover pages are fetched again, their new ids are fetched and loaded with the failed movies,
+    - the failed movies are fetched again, grouped by year, and loaded into every collection.
+
+The recovered work is removed from the dead letters, what fails again has its attempt counted
+and is left out of the sweeps once it reached `max_attempts`.
+"""
+
+# external imports
+import asyncio
+from typing import Any, Dict, List, Optional, Tuple
+
+# local imports
+from ..fetch_ids.run_fetch_ids import RunFetchIDs
+from ..load_movie_details.run_movie_details import RunMovieDetails
+from ..landing.landing_zone import LandingZone
+from ..load_mongo.mongo_loader import MongoLoader
+from ..load_mongo.projection import project_movie
+from ..utils.concurrency import ConcurrencyController
+from ..utils.dead_letters import DeadLetterStore
+from ..utils.progress_store import ProgressStore
+from ...base_log import Logger
+
+logger = Logger('run_retry_sweep').get_logger()
+
+COLLECTIONS = ["movies", "images", "videos", "people"]
+PARTS = ["details", "credits", "images", "videos"]
+# the part of a movie each collection is loaded from
+COLLECTION_PARTS = {"movies": "details", "images": "images", "videos": "videos", "people": "credits"}
+
+
+class RunRetrySweep:
+    """
+    This class re-drives the dead letters of the pipelines.
+    It sets configurations as follows:
+
+        - `self.loader`: `MongoLoader` the recovered movies are loaded with.
+        - `self.dead_letters`: `DeadLetterStore` to sweep.
+        - `self.progress_store`: Optional `ProgressStore`, the recovered pages and movies are checkpointed in it.
+        - `self.year`: Only the dead letters of this year, all of them if `None`.
+        - `self.kinds`: Kinds of dead letters to sweep (`page`, `movie`). Defaults to both.
+        - `self.batch_size`: Number of pages or movies re-driven at once. Defaults to `500`.
+        - `self.max_concurrency`: Number of requests in flight. Defaults to `5`.
+        - `self.controller`: Optional `ConcurrencyController` replacing `max_concurrency`.
+        - `self.max_attempts`: Dead letters which failed this many times are left out. Defaults to `5`.
+        - `self.landing`: Optional `LandingZone` the raw recovered movies are appended to, like the movies of the main run.
+
+    #### Notes:
+        - A movie is only resolved once its details, credits, images and videos were all fetched,
+        a movie still missing a part is loaded with what was fetched and stays in the dead letters.
+        It is only checkpointed in the collections of the parts which were fetched, hence a backfill
+        of its year still resumes it.
+        - The rate of the sweep is the one of the shared rate limiter, see `configure_rate_limiter`.
+
+    #### Example Usage:
+
+        >>> obj = RunRetrySweep(loader=MongoLoader(db=db), dead_letters=DeadLetterStore(), progress_store=ProgressStore())
+        >>> report = obj.run()
+        {'pages': 3, 'pages_recovered': 3, 'ids_recovered': 60, 'movies': 72, 'movies_recovered': 70, 'movies_failed': 2}
+    """
+    def __init__(self, loader: MongoLoader, dead_letters: DeadLetterStore, progress_store: ProgressStore = None, year: int = None, kinds: List[str] = None, batch_size: int = 500, max_concurrency: int = 5, controller: ConcurrencyController = None, max_attempts: int = 5, landing: LandingZone = None) -> None:
+        self.loader = loader
+        self.dead_letters = dead_letters
+        self.progress_store = progress_store
+        self.year = year
+        self.kinds = kinds or ["page", "movie"]
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.controller = controller
+        self.max_attempts = max_attempts
+        self.landing = landing
+
+    @staticmethod
+    def _get_batches(items: List[Any], size: int) -> List[List[Any]]:
+        return [items[start:start + size] for start in range(0, len(items), size)]
+
+    async def sweep_pages_async(self) -> Tuple[Dict[Optional[int], List[int]], Dict[str, int]]:
+        """
+        Fetch the failed discover pages again.
+
+        Returns:
+            Tuple[Dict[Optional[int], List[int]], Dict[str, int]]: The new movie ids of the recovered pages per year, and the counts of the sweep.
+        """
+        letters = await asyncio.to_thread(self.dead_letters.get, "page", year=self.year, max_attempts=self.max_attempts)
+        groups: Dict[Tuple[int, str], List[Dict[str, Any]]] = {}
+        for letter in letters:
+            groups.setdefault((letter["year"], letter["payload"]["type"]), []).append(letter)
+
+        new_ids: Dict[Optional[int], List[int]] = {}
+        report = {"pages": len(letters), "pages_recovered": 0, "ids_recovered": 0}
+        for (year, type), group in groups.items():
+            obj = RunFetchIDs(year=year, type=type, max_concurrency=self.max_concurrency, progress_store=self.progress_store, controller=self.controller, dead_letters=self.dead_letters)
+            for batch in self._get_batches(group, self.batch_size):
+                pages = [(letter["payload"]["start_date"], letter["payload"]["end_date"], letter["payload"]["page"]) for letter in batch]
+                ids, fetched = await obj.fetch_pages_async(pages)
+                fetched = set(fetched)
+                await asyncio.to_thread(self.dead_letters.resolve, "page", [letter["key"] for letter, page in zip(batch, pages) if page in fetched])
+                report["pages_recovered"] += len(fetched)
+                report["ids_recovered"] += len(ids)
+                # only the movies are loaded by the pipelines, the ids of the other types are only checkpointed
+                if type == "movies" and ids:
+                    new_ids.setdefault(year, []).extend(await asyncio.to_thread(lambda: self.loader.get_new_ids(ids).tolist()))
+        logger.info(f"Recovered {report['pages_recovered']} of {report['pages']} failed pages, holding {report['ids_recovered']} ids")
+        return new_ids, report
+
+    def _land(self, movies: List[Dict[str, Any]], year: Optional[int]) -> List[Dict[str, Any]]:
+        self.landing.write(movies, year)
+        return [project_movie(movie) for movie in movies]
+
+    def _checkpoint(self, movies: List[Dict[str, Any]], year: int) -> None:
+        self.progress_store.mark_movies_fetched(year, [movie["id"] for movie in movies])
+        for collection in COLLECTIONS:
+            part = COLLECTION_PARTS[collection]
+            self.progress_store.mark_loaded(year, collection, [movie["id"] for movie in movies if movie.get(part) is not None])
+
+    async def _load(self, movies: List[Dict[str, Any]], year: Optional[int]) -> None:
+        if self.landing is not None:
+            movies = await asyncio.to_thread(self._land, movies, year)
+        await asyncio.to_thread(self.loader.load_movies, movies, year)
+        if self.progress_store is not None and year is not None:
+            await asyncio.to_thread(self._checkpoint, movies, year)
+
+    async def sweep_movies_async(self, new_ids: Dict[Optional[int], List[int]] = None) -> Dict[str, int]:
+        """
+        Fetch the failed movies (and the `new_ids` of the recovered pages) again, and load them.
+
+        Returns:
+            Dict[str, int]: Number of movies swept, recovered and still failing.
+        """
+        letters = await asyncio.to_thread(self.dead_letters.get, "movie", year=self.year, max_attempts=self.max_attempts)
+        years: Dict[Optional[int], Dict[int, None]] = {}
+        for letter in letters:
+            years.setdefault(letter["year"], {})[letter["payload"]["movie_id"]] = None
+        for year, movie_ids in (new_ids or {}).items():
+            years.setdefault(year, {}).update(dict.fromkeys(movie_ids))
+
+        report = {"movies": sum(len(movie_ids) for movie_ids in years.values()), "movies_recovered": 0, "movies_failed": 0}
+        for year, movie_ids in years.items():
+            for batch in self._get_batches(list(movie_ids), self.batch_size):
+                obj = RunMovieDetails(movie_ids=batch, max_concurrency=self.max_concurrency, controller=self.controller, dead_letters=self.dead_letters, year=year, project=self.landing is None)
+                movies = [movie for movie in await obj.main() if movie]
+                if movies:
+                    await self._load(movies, year)
+                recovered = [movie["id"] for movie in movies if all(movie.get(part) is not None for part in PARTS)]
+                await asyncio.to_thread(self.dead_letters.resolve, "movie", recovered)
+                report["movies_recovered"] += len(recovered)
+                report["movies_failed"] += len(batch) - len(recovered)
+        logger.info(f"Recovered {report['movies_recovered']} of {report['movies']} movies, {report['movies_failed']} still failing")
+        return report
+
+    async def run_async(self) -> Dict[str, int]:
+        """
+        Sweep the failed pages, then the failed movies along with the new ids of the recovered pages.
+
+        Returns:
+            Dict[str, int]: The counts of the sweep.
+        """
+        new_ids, report = {}, {}
+        if "page" in self.kinds:
+            new_ids, report = await self.sweep_pages_async()
+        if "movie" in self.kinds:
+            report.update(await self.sweep_movies_async(new_ids))
+        return report
+
+    def run(self) -> Dict[str, int]:
+        return asyncio.run(self.run_async())
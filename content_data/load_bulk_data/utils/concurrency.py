@@ -0,0 +1,133 @@
+"""
+This file contains the adaptive (AIMD) concurrency controller of the async stages.
+
+Instead of a fixed `asyncio.Semaphore`, the number of requests in flight follows what TMDB and the network can take:
+it grows additively while the responses are healthy and is cut multiplicatively on a `429`,
+a `5xx`, a timeout or a latency spike, the same way TCP finds the capacity of a link.
+A latency spike is a share of slow responses over the recent window, not a single slow response,
+hence the usual tail latency (e.g. of the large images) does not lower the limit.
+"""
+
+# external imports
+import time
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Optional
+
+# local imports
+from .metrics import get_metrics
+from ...base_log import Logger
+
+logger = Logger('concurrency').get_logger()
+
+
+class ConcurrencyController:
+    """
+    Additive increase, multiplicative decrease limit of the requests in flight of a stage.
+    It sets configurations as follows:
+
+        - `self.name`: Name of the stage, used in the logs and metrics.
+        - `self.limit`: Current limit, starts at `initial`.
+        - `self.min_limit`, `self.max_limit`: Bounds of the limit. Default to `1` and `50`.
+        - `self.increase`: The limit grows by `increase` once every `limit` healthy responses. Defaults to `1`.
+        - `self.decrease`: Factor the limit is multiplied by on congestion. Defaults to `0.5`.
+        - `self.latency_factor`: A response slower than `latency_factor` times the usual latency is slow. Defaults to `3`.
+        - `self.window`: Number of recent responses the slow ones are counted over. Defaults to `50`.
+        - `self.slow_fraction`: Share of slow responses in the window which counts as congestion. Defaults to `0.2`.
+
+    #### Notes:
+        - The usual latency is an exponentially weighted average of the response times over about `window` responses,
+        hence a lasting change of the latency becomes the new normal rather than congestion forever.
+        - A `429`, a `5xx` or a timeout is congestion right away, slow responses only once they fill
+        `slow_fraction` of a full window. The window starts over after every decrease.
+        - The limit is cut at most once per cooldown (twice the usual latency, at least a second),
+        the failures of one burst of requests are a single congestion signal.
+        - It is meant for a single event loop, like the `asyncio.Semaphore` it replaces.
+
+    #### Example Usage:
+
+        >>> controller = ConcurrencyController(name="movie_details", initial=10, min_limit=2, max_limit=50)
+        >>> async with controller.slot():
+        ...     start = time.perf_counter()
+        ...     response = await client.get(url)
+        ...     controller.record(time.perf_counter() - start, congested=response.status_code == 429)
+    """
+    def __init__(self, name: str = "default", initial: int = 10, min_limit: int = 1, max_limit: int = 50, increase: float = 1.0, decrease: float = 0.5, latency_factor: float = 3.0, window: int = 50, slow_fraction: float = 0.2) -> None:
+        if min_limit < 1 or max_limit < min_limit or not 0 < decrease < 1:
+            raise ValueError(f"Invalid concurrency bounds: min_limit={min_limit}, max_limit={max_limit}, decrease={decrease}")
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(min(max(initial, min_limit), max_limit))
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+        self.window = window
+        self.slow_fraction = slow_fraction
+        self.in_flight = 0
+        self._latency: Optional[float] = None
+        self._last_decrease = 0.0
+        # whether each of the last `window` responses was slow
+        self._slow: Deque[bool] = deque(maxlen=window)
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    async def acquire(self) -> None:
+        while self.in_flight >= int(self.limit):
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                raise
+        self.in_flight += 1
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self) -> None:
+        free = int(self.limit) - self.in_flight
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def record(self, seconds: float, congested: bool = False) -> None:
+        """
+        Record the outcome of a request, `congested` being a `429`, a `5xx` or a timeout.
+        """
+        self._slow.append(self._latency is not None and seconds > self.latency_factor * self._latency)
+        if not congested and len(self._slow) == self.window and sum(self._slow) >= self.slow_fraction * self.window:
+            congested = True
+        # averaged over about a window, so a spike fills the window before it becomes the usual latency
+        self._latency = seconds if self._latency is None else self._latency + (seconds - self._latency) / self.window
+
+        if congested:
+            self._decrease()
+        elif self.limit < self.max_limit:
+            self.limit = min(self.max_limit, self.limit + self.increase / self.limit)
+            self._wake()
+        get_metrics().set_gauge("concurrency_limit", int(self.limit), stage=self.name)
+
+    def _decrease(self) -> None:
+        now = time.monotonic()
+        if now - self._last_decrease < max(2 * (self._latency or 0), 1.0):
+            return
+        self._last_decrease = now
+        self._slow.clear()
+        previous = int(self.limit)
+        self.limit = max(self.min_limit, self.limit * self.decrease)
+        if int(self.limit) < previous:
+            logger.warning(f"⚠️ Congestion on {self.name}, concurrency lowered from {previous} to {int(self.limit)}")
@@ -0,0 +1,164 @@
+"""
+This file contains the durable dead-letter store of the work the pipelines gave up on.
+
+A discover page or a movie which still fails after its retries is recorded here with the cause of its last failure,
+instead of only being logged, and the main run moves on. The retry sweep (`retry_sweep/run_retry_sweep.py`)
+re-drives the recorded work once the main run has finished, and removes what it recovers.
+
+The dead letters are kept in a local SQLite database next to the progress store, keyed by their kind and key:
+    - `page`: a discover page, keyed by `<year>:<type>:<start_date>:<end_date>:<page>`,
+    - `movie`: a movie whose details (or one of its credits, images and videos) could not be fetched, keyed by its id.
+"""
+
+# external imports
+import os
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# local imports
+from .metrics import get_metrics
+from ...base_log import Logger
+
+logger = Logger('dead_letters').get_logger()
+
+content_data_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+DEFAULT_PATH = os.path.join(content_data_dir, "tmdb_checkpoints", "dead_letters.sqlite3")
+KINDS = ["page", "movie"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dead_letters (
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    year INTEGER,
+    payload TEXT NOT NULL,
+    cause TEXT NOT NULL,
+    status_code INTEGER,
+    attempts INTEGER NOT NULL DEFAULT 1,
+    first_failed_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    last_failed_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (kind, key)
+);
+"""
+
+
+def get_cause(error: Optional[BaseException]) -> Tuple[str, Optional[int]]:
+    """
+    Describe the error a piece of work failed with.
+
+    Returns:
+        Tuple[str, Optional[int]]: The type and message of the error, and the HTTP status code of the response if there was one.
+    """
+    if error is None:
+        return "unknown", None
+    response = getattr(error, "response", None)
+    status_code = getattr(response, "status_code", None)
+    return f"{type(error).__name__}: {error}"[:500], status_code
+
+
+class DeadLetterStore:
+    """
+    This class records the pages and movies the pipelines gave up on, with the cause of their last failure.
+    Like the `ProgressStore`, a single connection is guarded by a lock and every write is committed right away,
+    hence a crash never loses a dead letter.
+
+    #### Notes:
+        - The database defaults to `tmdb_checkpoints/dead_letters.sqlite3`.
+        - Recording the same work again updates its cause and counts the attempt, the sweep leaves
+        the dead letters which reached its `max_attempts` for a human to look at.
+
+    #### Example Usage:
+
+        >>> dead_letters = DeadLetterStore()
+        >>> dead_letters.add("movie", 550, {"movie_id": 550}, cause="ReadTimeout: ", year=1999)
+        >>> dead_letters.get("movie", max_attempts=5)
+        [{'kind': 'movie', 'key': '550', 'year': 1999, 'payload': {'movie_id': 550}, 'cause': 'ReadTimeout: ', ...}]
+        >>> dead_letters.resolve("movie", [550])
+    """
+    def __init__(self, path: str = DEFAULT_PATH) -> None:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def add(self, kind: str, key: Any, payload: Dict[str, Any], cause: str, year: int = None, status_code: int = None) -> None:
+        """
+        Record a piece of work given up on, or count one more failed attempt of it.
+        """
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT INTO dead_letters (kind, key, year, payload, cause, status_code) VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (kind, key) DO UPDATE SET
+                    cause = excluded.cause, status_code = excluded.status_code,
+                    attempts = attempts + 1, last_failed_at = CURRENT_TIMESTAMP
+                """,
+                (kind, str(key), year, json.dumps(payload), cause, status_code),
+            )
+            self._conn.commit()
+        get_metrics().inc("dead_letters_total", kind=kind)
+
+    def get(self, kind: str, year: int = None, max_attempts: int = None) -> List[Dict[str, Any]]:
+        """
+        Get the dead letters of a kind, of a single year if given, leaving out the ones which failed `max_attempts` times.
+        """
+        query = "SELECT kind, key, year, payload, cause, status_code, attempts, first_failed_at, last_failed_at FROM dead_letters WHERE kind = ?"
+        params: List[Any] = [kind]
+        if year is not None:
+            query += " AND year = ?"
+            params.append(year)
+        if max_attempts is not None:
+            query += " AND attempts < ?"
+            params.append(max_attempts)
+        with self._lock:
+            rows = self._conn.execute(query + " ORDER BY year, key", params).fetchall()
+        columns = ["kind", "key", "year", "payload", "cause", "status_code", "attempts", "first_failed_at", "last_failed_at"]
+        letters = [dict(zip(columns, row)) for row in rows]
+        for letter in letters:
+            letter["payload"] = json.loads(letter["payload"])
+        return letters
+
+    def resolve(self, kind: str, keys: Iterable[Any]) -> int:
+        """
+        Remove the dead letters of the recovered work.
+
+        Returns:
+            int: Number of dead letters removed.
+        """
+        keys = [(kind, str(key)) for key in keys]
+        if not keys:
+            return 0
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany("DELETE FROM dead_letters WHERE kind = ? AND key = ?", keys)
+            self._conn.commit()
+            removed = self._conn.total_changes - before
+        get_metrics().inc("dead_letters_resolved_total", removed, kind=kind)
+        return removed
+
+    def get_counts(self) -> Dict[str, int]:
+        """
+        Get the number of dead letters of every kind.
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT kind, COUNT(*) FROM dead_letters GROUP BY kind").fetchall()
+        return {kind: 0 for kind in KINDS} | dict(rows)
+
+    def clear(self, kind: str = None) -> None:
+        with self._lock:
+            if kind is None:
+                self._conn.execute("DELETE FROM dead_letters")
+            else:
+                self._conn.execute("DELETE FROM dead_letters WHERE kind = ?", (kind,))
+            self._conn.commit()
+        logger.info(f"Cleared the dead letters{f' of kind {kind}' if kind else ''}")
@@ -0,0 +1,110 @@
+"""
+This file contains the compact set of TMDB ids used between the stages of the pipelines.
+
+The ids are kept as a sorted, deduplicated `array` of 64 bit integers (8 bytes per id instead of
+a Python int in a list), the ids added are buffered and merged into the array in chunks.
+"""
+
+# external imports
+import heapq
+from array import array
+from bisect import bisect_left
+from typing import Iterable, Iterator, List, Union
+
+MERGE_THRESHOLD = 10_000
+
+
+class IDSet:
+    """
+    A sorted set of integer ids backed by an `array('q')`.
+
+    #### Notes:
+        - Adding is cheap, the ids are buffered and merged into the sorted array once the buffer is large,
+        or when the set is read.
+        - Iterating yields the ids in ascending order, indexing and slicing work as on a list.
+
+    #### Example Usage:
+
+        >>> ids = IDSet([550, 155])
+        >>> ids.update([155, 27205])
+        >>> list(ids)
+        [155, 550, 27205]
+        >>> ids.difference([550])
+        IDSet([155, 27205])
+    """
+    def __init__(self, ids: Iterable[int] = ()) -> None:
+        self._ids = array("q")
+        self._pending: List[int] = []
+        self.update(ids)
+
+    def update(self, ids: Iterable[int]) -> None:
+        self._pending.extend(int(movie_id) for movie_id in ids if movie_id is not None)
+        if len(self._pending) >= MERGE_THRESHOLD:
+            self._merge()
+
+    def add(self, movie_id: int) -> None:
+        self.update((movie_id,))
+
+    def _merge(self) -> None:
+        if not self._pending:
+            return
+        merged = array("q")
+        previous = None
+        for movie_id in heapq.merge(self._ids, sorted(self._pending)):
+            if movie_id != previous:
+                merged.append(movie_id)
+                previous = movie_id
+        self._ids = merged
+        self._pending = []
+
+    def _get_ids(self) -> array:
+        self._merge()
+        return self._ids
+
+    def __len__(self) -> int:
+        return len(self._get_ids())
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._get_ids())
+
+    def __contains__(self, movie_id: int) -> bool:
+        ids = self._get_ids()
+        index = bisect_left(ids, movie_id)
+        return index < len(ids) and ids[index] == movie_id
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[int, "IDSet"]:
+        if isinstance(index, slice):
+            sliced = IDSet()
+            sliced._ids = self._get_ids()[index]
+            return sliced
+        return self._get_ids()[index]
+
+    def __repr__(self) -> str:
+        ids = self._get_ids()
+        preview = ", ".join(map(str, ids[:10])) + (", ..." if len(ids) > 10 else "")
+        return f"IDSet([{preview}])"
+
+    def difference(self, ids: Iterable[int]) -> "IDSet":
+        """
+        Get the ids of this set which are not in `ids`.
+        """
+        excluded = ids if isinstance(ids, (IDSet, set, frozenset)) else set(ids)
+        result = IDSet()
+        result._ids = array("q", (movie_id for movie_id in self._get_ids() if movie_id not in excluded))
+        return result
+
+    def chunks(self, size: int) -> Iterator[List[int]]:
+        """
+        Iterate over the ids in lists of at most `size`, e.g. for `$in` queries.
+        """
+        ids = self._get_ids()
+        for start in range(0, len(ids), size):
+            yield ids[start:start + size].tolist()
+
+    def tolist(self) -> List[int]:
+        return self._get_ids().tolist()
+
+    @property
+    def nbytes(self) -> int:
+        ids = self._get_ids()
+        return ids.itemsize * len(ids)
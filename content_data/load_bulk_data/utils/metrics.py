@@ -0,0 +1,273 @@
+"""
+This file contains the process wide metrics shared by every stage of the pipelines.
+
+The stages record counters, gauges and latency histograms by name and labels, e.g.::
+
+    metrics = get_metrics()
+    metrics.inc("tmdb_responses_total", endpoint="/movie/{id}", status=200)
+    metrics.observe("mongo_write_seconds", 0.042, collection="movies")
+
+At the end of a run the drivers write them out with `write`, as a Prometheus text file
+(for the node exporter textfile collector) and a JSON summary, so we can see whether the wall time
+goes to the rate limiter, the network or MongoDB.
+
+It contains the helpers:
+    - `get_metrics`: Returns the shared `Metrics` of the process.
+    - `get_endpoint_label`: Turns a TMDB url into its endpoint label, e.g. `/movie/{id}/credits`.
+"""
+
+# external imports
+import os
+import re
+import json
+import time
+import bisect
+import threading
+from pathlib import Path
+from urllib.parse import urlparse
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+content_data_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+DEFAULT_DIR = os.path.join(content_data_dir, "tmdb_metrics")
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+PREFIX = "tmdb_pipeline_"
+
+HELP = {
+    "tmdb_request_seconds": "Latency of the TMDB requests sent, per endpoint.",
+    "tmdb_responses_total": "TMDB responses per endpoint and status code.",
+    "tmdb_response_bytes_total": "Bytes received from TMDB per endpoint.",
+    "tmdb_cache_hits_total": "TMDB requests answered by the response cache.",
+    "tmdb_retries_total": "TMDB requests retried, per endpoint and reason.",
+    "tmdb_give_ups_total": "TMDB requests given up on after all the retries.",
+    "rate_limiter_wait_seconds": "Time waited for a token of the rate limiter.",
+    "semaphore_wait_seconds": "Time waited for a concurrency slot, per stage.",
+    "mongo_write_seconds": "Latency of the MongoDB bulk writes, per collection.",
+    "mongo_documents_written_total": "Documents upserted or replaced, per collection.",
+    "read_model_refills_total": "Top lists of the read models refilled from the movies collection.",
+    "items_total": "Items produced by every stage (ids, movies).",
+    "queue_depth": "Items waiting on the queue between the fetching and the loading.",
+    "assets_downloaded_total": "Images downloaded into the asset store, per size.",
+    "asset_bytes_total": "Bytes of the images downloaded, per size.",
+    "asset_download_seconds": "Latency of the image downloads (first byte to stored), per size.",
+    "asset_give_ups_total": "Images given up on, per size and reason.",
+    "concurrency_limit": "Requests in flight allowed by the adaptive concurrency controller, per stage.",
+    "dead_letters_total": "Pages and movies given up on and recorded in the dead-letter store, per kind.",
+    "dead_letters_resolved_total": "Dead letters recovered by the retry sweep, per kind.",
+    "landing_movies_written_total": "Raw movies appended to the landing zone.",
+    "landing_bytes_written_total": "Compressed bytes appended to the landing zone, per compression.",
+    "export_rows_total": "Rows written to the Parquet files, per export.",
+    "export_bytes_total": "Bytes of the Parquet files written, per export.",
+    "export_partition_seconds": "Time taken to write the Parquet file of a partition, per export.",
+}
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def get_endpoint_label(url: str) -> str:
+    """
+    Turn a TMDB url into its endpoint label, the ids and the API version are replaced so the label has a small cardinality.
+    """
+    path = re.sub(r"/\d+(?=/|$)", "/{id}", urlparse(url).path)
+    return re.sub(r"^/\{id\}", "", path) or "/"
+
+
+def get_written(result: Dict[str, Any]) -> int:
+    """
+    Count the documents a bulk write upserted or matched, from its `bulk_api_result` (or the details of its `BulkWriteError`).
+    `nModified` is left out, the documents it counts are already among the matched ones.
+    """
+    return result.get("nUpserted", 0) + result.get("nMatched", 0)
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def get_quantile(self, quantile: float) -> float:
+        """
+        Estimate the quantile by interpolating linearly inside its bucket, as Prometheus does.
+        """
+        if not self.count:
+            return 0.0
+        rank = quantile * self.count
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            if cumulative + count >= rank and count:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+
+class Metrics:
+    """
+    Registry of the counters, gauges and histograms of a run.
+    Every metric is keyed by its name and labels, the registry is guarded by a lock
+    hence it can be used from the event loop and from the worker threads alike.
+
+    #### Example Usage:
+
+        >>> metrics = get_metrics()
+        >>> metrics.inc("items_total", 20, stage="ids")
+        >>> with metrics.timer("mongo_write_seconds", collection="movies"):
+        ...     collection.bulk_write(operations)
+        >>> metrics.write("yearly_data")
+    """
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.started_at = time.time()
+            self.counters: Dict[str, Dict[LabelKey, float]] = {}
+            self.gauges: Dict[str, Dict[LabelKey, Tuple[float, float]]] = {}
+            self.histograms: Dict[str, Dict[LabelKey, Histogram]] = {}
+
+    @staticmethod
+    def _get_label_key(labels: Dict[str, Any]) -> LabelKey:
+        return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = self._get_label_key(labels)
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels) -> None:
+        """
+        Set the gauge, its maximum over the run is kept along with the last value.
+        """
+        key = self._get_label_key(labels)
+        with self._lock:
+            series = self.gauges.setdefault(name, {})
+            _, maximum = series.get(key, (0, value))
+            series[key] = (value, max(maximum, value))
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = self._get_label_key(labels)
+        with self._lock:
+            series = self.histograms.setdefault(name, {})
+            if key not in series:
+                series[key] = Histogram()
+            series[key].observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    @staticmethod
+    def _format_labels(key: LabelKey, extra: Optional[Dict[str, str]] = None) -> str:
+        labels = list(key) + list((extra or {}).items())
+        if not labels:
+            return ""
+        values = ",".join(f'{k}="{str(v)}"' for k, v in labels)
+        return f"{{{values}}}"
+
+    def to_prometheus(self) -> str:
+        """
+        Render the metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        with self._lock:
+            for name, series in sorted(self.counters.items()):
+                lines += [f"# HELP {PREFIX}{name} {HELP.get(name, name)}", f"# TYPE {PREFIX}{name} counter"]
+                lines += [f"{PREFIX}{name}{self._format_labels(key)} {value}" for key, value in sorted(series.items())]
+            for name, series in sorted(self.gauges.items()):
+                lines += [f"# HELP {PREFIX}{name} {HELP.get(name, name)}", f"# TYPE {PREFIX}{name} gauge"]
+                lines += [f"{PREFIX}{name}{self._format_labels(key)} {value}" for key, (value, _) in sorted(series.items())]
+            for name, series in sorted(self.histograms.items()):
+                lines += [f"# HELP {PREFIX}{name} {HELP.get(name, name)}", f"# TYPE {PREFIX}{name} histogram"]
+                for key, histogram in sorted(series.items()):
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else str(bound)
+                        lines.append(f"{PREFIX}{name}_bucket{self._format_labels(key, {'le': le})} {cumulative}")
+                    lines.append(f"{PREFIX}{name}_sum{self._format_labels(key)} {histogram.sum}")
+                    lines.append(f"{PREFIX}{name}_count{self._format_labels(key)} {histogram.count}")
+            lines += [
+                f"# HELP {PREFIX}run_seconds Wall time of the run.",
+                f"# TYPE {PREFIX}run_seconds gauge",
+                f"{PREFIX}run_seconds {time.time() - self.started_at}",
+            ]
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Summarize the metrics, the histograms by their count, total, mean and quantiles,
+        and the counters along with their rate per second of the run.
+        """
+        with self._lock:
+            elapsed = max(time.time() - self.started_at, 1e-9)
+
+            def label(key: LabelKey) -> str:
+                return ",".join(f"{k}={v}" for k, v in key) or "total"
+
+            return {
+                "started_at": self.started_at,
+                "run_seconds": round(elapsed, 3),
+                "counters": {
+                    name: {label(key): {"value": value, "per_second": round(value / elapsed, 3)} for key, value in sorted(series.items())}
+                    for name, series in sorted(self.counters.items())
+                },
+                "gauges": {
+                    name: {label(key): {"value": value, "max": maximum} for key, (value, maximum) in sorted(series.items())}
+                    for name, series in sorted(self.gauges.items())
+                },
+                "histograms": {
+                    name: {
+                        label(key): {
+                            "count": histogram.count,
+                            "total_seconds": round(histogram.sum, 3),
+                            "mean": round(histogram.sum / histogram.count, 4) if histogram.count else 0.0,
+                            "p50": round(histogram.get_quantile(0.5), 4),
+                            "p95": round(histogram.get_quantile(0.95), 4),
+                            "p99": round(histogram.get_quantile(0.99), 4),
+                        }
+                        for key, histogram in sorted(series.items())
+                    }
+                    for name, series in sorted(self.histograms.items())
+                },
+            }
+
+    def write(self, name: str, directory: str = DEFAULT_DIR) -> Tuple[str, str]:
+        """
+        Write the metrics of the run to `<directory>/<name>.prom` and `<directory>/<name>.json`.
+        The files are replaced atomically so a collector never reads a half written file.
+
+        Returns:
+            Tuple[str, str]: Paths of the Prometheus text file and of the JSON summary.
+        """
+        Path(directory).mkdir(parents=True, exist_ok=True)
+        prom_path = os.path.join(directory, f"{name}.prom")
+        json_path = os.path.join(directory, f"{name}.json")
+        for path, content in ((prom_path, self.to_prometheus()), (json_path, json.dumps(self.to_dict(), indent=4))):
+            with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+                f.write(content)
+            os.replace(f"{path}.tmp", path)
+        return prom_path, json_path
+
+
+_metrics = Metrics()
+
+
+def get_metrics() -> Metrics:
+    """
+    Get the shared metrics of the process.
+    """
+    return _metrics
@@ -0,0 +1,79 @@
+"""
+This file contains the process wide MongoDB clients.
+
+A `MongoClient` holds a pool of connections and is meant to be created once per process,
+hence the clients are created lazily on first use and shared by every caller of the same connection string.
+
+It contains the helpers:
+    - `get_mongo_client`: Returns the shared (sync) `MongoClient`.
+    - `get_motor_client`: Returns the shared async `AsyncIOMotorClient` of the running event loop.
+    - `close_mongo_clients`: Closes all the shared clients, it is also called at exit.
+"""
+
+# external imports
+import atexit
+import asyncio
+import threading
+from typing import Any, Dict, Tuple
+from pymongo import MongoClient
+
+# local imports
+from ...base_log import Logger
+
+logger = Logger('mongo_clients').get_logger()
+
+_clients: Dict[str, MongoClient] = {}
+_motor_clients: Dict[Tuple[str, int], Any] = {}
+_lock = threading.Lock()
+
+
+def get_mongo_client(connection_string: str, **options) -> MongoClient:
+    """
+    Get the shared `MongoClient` of the connection string, it is created with the given options on the first call.
+    """
+    with _lock:
+        client = _clients.get(connection_string)
+        if client is None:
+            client = MongoClient(connection_string, **options)
+            _clients[connection_string] = client
+            logger.info(f"Created MongoDB client with options: {options}")
+        return client
+
+
+def get_motor_client(connection_string: str, **options) -> Any:
+    """
+    Get the shared `AsyncIOMotorClient` of the connection string for the running event loop.
+    A motor client is bound to the event loop it is first used on,
+    hence every `asyncio.run` of the pipelines gets its own client.
+
+    **NOTE: `motor` is an optional dependency, it is only needed for the async write path.**
+    """
+    try:
+        from motor.motor_asyncio import AsyncIOMotorClient
+    except ImportError as e:
+        raise ImportError("The async MongoDB write path needs motor, install it with `pip install motor`.") from e
+
+    loop = asyncio.get_running_loop()
+    key = (connection_string, id(loop))
+    with _lock:
+        client = _motor_clients.get(key)
+        if client is None:
+            # drop the clients of event loops which are closed by now
+            for stale_key in [k for k, c in _motor_clients.items() if c.io_loop.is_closed()]:
+                _motor_clients.pop(stale_key).close()
+            client = AsyncIOMotorClient(connection_string, io_loop=loop, **options)
+            _motor_clients[key] = client
+        return client
+
+
+def close_mongo_clients() -> None:
+    with _lock:
+        for client in _clients.values():
+            client.close()
+        for client in _motor_clients.values():
+            client.close()
+        _clients.clear()
+        _motor_clients.clear()
+
+
+atexit.register(close_mongo_clients)
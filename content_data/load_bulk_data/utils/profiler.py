@@ -0,0 +1,307 @@
+"""
+This file contains the process wide profiler of the stages of a pipeline run.
+
+A driver enables it with `configure_profiler` and wraps its stages in `stage`, the deeper steps which run
+many times inside a stage (e.g. the JSON decoding of every response) are timed with `timed`::
+
+    profiler = configure_profiler(name="yearly_data", mode="sample", trace_memory=True)
+    with profiler.stage("discovery"):
+        ids = obj.fetch_yearly_data()
+    ...
+    with get_profiler().timed("json_decode"):
+        payload = loads(response.content)
+
+For every stage the report holds its calls, wall time, CPU time of the process and peak memory, and optionally
+    - `mode="cprofile"`: the top functions of `cProfile` by cumulative time (the calling thread only),
+    - `mode="sample"`: the top functions of a sampling profiler, which reads the stacks of every thread
+    every `interval` seconds (the threads waiting idle on a lock, queue or socket are left out),
+    - `trace_memory=True`: the peak of the memory traced by `tracemalloc` and the top allocation sites.
+The steps timed with `timed` report their calls, wall time and CPU time of their thread.
+
+`write` puts the report in `tmdb_logs/profile_<name>_<time>.txt` and `.json`. Until it is configured,
+`get_profiler` returns a disabled profiler whose `stage` and `timed` do nothing, hence they stay in the code.
+"""
+
+# external imports
+import io
+import os
+import sys
+import json
+import time
+import pstats
+import cProfile
+import resource
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# local imports
+from ...base_log import log_dir
+
+DEFAULT_DIR = os.path.join(log_dir, "tmdb_logs")
+MODES = ["cprofile", "sample"]
+# the leaf frames of a thread waiting idle, left out of the samples
+IDLE_FILES = ("threading.py", "selectors.py", "queue.py", "socket.py", "ssl.py")
+# the functions of a thread blocked in C (e.g. the queue listener of the logs), left out of the samples too
+IDLE_FUNCTIONS = ("dequeue",)
+
+
+class StackSampler:
+    """
+    A sampling profiler reading the stack of every thread from a background thread.
+    Every function on a stack counts a sample (cumulative), the function on top counts a sample of its own (self).
+    """
+    def __init__(self, interval: float = 0.005) -> None:
+        self.interval = interval
+        self.samples = 0
+        self.own: Counter = Counter()
+        self.cumulative: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @staticmethod
+    def _get_label(frame: Any) -> str:
+        code = frame.f_code
+        return f"{os.path.basename(code.co_filename)}:{code.co_firstlineno}({code.co_name})"
+
+    def _sample(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own or frame.f_code.co_filename.endswith(IDLE_FILES) or frame.f_code.co_name in IDLE_FUNCTIONS:
+                    continue
+                self.samples += 1
+                self.own[self._get_label(frame)] += 1
+                labels = set()
+                while frame is not None:
+                    labels.add(self._get_label(frame))
+                    frame = frame.f_back
+                self.cumulative.update(labels)
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._sample, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def get_top(self, top: int) -> List[Dict[str, Any]]:
+        return [
+            {"function": label, "own_share": round(count / self.samples, 4), "cumulative_share": round(self.cumulative[label] / self.samples, 4)}
+            for label, count in self.own.most_common(top)
+        ]
+
+
+class StageProfiler:
+    """
+    This class times the stages of a run, and optionally profiles them.
+    It sets configurations as follows:
+
+        - `self.name`: Name of the run, the report is written to `profile_<name>_<time>.txt` and `.json`.
+        - `self.enabled`: Whether the stages are profiled at all. Defaults to `True`.
+        - `self.mode`: `None` (times only), `cprofile` or `sample`. Defaults to `None`.
+        - `self.trace_memory`: Whether `tracemalloc` traces the allocations of the stages. Defaults to `False`.
+        - `self.top`: Number of functions and allocation sites reported per stage. Defaults to `15`.
+        - `self.interval`: Seconds between two samples in `sample` mode. Defaults to `0.005`.
+
+    #### Notes:
+        - A stage run several times (e.g. once per year) adds up in the report.
+        - The CPU time of a stage is the one of the whole process, it includes the worker threads.
+        - `cProfile` and `tracemalloc` slow the run down noticeably, the sampling profiler hardly does.
+        Without them the peak memory is the peak resident set size of the process so far.
+
+    #### Example Usage:
+
+        >>> profiler = configure_profiler(name="yearly_data", mode="cprofile", trace_memory=True)
+        >>> with profiler.stage("details"):
+        ...     movies = asyncio.run(obj.main())
+        >>> profiler.write()
+        ('.../tmdb_logs/profile_yearly_data_20240601T020000.txt', '.../tmdb_logs/profile_yearly_data_20240601T020000.json')
+    """
+    def __init__(self, name: str = "run", enabled: bool = True, mode: str = None, trace_memory: bool = False, top: int = 15, interval: float = 0.005) -> None:
+        if mode is not None and mode not in MODES:
+            raise ValueError(f"Unknown profiling mode {mode}, use one of {', '.join(MODES)}.")
+        self.name = name
+        self.enabled = enabled
+        self.mode = mode
+        self.trace_memory = trace_memory
+        self.top = top
+        self.interval = interval
+        self.stages: Dict[str, Dict[str, Any]] = {}
+        self.steps: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+        self._active = False
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """
+        Time (and profile) a stage. A stage started within another one is only timed, as a step of it.
+        """
+        if not self.enabled:
+            yield
+            return
+        if self._active:
+            with self.timed(name):
+                yield
+            return
+
+        self._active = True
+        profile = cProfile.Profile() if self.mode == "cprofile" else None
+        sampler = StackSampler(self.interval) if self.mode == "sample" else None
+        started_tracing = False
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(10)
+                started_tracing = True
+            tracemalloc.reset_peak()
+            before = tracemalloc.take_snapshot()
+        if sampler:
+            sampler.start()
+        if profile:
+            profile.enable()
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            if profile:
+                profile.disable()
+            if sampler:
+                sampler.stop()
+            report = {"wall_seconds": wall, "cpu_seconds": cpu, "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+            if self.trace_memory:
+                report["traced_peak_mb"] = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+                report["allocations"] = self._get_allocations(before, tracemalloc.take_snapshot())
+                if started_tracing:
+                    tracemalloc.stop()
+            if profile:
+                report["functions"] = self._get_functions(profile)
+            if sampler:
+                report["samples"] = sampler.samples
+                report["functions"] = sampler.get_top(self.top)
+            self._add_stage(name, report)
+            self._active = False
+
+    @contextmanager
+    def timed(self, name: str) -> Iterator[None]:
+        """
+        Time a step, from any thread or task. Only the wall time and the CPU time of the calling thread are taken.
+        """
+        if not self.enabled:
+            yield
+            return
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.thread_time() - cpu
+            with self._lock:
+                step = self.steps.setdefault(name, {"calls": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0})
+                step["calls"] += 1
+                step["wall_seconds"] += wall
+                step["cpu_seconds"] += cpu
+
+    def _get_allocations(self, before: tracemalloc.Snapshot, after: tracemalloc.Snapshot) -> List[Dict[str, Any]]:
+        # the allocations of tracemalloc itself are left out
+        filters = [tracemalloc.Filter(False, tracemalloc.__file__)]
+        stats = after.filter_traces(filters).compare_to(before.filter_traces(filters), "lineno")
+        return [
+            {"site": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}", "size_diff_mb": round(stat.size_diff / 1024 ** 2, 3), "count_diff": stat.count_diff}
+            for stat in sorted(stats, key=lambda stat: stat.size_diff, reverse=True)[:self.top]
+        ]
+
+    def _get_functions(self, profile: cProfile.Profile) -> List[Dict[str, Any]]:
+        stats = pstats.Stats(profile, stream=io.StringIO())
+        rows = []
+        for (filename, line, function), (_, calls, own, cumulative, _) in stats.stats.items():
+            rows.append({"function": f"{os.path.basename(filename)}:{line}({function})", "calls": calls, "own_seconds": round(own, 4), "cumulative_seconds": round(cumulative, 4)})
+        return sorted(rows, key=lambda row: row["cumulative_seconds"], reverse=True)[:self.top]
+
+    def _add_stage(self, name: str, report: Dict[str, Any]) -> None:
+        with self._lock:
+            stage = self.stages.get(name)
+            if stage is None:
+                self.stages[name] = {"calls": 1, **report}
+                return
+            stage["calls"] += 1
+            for key in ("wall_seconds", "cpu_seconds"):
+                stage[key] += report[key]
+            for key in ("max_rss_mb", "traced_peak_mb"):
+                if key in report:
+                    stage[key] = max(stage.get(key, 0), report[key])
+            # the functions and allocation sites of the longest run of the stage are kept
+            if report["wall_seconds"] >= stage.get("longest_seconds", 0):
+                stage["longest_seconds"] = report["wall_seconds"]
+                for key in ("functions", "allocations", "samples"):
+                    if key in report:
+                        stage[key] = report[key]
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"name": self.name, "mode": self.mode, "trace_memory": self.trace_memory, "stages": self.stages, "steps": self.steps}
+
+    def to_text(self) -> str:
+        report = self.to_dict()
+        lines = [f"Profile of {self.name} (mode: {self.mode or 'times'}, tracemalloc: {'on' if self.trace_memory else 'off'})", ""]
+        lines.append(f"{'stage':<28}{'calls':>7}{'wall s':>11}{'cpu s':>11}{'max rss MB':>12}{'traced peak MB':>16}")
+        for name, stage in report["stages"].items():
+            traced = f"{stage['traced_peak_mb']:.1f}" if "traced_peak_mb" in stage else "-"
+            lines.append(f"{name:<28}{stage['calls']:>7}{stage['wall_seconds']:>11.3f}{stage['cpu_seconds']:>11.3f}{stage['max_rss_mb']:>12.1f}{traced:>16}")
+        if report["steps"]:
+            lines += ["", f"{'step':<28}{'calls':>7}{'wall s':>11}{'thread cpu s':>14}"]
+            for name, step in report["steps"].items():
+                lines.append(f"{name:<28}{step['calls']:>7}{step['wall_seconds']:>11.3f}{step['cpu_seconds']:>14.3f}")
+        for name, stage in report["stages"].items():
+            if stage.get("functions"):
+                lines += ["", f"Top functions of {name}:"]
+                for row in stage["functions"]:
+                    if "cumulative_seconds" in row:
+                        lines.append(f"  {row['cumulative_seconds']:>10.3f}s cumulative {row['own_seconds']:>10.3f}s own {row['calls']:>9} calls  {row['function']}")
+                    else:
+                        lines.append(f"  {row['cumulative_share']:>7.1%} cumulative {row['own_share']:>7.1%} own  {row['function']}")
+            if stage.get("allocations"):
+                lines += ["", f"Top allocation sites of {name}:"]
+                for row in stage["allocations"]:
+                    lines.append(f"  {row['size_diff_mb']:>10.3f} MB {row['count_diff']:>9} blocks  {row['site']}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, directory: str = DEFAULT_DIR) -> Optional[Tuple[str, str]]:
+        """
+        Write the report to `<directory>/profile_<name>_<time>.txt` and `.json`, next to the logs.
+
+        Returns:
+            Optional[Tuple[str, str]]: Paths of the text and JSON reports, `None` when the profiler is disabled.
+        """
+        if not self.enabled:
+            return None
+        Path(directory).mkdir(parents=True, exist_ok=True)
+        stem = os.path.join(directory, f"profile_{self.name}_{datetime.now().strftime('%Y%m%dT%H%M%S')}")
+        with open(f"{stem}.txt", "w", encoding="utf-8") as f:
+            f.write(self.to_text())
+        with open(f"{stem}.json", "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=4)
+        return f"{stem}.txt", f"{stem}.json"
+
+
+_profiler = StageProfiler(enabled=False)
+
+
+def get_profiler() -> StageProfiler:
+    """
+    Get the profiler of the process, disabled until `configure_profiler` is called.
+    """
+    return _profiler
+
+
+def configure_profiler(**kwargs) -> StageProfiler:
+    """
+    Replace the profiler of the process by an enabled one, see `StageProfiler` for the arguments.
+    """
+    global _profiler
+    _profiler = StageProfiler(**kwargs)
+    return _profiler
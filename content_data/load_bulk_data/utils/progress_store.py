@@ -0,0 +1,233 @@
+"""
+This file contains the durable progress store used to checkpoint and resume yearly backfills.
+
+The progress is kept in a local SQLite database, it records:
+    - the work units (date ranges) a year was partitioned into,
+    - the completed discover pages of each date range along with their ids,
+    - the fetched movie ids,
+    - the loaded batches (and their movie ids) of each collection.
+
+A rerun of the same year reads these back and only fetches and loads what is missing.
+"""
+
+# external imports
+import os
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# local imports
+from ...base_log import Logger
+
+logger = Logger('progress_store').get_logger()
+
+content_data_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+DEFAULT_PATH = os.path.join(content_data_dir, "tmdb_checkpoints", "progress.sqlite3")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS work_units (
+    year INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    start_date TEXT NOT NULL,
+    end_date TEXT NOT NULL,
+    total_pages INTEGER NOT NULL,
+    PRIMARY KEY (year, type, start_date)
+);
+CREATE TABLE IF NOT EXISTS discover_pages (
+    year INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    start_date TEXT NOT NULL,
+    end_date TEXT NOT NULL,
+    page INTEGER NOT NULL,
+    ids TEXT NOT NULL,
+    PRIMARY KEY (year, type, start_date, end_date, page)
+);
+CREATE TABLE IF NOT EXISTS fetched_movies (
+    year INTEGER NOT NULL,
+    movie_id INTEGER NOT NULL,
+    PRIMARY KEY (year, movie_id)
+);
+CREATE TABLE IF NOT EXISTS loaded_batches (
+    batch_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    year INTEGER NOT NULL,
+    collection TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    loaded_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS loaded_movies (
+    year INTEGER NOT NULL,
+    collection TEXT NOT NULL,
+    movie_id INTEGER NOT NULL,
+    batch_id INTEGER NOT NULL,
+    PRIMARY KEY (year, collection, movie_id)
+);
+"""
+
+
+class ProgressStore:
+    """
+    This class checkpoints the progress of the yearly backfills in a local SQLite database.
+    The same store is shared by the discover stage (event loop) and the load stage (worker threads),
+    hence a single connection is guarded by a lock and every write is committed right away.
+
+    #### Notes:
+        - The database defaults to `tmdb_checkpoints/progress.sqlite3` next to the `tmdb_logs`.
+        - Use `clear(year)` to throw away the progress of a year and start it from scratch.
+
+    #### Example Usage:
+
+        >>> store = ProgressStore()
+        >>> ids = RunFetchIDs(year=2024, progress_store=store).fetch_yearly_data()
+        >>> pending = [movie_id for movie_id in ids if movie_id not in store.get_completed_movie_ids(2024, collections)]
+        >>> store.mark_loaded(2024, "movies", [550, 155])
+    """
+    def __init__(self, path: str = DEFAULT_PATH) -> None:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    # discover stage
+    def get_work_units(self, year: int, type: str) -> Optional[List[Tuple[str, str, int]]]:
+        """
+        Get the work units a year was partitioned into on an earlier run.
+
+        Returns:
+            Optional[List[Tuple[str, str, int]]]: `(start_date, end_date, total_pages)` of each work unit, `None` if not partitioned yet.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT start_date, end_date, total_pages FROM work_units WHERE year = ? AND type = ? ORDER BY start_date",
+                (year, type),
+            ).fetchall()
+        return [tuple(row) for row in rows] or None
+
+    def save_work_units(self, year: int, type: str, work_units: Iterable[Tuple[str, str, int]]) -> None:
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO work_units (year, type, start_date, end_date, total_pages) VALUES (?, ?, ?, ?, ?)",
+                [(year, type, start_date, end_date, total_pages) for start_date, end_date, total_pages in work_units],
+            )
+            self._conn.commit()
+
+    def get_completed_pages(self, year: int, type: str) -> Dict[Tuple[str, str, int], List[int]]:
+        """
+        Get the ids of the discover pages completed on earlier runs.
+
+        Returns:
+            Dict[Tuple[str, str, int], List[int]]: ids keyed by `(start_date, end_date, page)`.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT start_date, end_date, page, ids FROM discover_pages WHERE year = ? AND type = ?",
+                (year, type),
+            ).fetchall()
+        return {(start_date, end_date, page): json.loads(ids) for start_date, end_date, page, ids in rows}
+
+    def mark_page_completed(self, year: int, type: str, start_date: str, end_date: str, page: int, ids: List[int]) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO discover_pages (year, type, start_date, end_date, page, ids) VALUES (?, ?, ?, ?, ?, ?)",
+                (year, type, start_date, end_date, page, json.dumps(ids)),
+            )
+            self._conn.commit()
+
+    def mark_pages_completed(self, year: int, type: str, pages: Dict[Tuple[str, str, int], List[int]]) -> None:
+        """
+        Record several completed pages, keyed by `(start_date, end_date, page)`, in one transaction.
+        """
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO discover_pages (year, type, start_date, end_date, page, ids) VALUES (?, ?, ?, ?, ?, ?)",
+                [(year, type, start_date, end_date, page, json.dumps(ids)) for (start_date, end_date, page), ids in pages.items()],
+            )
+            self._conn.commit()
+
+    # details and load stages
+    def mark_movies_fetched(self, year: int, movie_ids: Iterable[int]) -> None:
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO fetched_movies (year, movie_id) VALUES (?, ?)",
+                [(year, movie_id) for movie_id in movie_ids],
+            )
+            self._conn.commit()
+
+    def get_loaded_ids(self, year: int, collection: str, movie_ids: Iterable[int] = None) -> Set[int]:
+        """
+        Get the movies of a year loaded into a collection, only those among `movie_ids` when given (e.g. a batch).
+        """
+        if movie_ids is None:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT movie_id FROM loaded_movies WHERE year = ? AND collection = ?",
+                    (year, collection),
+                ).fetchall()
+            return {row[0] for row in rows}
+
+        movie_ids = list(movie_ids)
+        loaded = set()
+        # looked up on the primary key, in chunks within the variable limit of SQLite
+        for start in range(0, len(movie_ids), 500):
+            chunk = movie_ids[start:start + 500]
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT movie_id FROM loaded_movies WHERE year = ? AND collection = ? AND movie_id IN ({', '.join('?' * len(chunk))})",
+                    (year, collection, *chunk),
+                ).fetchall()
+            loaded.update(row[0] for row in rows)
+        return loaded
+
+    def mark_loaded(self, year: int, collection: str, movie_ids: List[int]) -> None:
+        """
+        Record a batch of movies loaded into a collection.
+        """
+        if not movie_ids:
+            return
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO loaded_batches (year, collection, size) VALUES (?, ?, ?)",
+                (year, collection, len(movie_ids)),
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO loaded_movies (year, collection, movie_id, batch_id) VALUES (?, ?, ?, ?)",
+                [(year, collection, movie_id, cursor.lastrowid) for movie_id in movie_ids],
+            )
+            self._conn.commit()
+
+    def get_completed_movie_ids(self, year: int, collections: List[str]) -> Set[int]:
+        """
+        Get the movies of a year which are loaded into every one of the given collections.
+        """
+        completed = None
+        for collection in collections:
+            loaded = self.get_loaded_ids(year, collection)
+            completed = loaded if completed is None else completed & loaded
+        return completed or set()
+
+    def get_started_movie_ids(self, year: int) -> Set[int]:
+        """
+        Get the movies of a year which were fetched or loaded into any collection on earlier runs, complete or not.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT movie_id FROM fetched_movies WHERE year = ? UNION SELECT movie_id FROM loaded_movies WHERE year = ?",
+                (year, year),
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def clear(self, year: int) -> None:
+        with self._lock:
+            for table in ("work_units", "discover_pages", "fetched_movies", "loaded_batches", "loaded_movies"):
+                self._conn.execute(f"DELETE FROM {table} WHERE year = ?", (year,))
+            self._conn.commit()
+        logger.info(f"Cleared the progress of year {year}")
@@ -0,0 +1,155 @@
+"""
+This file contains the process wide rate limiter which every TMDB request goes through.
+
+It contains the helpers:
+    - `get_rate_limiter`: Returns the shared `RateLimiter` of the process.
+    - `configure_rate_limiter`: Replaces the shared `RateLimiter` with new settings.
+
+The requests themselves are sent by the helpers of the `tmdb_http` module.
+"""
+
+# external imports
+import time
+import asyncio
+import threading
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Mapping, Optional
+
+# local imports
+from ...base_log import Logger
+
+logger = Logger('rate_limiter').get_logger()
+
+DEFAULT_RATE = 40.0
+DEFAULT_BURST = 40
+DEFAULT_RETRY_AFTER = 1.0
+
+
+class RateLimiter:
+    """
+    Token bucket rate limiter shared by the sync and async code of the pipelines.
+    The bucket holds at most `burst` tokens and is refilled with `rate` tokens per second,
+    every request takes one token.
+
+    When any request gets a `429 Too Many Requests` response the limiter is paused for the whole
+    process, for as long as the `Retry-After` header of the response asks for.
+    After the pause the bucket starts empty, so requests resume at `rate` instead of bursting.
+
+    #### Notes:
+        - The state is guarded by a `threading.Lock` which is never held while sleeping,
+        hence the same limiter can be used from threads and from the event loop.
+
+    #### Example Usage:
+
+        >>> limiter = RateLimiter(rate=40, burst=40)
+        >>> limiter.acquire()
+        >>> await limiter.acquire_async()
+        >>> limiter.pause(limiter.get_retry_after(response.headers))
+    """
+    def __init__(self, rate: float = DEFAULT_RATE, burst: int = DEFAULT_BURST) -> None:
+        if rate <= 0 or burst < 1:
+            raise ValueError(f"Invalid rate limit: rate={rate}, burst={burst}")
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        elapsed = max(0.0, now - self._updated)
+        self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+        self._updated = max(self._updated, now)
+
+    def _try_acquire(self) -> float:
+        """
+        Take a token if one is available.
+
+        Returns:
+            float: `0` if a token was taken, else the seconds to wait before trying again.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if now < self._paused_until:
+                return self._paused_until - now
+            self._refill(now)
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self) -> None:
+        """
+        Block the calling thread until a request may be sent.
+        """
+        while (wait := self._try_acquire()) > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self) -> None:
+        """
+        Wait without blocking the event loop until a request may be sent.
+        """
+        while (wait := self._try_acquire()) > 0:
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        """
+        Pause all the requests of the process for the given seconds.
+        A longer running pause is never shortened.
+        """
+        with self._lock:
+            now = time.monotonic()
+            paused_until = now + max(0.0, seconds)
+            if paused_until > self._paused_until:
+                self._paused_until = paused_until
+                self._tokens = 0.0
+                self._updated = paused_until
+                logger.warning(f"⏸️ Rate limited by TMDB, pausing all requests for {seconds:.2f}s")
+
+    @staticmethod
+    def get_retry_after(headers: Mapping[str, str], default: float = DEFAULT_RETRY_AFTER) -> float:
+        """
+        Read the `Retry-After` header, which is either in seconds or an HTTP date.
+
+        Returns:
+            float: Seconds to wait before retrying.
+        """
+        value = headers.get("Retry-After") if headers else None
+        if not value:
+            return default
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            retry_at = parsedate_to_datetime(value)
+            return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+        except (TypeError, ValueError):
+            return default
+
+
+_rate_limiter: Optional[RateLimiter] = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter(rate: float = DEFAULT_RATE, burst: int = DEFAULT_BURST) -> RateLimiter:
+    """
+    Get the shared rate limiter of the process, it is created with the given settings on the first call.
+    """
+    global _rate_limiter
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            _rate_limiter = RateLimiter(rate=rate, burst=burst)
+        return _rate_limiter
+
+
+def configure_rate_limiter(rate: float, burst: int) -> RateLimiter:
+    """
+    Replace the shared rate limiter of the process, e.g. with the settings passed on the command line.
+    """
+    global _rate_limiter
+    with _rate_limiter_lock:
+        _rate_limiter = RateLimiter(rate=rate, burst=burst)
+        return _rate_limiter
+
@@ -0,0 +1,225 @@
+"""
+This file contains the optional on-disk cache of the TMDB responses.
+
+The responses are kept in a local SQLite database keyed by the normalized url and params
+(the `api_key` is never part of the key). Every entry expires after the TTL of its endpoint,
+an expired entry having an `ETag` is revalidated with `If-None-Match` instead of being downloaded again.
+Once the cache grows beyond its size cap, the least recently used entries are evicted.
+The last access of a hit is only buffered in memory, the buffer is written in a batch every `ACCESS_FLUSH_SIZE` hits,
+before an eviction and when the cache is closed, hence a hit costs no write on the event loop.
+"""
+
+# external imports
+import os
+import time
+import atexit
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+from urllib.parse import urlencode
+from typing import Any, Dict, Optional
+
+# local imports
+from ...base_log import Logger
+
+logger = Logger('response_cache').get_logger()
+
+content_data_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+DEFAULT_PATH = os.path.join(content_data_dir, "tmdb_cache", "responses.sqlite3")
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+EXCLUDED_PARAMS = {"api_key"}
+ACCESS_FLUSH_SIZE = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    etag TEXT,
+    content_type TEXT,
+    body BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    expires_at REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access);
+"""
+
+
+class CachedResponse:
+    """
+    A response read back from the cache.
+    """
+    def __init__(self, key: str, url: str, body: bytes, etag: Optional[str], content_type: Optional[str], expires_at: float) -> None:
+        self.key = key
+        self.url = url
+        self.body = body
+        self.etag = etag
+        self.content_type = content_type
+        self.expires_at = expires_at
+
+    @property
+    def is_fresh(self) -> bool:
+        return time.time() < self.expires_at
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        headers = {"Content-Type": self.content_type or "application/json", "X-Cache": "HIT"}
+        if self.etag:
+            headers["ETag"] = self.etag
+        return headers
+
+
+class ResponseCache:
+    """
+    This class caches the TMDB responses on disk.
+    It is used by the `tmdb_get` and `tmdb_get_async` helpers of the `tmdb_http` module,
+    a fresh hit is returned without taking a token from the rate limiter.
+
+    #### Notes:
+        - The TTL of each endpoint is configured by the `cache_ttl` of its entry in `endpoint_config.py`.
+        - Only `200` responses are cached.
+
+    #### Example Usage:
+
+        >>> cache = ResponseCache(max_bytes=512 * 1024 ** 2)
+        >>> entry = cache.get(url, params)
+        >>> if entry is None or not entry.is_fresh:
+        ...     response = requests.get(url, params=params, headers=cache.get_conditional_headers(entry))
+        ...     cache.put(url, params, response.content, ttl=86400, etag=response.headers.get("ETag"))
+    """
+    def __init__(self, path: str = DEFAULT_PATH, max_bytes: int = DEFAULT_MAX_BYTES) -> None:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        # key -> last access of the hits not written yet
+        self._accessed: Dict[str, float] = {}
+
+    def close(self) -> None:
+        with self._lock:
+            self._flush_accesses()
+            self._conn.commit()
+            self._conn.close()
+
+    def flush(self) -> None:
+        """
+        Write the buffered last accesses of the hits.
+        """
+        with self._lock:
+            self._flush_accesses()
+            self._conn.commit()
+
+    def _flush_accesses(self) -> None:
+        """
+        Must be called holding the lock, the caller commits.
+        """
+        if self._accessed:
+            self._conn.executemany("UPDATE responses SET last_access = ? WHERE key = ?", [(at, key) for key, at in self._accessed.items()])
+            self._accessed.clear()
+
+    @staticmethod
+    def get_key(url: str, params: Dict[str, Any] = None) -> str:
+        """
+        Normalize the url and params into the cache key, leaving out the `api_key`.
+        """
+        params = sorted((str(k), str(v)) for k, v in (params or {}).items() if k not in EXCLUDED_PARAMS)
+        normalized = f"{url.rstrip('/')}?{urlencode(params)}"
+        return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+    def get(self, url: str, params: Dict[str, Any] = None) -> Optional[CachedResponse]:
+        """
+        Get the cached response of the url and params, fresh or expired.
+
+        Returns:
+            Optional[CachedResponse]: The cached response, `None` on a miss.
+        """
+        key = self.get_key(url, params)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT body, etag, content_type, expires_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._accessed[key] = time.time()
+            if len(self._accessed) >= ACCESS_FLUSH_SIZE:
+                self._flush_accesses()
+                self._conn.commit()
+        body, etag, content_type, expires_at = row
+        return CachedResponse(key, url, body, etag, content_type, expires_at)
+
+    @staticmethod
+    def get_conditional_headers(entry: Optional[CachedResponse]) -> Dict[str, str]:
+        """
+        Get the headers to revalidate an expired entry, empty if it can not be revalidated.
+        """
+        if entry is not None and entry.etag:
+            return {"If-None-Match": entry.etag}
+        return {}
+
+    def put(self, url: str, params: Dict[str, Any], body: bytes, ttl: float, etag: str = None, content_type: str = None) -> None:
+        if ttl <= 0:
+            return
+        key = self.get_key(url, params)
+        now = time.time()
+        with self._lock:
+            previous = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, url, etag, content_type, body, size, expires_at, last_access) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, url, etag, content_type, body, len(body), now + ttl, now),
+            )
+            self._total_bytes += len(body) - (previous[0] if previous else 0)
+            self._evict()
+            self._conn.commit()
+
+    def refresh(self, entry: CachedResponse, ttl: float) -> None:
+        """
+        Extend the expiry of an entry revalidated by a `304 Not Modified`.
+        """
+        with self._lock:
+            now = time.time()
+            self._conn.execute("UPDATE responses SET expires_at = ?, last_access = ? WHERE key = ?", (now + ttl, now, entry.key))
+            self._conn.commit()
+        entry.expires_at = now + ttl
+
+    def _evict(self) -> None:
+        """
+        Evict the least recently used entries until the cache is 10% below its size cap.
+        Must be called holding the lock.
+        """
+        if self._total_bytes <= self.max_bytes:
+            return
+        # the least recently used are only known once the buffered accesses are written
+        self._flush_accesses()
+        target = self.max_bytes * 0.9
+        evicted = 0
+        rows = self._conn.execute("SELECT key, size FROM responses ORDER BY last_access").fetchall()
+        for key, size in rows:
+            if self._total_bytes <= target:
+                break
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._total_bytes -= size
+            evicted += 1
+        logger.info(f"Evicted {evicted} least recently used responses, cache size: {self._total_bytes / 1024 ** 2:.1f} MB")
+
+
+_response_cache: Optional[ResponseCache] = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache(path: str = DEFAULT_PATH, max_bytes: int = DEFAULT_MAX_BYTES) -> ResponseCache:
+    """
+    Get the shared response cache of the process, it is created with the given settings on the first call.
+    """
+    global _response_cache
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache(path=path, max_bytes=max_bytes)
+            atexit.register(_response_cache.flush)
+        return _response_cache
@@ -0,0 +1,152 @@
+"""
+This file contains the helpers which send every GET request to TMDB.
+
+It contains the helpers:
+    - `tmdb_get`: GET using `requests` (sync code).
+    - `tmdb_get_async`: GET using a shared `httpx.AsyncClient` (async code).
+
+Both the helpers:
+    - answer from the `ResponseCache` when one is given and the cached response is fresh,
+    - revalidate an expired cached response with `If-None-Match` (any cached response with `revalidate=True`),
+    - take a token from the `RateLimiter` before every request sent,
+    - pause the `RateLimiter` and retry on a `429`, as per the `Retry-After` of TMDB,
+    - record the latency, status code and size of every response in the shared `Metrics`.
+
+`tmdb_get_async` also reports the latency and congestion (`429`, `5xx`, timeouts) of every request
+to the `ConcurrencyController` of the stage, when one is given.
+"""
+
+# external imports
+import time
+import httpx
+import requests
+from requests.structures import CaseInsensitiveDict
+from typing import Any, Dict, Optional, Union
+
+# local imports
+from .concurrency import ConcurrencyController
+from .metrics import get_metrics, get_endpoint_label
+from .rate_limiter import RateLimiter, get_rate_limiter
+from .response_cache import CachedResponse, ResponseCache
+
+MAX_RATE_LIMITED_RETRIES = 5
+
+
+def _get_cached(cache: Optional[ResponseCache], ttl: float, url: str, params: Dict[str, Any]) -> Optional[CachedResponse]:
+    if cache is None or ttl <= 0:
+        return None
+    return cache.get(url, params)
+
+
+def _update_cache(cache: Optional[ResponseCache], ttl: float, entry: Optional[CachedResponse], url: str, params: Dict[str, Any], response: Union[requests.Response, httpx.Response]) -> Optional[CachedResponse]:
+    """
+    Store a `200` response in the cache, or refresh the entry revalidated by a `304`.
+
+    Returns:
+        Optional[CachedResponse]: The revalidated entry to answer from, `None` otherwise.
+    """
+    if cache is None or ttl <= 0:
+        return None
+    if response.status_code == 304 and entry is not None:
+        cache.refresh(entry, ttl)
+        return entry
+    if response.status_code == 200:
+        cache.put(url, params, response.content, ttl=ttl, etag=response.headers.get("ETag"), content_type=response.headers.get("Content-Type"))
+    return None
+
+
+def _record_response(endpoint: str, response: Union[requests.Response, httpx.Response], seconds: float) -> None:
+    metrics = get_metrics()
+    metrics.observe("tmdb_request_seconds", seconds, endpoint=endpoint)
+    metrics.inc("tmdb_responses_total", endpoint=endpoint, status=response.status_code)
+    metrics.inc("tmdb_response_bytes_total", len(response.content), endpoint=endpoint)
+    if response.status_code == 429:
+        metrics.inc("tmdb_retries_total", endpoint=endpoint, reason="rate_limited")
+
+
+def _record_cache_hit(endpoint: str) -> None:
+    get_metrics().inc("tmdb_cache_hits_total", endpoint=endpoint)
+
+
+def _record_give_up(endpoint: str, response: Union[requests.Response, httpx.Response]) -> None:
+    if response.status_code == 429:
+        get_metrics().inc("tmdb_give_ups_total", endpoint=endpoint, reason="rate_limited")
+
+
+def _to_requests_response(entry: CachedResponse) -> requests.Response:
+    response = requests.Response()
+    response.status_code = 200
+    response._content = entry.body
+    response.headers = CaseInsensitiveDict(entry.headers)
+    response.url = entry.url
+    response.encoding = "utf-8"
+    return response
+
+
+def _to_httpx_response(entry: CachedResponse) -> httpx.Response:
+    return httpx.Response(200, content=entry.body, headers=entry.headers, request=httpx.Request("GET", entry.url))
+
+
+def tmdb_get(url: str, limiter: RateLimiter = None, cache: ResponseCache = None, ttl: float = 0, params: Dict[str, Any] = None, headers: Dict[str, str] = None, **kwargs) -> requests.Response:
+    """
+    Send a rate limited (and optionally cached) GET request to TMDB using `requests`.
+    A `429` response pauses the limiter and the request is retried, the last response is returned as is.
+    """
+    limiter = limiter or get_rate_limiter()
+    endpoint = get_endpoint_label(url)
+    entry = _get_cached(cache, ttl, url, params)
+    if entry is not None and entry.is_fresh:
+        _record_cache_hit(endpoint)
+        return _to_requests_response(entry)
+    headers = {**(headers or {}), **ResponseCache.get_conditional_headers(entry)}
+
+    for _ in range(MAX_RATE_LIMITED_RETRIES + 1):
+        with get_metrics().timer("rate_limiter_wait_seconds"):
+            limiter.acquire()
+        start = time.perf_counter()
+        response = requests.get(url, params=params, headers=headers, **kwargs)
+        _record_response(endpoint, response, time.perf_counter() - start)
+        if response.status_code != 429:
+            break
+        limiter.pause(limiter.get_retry_after(response.headers))
+    _record_give_up(endpoint, response)
+
+    revalidated = _update_cache(cache, ttl, entry, url, params, response)
+    return _to_requests_response(revalidated) if revalidated else response
+
+
+async def tmdb_get_async(client: httpx.AsyncClient, url: str, limiter: RateLimiter = None, cache: ResponseCache = None, ttl: float = 0, params: Dict[str, Any] = None, headers: Dict[str, str] = None, controller: ConcurrencyController = None, revalidate: bool = False, **kwargs) -> httpx.Response:
+    """
+    Send a rate limited (and optionally cached) GET request to TMDB using the shared `httpx.AsyncClient`.
+    A `429` response pauses the limiter and the request is retried, the last response is returned as is.
+    With `revalidate`, even a fresh cached response is revalidated with TMDB (e.g. for a movie known to have changed).
+    """
+    limiter = limiter or get_rate_limiter()
+    endpoint = get_endpoint_label(url)
+    entry = _get_cached(cache, ttl, url, params)
+    if entry is not None and entry.is_fresh and not revalidate:
+        _record_cache_hit(endpoint)
+        return _to_httpx_response(entry)
+    headers = {**(headers or {}), **ResponseCache.get_conditional_headers(entry)}
+
+    for _ in range(MAX_RATE_LIMITED_RETRIES + 1):
+        with get_metrics().timer("rate_limiter_wait_seconds"):
+            await limiter.acquire_async()
+        start = time.perf_counter()
+        try:
+            response = await client.get(url, params=params, headers=headers, **kwargs)
+        except httpx.TimeoutException:
+            if controller is not None:
+                controller.record(time.perf_counter() - start, congested=True)
+            raise
+        seconds = time.perf_counter() - start
+        _record_response(endpoint, response, seconds)
+        if controller is not None:
+            controller.record(seconds, congested=response.status_code == 429 or response.status_code >= 500)
+        if response.status_code != 429:
+            break
+        limiter.pause(limiter.get_retry_after(response.headers))
+    _record_give_up(endpoint, response)
+
+    revalidated = _update_cache(cache, ttl, entry, url, params, response)
+    return _to_httpx_response(revalidated) if revalidated else response
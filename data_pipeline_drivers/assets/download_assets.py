@@ -0,0 +1,54 @@
+"""
+This file contains the functionality to download the posters, backdrops and logos of the loaded movies
+into the local content-addressed asset store, so they can be served without going to the CDN of TMDB.
+"""
+
+import os
+import sys
+import argparse
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+from content_data import get_config, Logger, RunAssets, get_metrics
+from content_data.load_bulk_data.load_assets.run_assets import DEFAULT_SIZES
+
+logger = Logger("download_assets").get_logger()
+
+
+def parse_sizes(values):
+    """
+    Parse `kind=size,size` arguments, e.g. `poster=w342,w500`, the kinds not given keep their default sizes.
+    """
+    sizes = dict(DEFAULT_SIZES)
+    for value in values or []:
+        kind, _, kind_sizes = value.partition("=")
+        if kind not in DEFAULT_SIZES:
+            raise argparse.ArgumentTypeError(f"Unknown kind of image {kind}, expected one of {', '.join(DEFAULT_SIZES)}")
+        sizes[kind] = [size for size in kind_sizes.split(",") if size]
+    return sizes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Download the images of the loaded movies into the local asset store.")
+    parser.add_argument("--year", type=int, help="only the movies of this release year, all of them if not given")
+    parser.add_argument("--sizes", nargs="+", metavar="KIND=SIZES", help="sizes per kind of image, e.g. poster=w342,w500 backdrop=w780 logo= (empty skips the kind)")
+    parser.add_argument("--include-images", action="store_true", help="download every poster, backdrop and logo of the images collection, not only the ones of the movies")
+    parser.add_argument("--concurrency", type=int, default=20, help="downloads in flight, the upper bound when the concurrency is adaptive")
+    args = parser.parse_args()
+
+    config = get_config()
+    obj = RunAssets(
+        db=config.get_mongo_db(),
+        sizes=parse_sizes(args.sizes),
+        year=args.year,
+        include_images=args.include_images,
+        max_concurrency=args.concurrency,
+        controller=config.get_concurrency_controller("assets", initial=min(10, args.concurrency)),
+    )
+    report = obj.run()
+    paths, files, total = obj.store.get_stats()
+    logger.info(f"Asset report: {report}, the store holds {paths} images in {files} files ({total / 1024 ** 2:.1f} MB)")
+
+    prom_path, json_path = get_metrics().write("download_assets")
+    logger.info(f"Metrics of the run written to {prom_path} and {json_path}")
@@ -0,0 +1,100 @@
+"""
+This file contains the functionality to benchmark the yearly pipeline offline,
+against a local fake TMDB server and a local MongoDB (or an in-memory stand-in).
+"""
+
+import os
+import sys
+import json
+import argparse
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the yearly pipeline against a fake TMDB server.")
+    parser.add_argument("--year", type=int, default=2024, help="year to fetch")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[10], help="requests in flight, one run per value to compare them")
+    parser.add_argument("--assets", action="store_true", help="also download the images of the loaded movies from the fake image CDN")
+    parser.add_argument("--adaptive", action="store_true", help="adapt the requests in flight with the AIMD controller, --concurrency being its upper bound")
+    parser.add_argument("--batch-size", type=int, default=500, help="number of movies fetched before they are loaded")
+    parser.add_argument("--load-batch-size", type=int, default=1000, help="number of documents per bulk write")
+    parser.add_argument("--load-workers", type=int, default=4, help="number of bulk writes in parallel")
+    parser.add_argument("--max-movies", type=int, help="only fetch the details of the first N ids")
+    parser.add_argument("--movies-per-day", type=int, default=20, help="movies the fake TMDB releases per day, sets the page counts")
+    parser.add_argument("--latency-ms", type=float, default=20, help="latency of every fake TMDB response")
+    parser.add_argument("--error-rate", type=float, default=0, help="share of the requests answered with a 500")
+    parser.add_argument("--rate-limited-rate", type=float, default=0, help="share of the requests answered with a 429")
+    parser.add_argument("--rate-limit", type=float, default=1000, help="requests per second allowed by the rate limiter")
+    parser.add_argument("--port", type=int, default=8765, help="port of the fake TMDB server, 0 picks a free port")
+    parser.add_argument("--mongo-uri", help="local MongoDB to load into, the in-memory stand-in is used if not given")
+    parser.add_argument("--mongo-db", default="tmdb_benchmark", help="database of --mongo-uri, its content collections are dropped")
+    parser.add_argument("--write-latency-ms", type=float, default=0, help="latency of every bulk write of the in-memory stand-in")
+    parser.add_argument("--output", help="JSON file to write the reports to")
+    args = parser.parse_args()
+
+    # the config is read on its first use, hence the environment is set before the pipelines run
+    os.environ["TMDB_RATE_LIMIT"] = str(args.rate_limit)
+    os.environ["TMDB_RATE_BURST"] = str(max(int(args.rate_limit), 1))
+    os.environ.setdefault("TMDB_API_KEY", "benchmark")
+    os.environ.setdefault("MONGO_PORT", "27017")
+    # the responses must come from the fake server, not from the cache
+    os.environ.pop("TMDB_CACHE_DIR", None)
+
+    from content_data import Logger, get_metrics
+    from content_data.load_bulk_data.benchmark.fake_tmdb import FakeTMDBServer
+    from content_data.load_bulk_data.benchmark.memory_mongo import MemoryDatabase
+    from content_data.load_bulk_data.benchmark.run_benchmark import RunBenchmark
+    logger = Logger("benchmark").get_logger()
+
+    if args.mongo_uri:
+        from pymongo import MongoClient
+        db = MongoClient(args.mongo_uri)[args.mongo_db]
+    else:
+        db = MemoryDatabase(name=args.mongo_db, write_latency=args.write_latency_ms / 1000)
+
+    server = FakeTMDBServer(
+        port=args.port,
+        latency=args.latency_ms / 1000,
+        error_rate=args.error_rate,
+        rate_limited_rate=args.rate_limited_rate,
+        movies_per_day=args.movies_per_day,
+    ).start()
+    # the port is only known once the server listens (`--port 0` picks a free one)
+    os.environ["TMDB_BASE_URL"] = server.base_url
+    os.environ["TMDB_IMAGE_BASE_URL"] = server.image_base_url
+    reports = []
+    try:
+        for max_concurrency in args.concurrency:
+            obj = RunBenchmark(
+                db=db,
+                year=args.year,
+                max_concurrency=max_concurrency,
+                batch_size=args.batch_size,
+                load_batch_size=args.load_batch_size,
+                load_workers=args.load_workers,
+                max_movies=args.max_movies,
+                adaptive=args.adaptive,
+                assets=args.assets,
+            )
+            get_metrics().reset()
+            report = obj.run()
+            get_metrics().write(f"benchmark_concurrency_{max_concurrency}")
+            report["requests"] = dict(sorted(server.stats.items()))
+            server.stats.clear()
+            reports.append(report)
+            logger.info(f"Benchmark report: {report}")
+    finally:
+        server.stop()
+
+    columns = ["max_concurrency", "final_concurrency", "ids", "ids_per_second", "movies", "movies_per_second", "documents", "documents_per_second", "peak_rss_mb", "requests"]
+    if args.assets:
+        columns += ["assets", "assets_per_second", "asset_mb_per_second"]
+    print(" | ".join(columns))
+    for report in reports:
+        print(" | ".join(str(report[column]) for column in columns))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(reports, f, indent=4)
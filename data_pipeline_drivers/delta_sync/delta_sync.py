@@ -0,0 +1,39 @@
+"""
+This file contains the functionality to refresh the content data incrementally,
+by re-fetching only the movies changed on TMDB since the last run.
+"""
+
+import os
+import sys
+import argparse
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+from content_data import get_config, Logger, MongoLoader, IndexManager, RunDeltaSync, DeadLetterStore, get_metrics
+
+logger = Logger("delta_sync").get_logger()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Refresh the movies changed on TMDB since the last run.")
+    parser.add_argument("--start-date", help="start of the window (YYYY-MM-DD), defaults to the stored high-water mark")
+    parser.add_argument("--end-date", help="end of the window (YYYY-MM-DD), defaults to today")
+    parser.add_argument("--include-new", action="store_true", help="also load the changed movies which are not in the movies collection yet")
+    parser.add_argument("--batch-size", type=int, default=500, help="number of movies fetched before they are loaded")
+    parser.add_argument("--load-batch-size", type=int, default=1000, help="number of documents per bulk write")
+    parser.add_argument("--raw-credits", action="store_true", help="also load the raw credits of every movie into the people collection, besides the normalized persons")
+    parser.add_argument("--skip-read-models", action="store_true", help="don't refresh the top_movies and genre_movies read models while loading")
+    args = parser.parse_args()
+
+    config = get_config()
+    db = config.get_mongo_db()
+    loader = MongoLoader(db=db, batch_size=args.load_batch_size, raw_credits=args.raw_credits, read_models=not args.skip_read_models)
+
+    obj = RunDeltaSync(db=db, start_date=args.start_date, end_date=args.end_date, include_new=args.include_new, batch_size=args.batch_size, loader=loader, controller=config.get_concurrency_controller("movie_details"), dead_letters=DeadLetterStore())
+    loaded = obj.run()
+    logger.info(f"Total {loaded} changed movies loaded successfully.")
+    IndexManager(db).ensure_indexes()
+
+    prom_path, json_path = get_metrics().write("delta_sync")
+    logger.info(f"Metrics of the run written to {prom_path} and {json_path}")
@@ -0,0 +1,40 @@
+"""
+This file contains the functionality to export the content collections changed since the last export
+to partitioned Parquet files, to be bulk loaded into the BigQuery warehouse.
+It only reads MongoDB, hence it runs offline against a local database.
+"""
+
+import os
+import sys
+import argparse
+from datetime import timedelta
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+from content_data import get_config, Logger, RunParquetExport, get_metrics
+
+logger = Logger("export_parquet").get_logger()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the content collections changed since the last export to Parquet files.")
+    parser.add_argument("--exports", nargs="+", choices=["movies", "people", "images", "videos"], help="exports to run, all of them by default")
+    parser.add_argument("--full", action="store_true", help="export every document, ignoring the documents already exported")
+    parser.add_argument("--output-dir", help="directory of the files, defaults to content_data/tmdb_exports")
+    parser.add_argument("--workers", type=int, default=4, help="number of partitions written in parallel")
+    parser.add_argument("--batch-size", type=int, default=10_000, help="number of documents read per cursor and written per row group")
+    parser.add_argument("--rows-per-file", type=int, default=100_000, help="number of rows per file of the exports not partitioned by release_year (people)")
+    parser.add_argument("--lag-minutes", type=float, default=60, help="only export the documents stamped this long before the export, it must exceed the longest load")
+    parser.add_argument("--compression", choices=["snappy", "zstd", "gzip", "none"], default="snappy", help="Parquet compression codec")
+    args = parser.parse_args()
+
+    config = get_config()
+    options = {"root": args.output_dir} if args.output_dir else {}
+    obj = RunParquetExport(db=config.get_mongo_db(), exports=args.exports, full=args.full, max_workers=args.workers, batch_size=args.batch_size, rows_per_file=args.rows_per_file, compression=args.compression, lag=timedelta(minutes=args.lag_minutes), **options)
+    manifest = obj.run()
+    for export, spec in manifest["exports"].items():
+        logger.info(f"{export}: {spec['rows']} rows in {len(spec['files'])} files for the {spec['bq_table']} table")
+
+    prom_path, json_path = get_metrics().write("export_parquet")
+    logger.info(f"Metrics of the run written to {prom_path} and {json_path}")
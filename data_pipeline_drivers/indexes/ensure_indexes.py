@@ -0,0 +1,33 @@
+"""
+This file contains the functionality to create the indexes of the content collections,
+and to rebuild the top_movies and genre_movies read models from the movies collection.
+"""
+
+import os
+import sys
+import argparse
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+from content_data import get_config, Logger, IndexManager, ReadModels, get_metrics
+
+logger = Logger("ensure_indexes").get_logger()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create the missing indexes of the content collections.")
+    parser.add_argument("--collections", nargs="+", help="only the indexes of these collections, all of them by default")
+    parser.add_argument("--load-only", action="store_true", help="only the indexes the loads rely on, e.g. before a backfill")
+    parser.add_argument("--rebuild-read-models", action="store_true", help="recompute the top_movies and genre_movies read models from the movies collection")
+    args = parser.parse_args()
+
+    config = get_config()
+    db = config.get_mongo_db()
+    if args.rebuild_read_models:
+        ReadModels(db=db).rebuild()
+    created = IndexManager(db).ensure_indexes(args.collections, load_only=args.load_only)
+    logger.info(f"Total {len(created)} indexes created.")
+
+    prom_path, json_path = get_metrics().write("ensure_indexes")
+    logger.info(f"Metrics of the run written to {prom_path} and {json_path}")
@@ -0,0 +1,46 @@
+"""
+This file contains the functionality to load the raw movies of the landing zone into MongoDB again,
+without calling TMDB, e.g. after a change of the schema, of the projection or of the loader.
+"""
+
+import os
+import sys
+import argparse
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+from content_data import get_config, Logger, MongoLoader, IndexManager, LandingZone, RunReplay, get_metrics
+
+logger = Logger("replay").get_logger()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load the raw movies of the landing zone into MongoDB without calling TMDB.")
+    parser.add_argument("--years", nargs="+", help="years to replay (`unknown` for the movies landed without a year), every year landed by default")
+    parser.add_argument("--landing-dir", help="directory of the landing zone, defaults to content_data/tmdb_landing")
+    parser.add_argument("--batch-size", type=int, default=500, help="number of movies loaded at once")
+    parser.add_argument("--load-batch-size", type=int, default=1000, help="number of documents per bulk write")
+    parser.add_argument("--load-workers", type=int, default=4, help="number of bulk writes submitted in parallel")
+    parser.add_argument("--raw-credits", action="store_true", help="also load the raw credits of every movie into the people collection, besides the normalized persons")
+    parser.add_argument("--skip-read-models", action="store_true", help="don't refresh the top_movies and genre_movies read models while loading")
+    parser.add_argument("--list", action="store_true", help="only list the years and chunks of the landing zone")
+    args = parser.parse_args()
+
+    landing = LandingZone(root=args.landing_dir) if args.landing_dir else LandingZone()
+    years = None if args.years is None else [None if year == "unknown" else int(year) for year in args.years]
+    if args.list:
+        for year in landing.get_years():
+            chunks = landing.get_chunks(year)
+            logger.info(f"Year {year if year is not None else 'unknown'}: {len(chunks)} chunks, {sum(chunk.stat().st_size for chunk in chunks) / 1024 ** 2:.1f} MB")
+        sys.exit(0)
+
+    config = get_config()
+    db = config.get_mongo_db()
+    loader = MongoLoader(db=db, batch_size=args.load_batch_size, max_workers=args.load_workers, raw_credits=args.raw_credits, read_models=not args.skip_read_models)
+    report = RunReplay(loader=loader, landing=landing, years=years, batch_size=args.batch_size).run()
+    logger.info(f"Total {sum(report.values())} movies replayed: {report}")
+    IndexManager(db).ensure_indexes()
+
+    prom_path, json_path = get_metrics().write("replay")
+    logger.info(f"Metrics of the run written to {prom_path} and {json_path}")
@@ -0,0 +1,35 @@
+"""
+This file contains the functionality to normalize the raw credits loaded into the people collection
+before the people normalization existed, into one document per person in the persons collection.
+"""
+
+import os
+import sys
+import argparse
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+from content_data import get_config, Logger, PeopleNormalizer, IndexManager, get_metrics
+
+logger = Logger("normalize_people").get_logger()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Normalize the raw credits of the people collection into the persons collection.")
+    parser.add_argument("--source", default="people", help="collection holding the raw credits of every movie")
+    parser.add_argument("--batch-size", type=int, default=500, help="number of movies normalized per batch")
+    parser.add_argument("--drop-source", action="store_true", help="drop the raw credits once they are normalized")
+    args = parser.parse_args()
+
+    config = get_config()
+    db = config.get_mongo_db()
+    movies = PeopleNormalizer(db=db).backfill(source=args.source, batch_size=args.batch_size)
+    logger.info(f"Normalized the credits of {movies} movies into {db['persons'].count_documents({})} persons.")
+    IndexManager(db).ensure_indexes(["persons"])
+    if args.drop_source:
+        db.drop_collection(args.source)
+        logger.info(f"Dropped the raw credits of {args.source}.")
+
+    prom_path, json_path = get_metrics().write("normalize_people")
+    logger.info(f"Metrics of the run written to {prom_path} and {json_path}")
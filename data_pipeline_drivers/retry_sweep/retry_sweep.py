@@ -0,0 +1,53 @@
+"""
+This file contains the functionality to re-drive the pages and movies recorded in the dead-letter store,
+once the main runs have finished, at a lower concurrency and rate than the main runs.
+"""
+
+import os
+import sys
+import argparse
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+from content_data import get_config, configure_rate_limiter, Logger, MongoLoader, ProgressStore, DeadLetterStore, RunRetrySweep, get_metrics
+
+logger = Logger("retry_sweep").get_logger()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-drive the failed pages and movies of the dead-letter store.")
+    parser.add_argument("--kinds", nargs="+", choices=["page", "movie"], default=["page", "movie"], help="kinds of dead letters to re-drive")
+    parser.add_argument("--year", type=int, help="only the dead letters of this year, all of them by default")
+    parser.add_argument("--batch-size", type=int, default=500, help="number of pages or movies re-driven at once")
+    parser.add_argument("--concurrency", type=int, default=3, help="requests in flight")
+    parser.add_argument("--adaptive", action="store_true", help="adapt the requests in flight (up to --concurrency) to the latency and errors of TMDB")
+    parser.add_argument("--rate-limit", type=float, help="requests per second sent to TMDB, defaults to TMDB_RATE_LIMIT")
+    parser.add_argument("--rate-burst", type=int, help="requests sent to TMDB at once after an idle period")
+    parser.add_argument("--max-attempts", type=int, default=5, help="leave out the dead letters which failed this many times")
+    parser.add_argument("--load-batch-size", type=int, default=1000, help="number of documents per bulk write")
+    parser.add_argument("--list", action="store_true", help="only list the number of dead letters of every kind")
+    args = parser.parse_args()
+
+    dead_letters = DeadLetterStore()
+    if args.list:
+        logger.info(f"Dead letters: {dead_letters.get_counts()}")
+        sys.exit(0)
+
+    config = get_config()
+    if args.rate_limit is not None:
+        configure_rate_limiter(rate=args.rate_limit, burst=args.rate_burst or max(int(args.rate_limit), 1))
+    controller = None
+    if args.adaptive:
+        config.tmdb_adaptive_concurrency = True
+        config.tmdb_max_concurrency = args.concurrency
+        config.tmdb_min_concurrency = min(config.tmdb_min_concurrency, args.concurrency)
+        controller = config.get_concurrency_controller("retry_sweep", initial=args.concurrency)
+
+    loader = MongoLoader(db=config.get_mongo_db(), batch_size=args.load_batch_size)
+    sweep = RunRetrySweep(loader=loader, dead_letters=dead_letters, progress_store=ProgressStore(), year=args.year, kinds=args.kinds, batch_size=args.batch_size, max_concurrency=args.concurrency, controller=controller, max_attempts=args.max_attempts)
+    report = sweep.run()
+    logger.info(f"Retry sweep done: {report}, still failing: {dead_letters.get_counts()}")
+
+    prom_path, json_path = get_metrics().write("retry_sweep")
+    logger.info(f"Metrics of the run written to {prom_path} and {json_path}")
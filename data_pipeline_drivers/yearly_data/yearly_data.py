@@ -1,35 +1,41 @@
 """
-This file contains the functionality to fetch and load yearly data from TMDB.
+This file contains the functionality to fetch and load yearly data from TMDB, for one year or a range of years.
+
+Every year goes through the selected stages:
+    - `ids`: the ids of the movies released in the year, checkpointed page by page,
+    - `details`: the details, credits, images and videos of every movie,
+    - `load`: the bulk loads into MongoDB, checkpointed batch by batch.
+
+Without `--start-year` the year is read from `fetch_year.json`, which is moved one year back after every year loaded,
+hence the daily schedule keeps walking backwards. Nothing is connected or read before the command line is parsed.
+
+The pages and movies which fail are recorded in the dead-letter store, `--retry-sweep` re-drives them
+once all the years are done, at its own (lower) concurrency and rate.
+
+With `--land` the raw movies are also appended to the landing zone, from which `landing/replay.py`
+loads them again without calling TMDB.
+
+With `--profile` every stage is timed (and with `--profile-mode`/`--trace-memory` profiled),
+the report is written next to the logs in `tmdb_logs/profile_yearly_data_<time>.txt`.
 """
 
 import os
 import sys
-import asyncio
 import json
+import asyncio
+import argparse
+from typing import Any, Dict, List, Optional
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
 if project_root not in sys.path:
     sys.path.append(project_root)
 
-from content_data import Config, Logger, RunMovieDetails, RunFetchIDs
+from content_data import get_config, configure_rate_limiter, Logger, RunMovieDetails, RunFetchIDs, RunRetrySweep, ProgressStore, DeadLetterStore, LandingZone, project_movie, MongoLoader, IndexManager, IDSet, get_metrics, get_profiler, configure_profiler
 
-config = Config()
-db = config.get_mongo_db()
 logger = Logger("all_movie_details").get_logger()
-movie_collection = db['movies']
-image_collection = db['images']
-video_collection = db['videos']
-people_collection = db['people']
-
-
-def get_ids(year, type:str="movies"):
-    obj = RunFetchIDs(year=year, type=type)
-    ids = obj.fetch_yearly_data()
-    return ids
+COLLECTIONS = ["movies", "images", "videos", "people"]
+STAGES = ["ids", "details", "load"]
+YEAR_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fetch_year.json")
 
-def get_movie_details(movie_ids):
-    obj = RunMovieDetails(movie_ids=movie_ids)
-    movies = asyncio.run(obj.main())
-    return movies
 
 def format_movie_data(movies):
     details = []
@@ -46,95 +52,347 @@ def format_movie_data(movies):
             print(index)
     return details, credits, images, videos
 
-def load_details(details, year):
-    filtered_docs = []
-    allowed_keys = [
-        'id', 'title', 'adult', 'backdrop_path', 'poster_path',
-        'release_date', 'release_year', 'overview', 'tagline',
-        'runtime', 'genres', 'cast', 'director', 'production_companies',
-        'popularity', 'vote_average', 'vote_count', 'status',
-        'original_language', 'production_countries', 'budget', 'revenue', 'trailer'
-    ]
-
-    for detail in details:
-        detail['release_year'] = year
-
-        # Fetch full video doc for this movie
-        video_doc = video_collection.find_one({"id": detail["id"]})
-
-        trailer = None
-        if video_doc and "results" in video_doc:
-            # Search manually for the trailer inside results
-            for v in video_doc["results"]:
-                if v.get("type") == "Trailer":
-                    trailer = v
-                    break
-
-        # Filter fields from details
-        filtered_doc = {k: detail.get(k) for k in allowed_keys if k in detail}
-        filtered_doc["trailer"] = trailer
-        filtered_docs.append(filtered_doc)
-
-    if filtered_docs:
-        movie_collection.insert_many(filtered_docs)
-
-    return
-
-def load_images(images):
-    fixed_docs = []
-    for index, doc in enumerate(images):
+
+class YearlyBackfill:
+    """
+    This class runs the selected stages of the yearly pipeline for one year after another.
+    It sets configurations as follows:
+
+        - `self.store`: `ProgressStore` the ids and the loads are checkpointed in.
+        - `self.loader`: `MongoLoader` of the `load` stage, `None` when the stage is not selected.
+        - `self.stages`: Stages to run, see `STAGES`.
+        - `self.stream`: Whether the movies are loaded in batches while they are being fetched.
+        - `self.batch_size`: Number of movies per batch in streaming mode.
+        - `self.concurrency`: Requests in flight, the upper bound of the adaptive controllers when they are enabled.
+        - `self.refetch_loaded`: Whether the movies already in the `movies` collection are fetched again.
+        - `self.dead_letters`: Optional `DeadLetterStore` the failed pages and movies are recorded in.
+        - `self.landing`: Optional `LandingZone` the raw movies are appended to before they are projected and loaded.
+
+    #### Notes:
+        - Without the `ids` stage the ids are taken from the discover pages checkpointed by earlier runs.
+        - Without the `load` stage the details are only fetched, e.g. to warm the response cache (`TMDB_CACHE_DIR`)
+        or to land them for a later replay.
+
+    #### Example Usage:
+
+        >>> backfill = YearlyBackfill(store=ProgressStore(), loader=MongoLoader(db=db), stream=True)
+        >>> backfill.run_year(2024)
+        {'year': 2024, 'ids': 9135, 'fetched': 9135, 'loaded': 9135}
+    """
+    def __init__(self, store: ProgressStore, loader: Optional[MongoLoader], stages: List[str] = STAGES, stream: bool = False, batch_size: int = 500, concurrency: int = 10, refetch_loaded: bool = False, dead_letters: DeadLetterStore = None, landing: LandingZone = None) -> None:
+        self.config = get_config()
+        self.store = store
+        self.loader = loader
+        self.stages = stages
+        self.stream = stream
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.refetch_loaded = refetch_loaded
+        self.dead_letters = dead_letters
+        self.landing = landing
+
+    def get_ids(self, year: int, type: str = "movies") -> IDSet:
+        if "ids" not in self.stages:
+            ids = IDSet(movie_id for page_ids in self.store.get_completed_pages(year, type).values() for movie_id in page_ids)
+            logger.info(f"Total {len(ids)} ids of year {year} read from the checkpoints.")
+            return ids
+        obj = RunFetchIDs(year=year, type=type, max_concurrency=self.concurrency, progress_store=self.store, controller=self.config.get_concurrency_controller("ids", initial=self.concurrency), dead_letters=self.dead_letters)
+        ids = obj.fetch_yearly_data()
+        logger.info(f"Total {len(ids)} ids fetched successfully.")
+        return ids
+
+    def get_pending_ids(self, ids: IDSet, year: int) -> IDSet:
+        """
+        Get the ids whose movies are still to be fetched and loaded.
+        """
+        # skip the movies which were loaded into every collection on earlier runs of the year
+        completed = self.store.get_completed_movie_ids(year, COLLECTIONS)
+        if completed:
+            ids = ids.difference(completed)
+            logger.info(f"Skipping {len(completed)} movies loaded on earlier runs, {len(ids)} movies left.")
+
+        # skip the movies which are already in MongoDB, e.g. loaded by the delta sync or before the progress store existed.
+        # The movies an earlier run of the year started are left out of the diff, their `movies` document may be
+        # written while another collection is not (e.g. a crash in between), hence they are resumed from the checkpoints.
+        if self.loader is not None and not self.refetch_loaded:
+            started = self.store.get_started_movie_ids(year)
+            untouched = ids.difference(started) if started else ids
+            existing = self.loader.get_existing_ids(untouched)
+            if existing:
+                ids = ids.difference(existing)
+                logger.info(f"Skipping {len(existing)} movies already in movies, {len(ids)} movies left.")
+        return ids
+
+    def get_movie_details(self, movie_ids, year=None):
+        obj = RunMovieDetails(movie_ids=movie_ids, max_concurrency=self.concurrency, controller=self.config.get_concurrency_controller("movie_details", initial=self.concurrency), dead_letters=self.dead_letters, year=year, project=self.landing is None)
+        return asyncio.run(obj.main())
+
+    def land(self, movies, year):
+        """
+        Append the raw movies to the landing zone, and project them for the loads.
+        """
+        if self.landing is None:
+            return movies
+        self.landing.write(movies, year)
+        return [project_movie(movie) for movie in movies]
+
+    def _land_timed(self, movies, year):
+        with get_profiler().timed("landing"):
+            return self.land(movies, year)
+
+    def load_checkpointed(self, year, collection, load, docs, *args):
+        """
+        Load only the docs which were not loaded into the collection on earlier runs, and checkpoint them.
+        """
+        docs = [doc for doc in docs if doc]
+        loaded = self.store.get_loaded_ids(year, collection, [doc.get("id") for doc in docs])
+        docs = [doc for doc in docs if doc.get("id") not in loaded]
+        load(docs, *args)
+        self.store.mark_loaded(year, collection, [doc["id"] for doc in docs])
+
+    def load_batch(self, movies, year):
+        profiler = get_profiler()
+        self.store.mark_movies_fetched(year, [movie["id"] for movie in movies])
+        with profiler.timed("format_movie_data"):
+            details, credits, images, videos = format_movie_data(movies)
+        with profiler.timed("mongo_load"):
+            self.load_checkpointed(year, "movies", self.loader.load_details, details, year, videos)
+            self.load_checkpointed(year, "images", self.loader.load_images, images)
+            self.load_checkpointed(year, "videos", self.loader.load_videos, videos)
+            self.load_checkpointed(year, "people", self.loader.load_credits, credits)
+
+    async def load_checkpointed_async(self, year, collection, load, docs, *args):
+        # the checkpoints are SQLite calls, they run in worker threads to not hold up the fetchers sharing the loop
+        docs = [doc for doc in docs if doc]
+        loaded = await asyncio.to_thread(self.store.get_loaded_ids, year, collection, [doc.get("id") for doc in docs])
+        docs = [doc for doc in docs if doc.get("id") not in loaded]
+        await load(docs, *args)
+        await asyncio.to_thread(self.store.mark_loaded, year, collection, [doc["id"] for doc in docs])
+
+    async def load_batch_async(self, movies, year):
+        profiler = get_profiler()
+        await asyncio.to_thread(self.store.mark_movies_fetched, year, [movie["id"] for movie in movies])
+        with profiler.timed("format_movie_data"):
+            details, credits, images, videos = format_movie_data(movies)
+        with profiler.timed("mongo_load"):
+            await asyncio.gather(
+                self.load_checkpointed_async(year, "movies", self.loader.load_details_async, details, year, videos),
+                self.load_checkpointed_async(year, "images", self.loader.load_images_async, images),
+                self.load_checkpointed_async(year, "videos", self.loader.load_videos_async, videos),
+                self.load_checkpointed_async(year, "people", self.loader.load_credits_async, credits),
+            )
+
+    async def stream_movie_details(self, movie_ids, year):
+        """
+        Fetch the movie details and load them in batches of `batch_size` while the fetching continues.
+        The fetched movies wait on a queue of `batch_size`, and only one batch is written at a time,
+        hence the memory depends on the batch size rather than the number of movies.
+        The batches are written through the async (motor) database when motor is installed,
+        else in a worker thread.
+        """
         try:
-            transformed = {k: v for k, v in doc.items() if k != "id"}
+            self.loader.async_db = self.config.get_async_mongo_db()
+            load = self.load_batch_async
+        except ImportError:
+            logger.warning("motor is not installed, the batches will be written from a worker thread.")
+            load = lambda batch, year: asyncio.to_thread(self.load_batch, batch, year)
 
-            transformed["movie_id"] = doc["id"]
+        queue = asyncio.Queue(maxsize=self.batch_size)
+        obj = RunMovieDetails(movie_ids=movie_ids, max_concurrency=self.concurrency, controller=self.config.get_concurrency_controller("movie_details", initial=self.concurrency), dead_letters=self.dead_letters, year=year, project=self.landing is None)
+        producer = asyncio.create_task(obj.stream_movies(queue))
 
-            fixed_docs.append(transformed)
-        except:
-            print(index)
+        batch = []
+        loaded = 0
+        flush = None
+        while True:
+            movie = await queue.get()
+            if movie is not RunMovieDetails.END_OF_STREAM:
+                batch.append(movie)
+            if len(batch) >= self.batch_size or (movie is RunMovieDetails.END_OF_STREAM and batch):
+                if flush:
+                    await flush
+                if self.landing is not None:
+                    batch = await asyncio.to_thread(self._land_timed, batch, year)
+                flush = asyncio.create_task(load(batch, year))
+                loaded += len(batch)
+                logger.info(f"Flushing batch of {len(batch)} movies, {loaded} movies so far.")
+                batch = []
+            if movie is RunMovieDetails.END_OF_STREAM:
+                break
+
+        if flush:
+            await flush
+        await producer
+        return loaded
+
+    def run_year(self, year: int) -> Dict[str, Any]:
+        """
+        Run the selected stages for a year.
+
+        Returns:
+            Dict[str, Any]: Number of ids found, of movies fetched and of movies loaded.
+        """
+        logger.info(f"Fetching for year: {year}")
+        profiler = get_profiler()
+        with profiler.stage("discovery"):
+            ids = self.get_ids(year)
+        report = {"year": year, "ids": len(ids), "fetched": 0, "loaded": 0}
+        if "details" not in self.stages:
+            return report
+
+        with profiler.stage("skip_loaded"):
+            ids = self.get_pending_ids(ids, year)
 
-    # Insert into MongoDB
-    if fixed_docs:
-        image_collection.insert_many(fixed_docs)
-    return
+        if self.stream and self.loader is not None:
+            # the stages overlap when streaming, their own times are in the steps of the report
+            with profiler.stage("details_and_load"):
+                report["fetched"] = report["loaded"] = asyncio.run(self.stream_movie_details(ids, year))
+            logger.info(f"Total {report['loaded']} movies fetched and loaded successfully.")
+            return report
 
-def load_videos(videos):
-    video_collection.insert_many(videos)
+        with profiler.stage("details"):
+            # the movies which could not be fetched are None, they are in the dead letters
+            movies = [movie for movie in self.get_movie_details(ids, year) if movie]
+        logger.info(f"Total {len(movies)} fetched successfully.")
+        with profiler.stage("landing"):
+            movies = self.land(movies, year)
+        self.store.mark_movies_fetched(year, [movie["id"] for movie in movies])
+        report["fetched"] = len(movies)
+        if self.loader is None:
+            return report
 
-def load_credits(credits):
-    people_collection.insert_many(credits)
+        with profiler.stage("format_movie_data"):
+            details, credits, images, videos = format_movie_data(movies)
+        logger.info(f"Details bifurcated successfully.")
+        with profiler.stage("mongo_load"):
+            self.load_checkpointed(year, "movies", self.loader.load_details, details, year, videos)
+            logger.info(f"Details loaded successfully.")
+            self.load_checkpointed(year, "images", self.loader.load_images, images)
+            logger.info(f"Images loaded successfully.")
+            self.load_checkpointed(year, "videos", self.loader.load_videos, videos)
+            logger.info(f"Videos loaded successfully.")
+            self.load_checkpointed(year, "people", self.loader.load_credits, credits)
+            logger.info(f"Credits loaded successfully.")
+        report["loaded"] = report["fetched"]
+        return report
 
 
-script_dir = os.path.dirname(os.path.abspath(__file__))
-json_path = os.path.join(script_dir, 'fetch_year.json')
-with open(json_path, mode='r', encoding='utf-8') as f:
-    file = json.load(f)
-    year = file["year"]
-    logger.info(f"Fetching for year: {year}")
+def get_years(start_year: int, end_year: Optional[int]) -> List[int]:
+    end_year = start_year if end_year is None else end_year
+    step = 1 if end_year >= start_year else -1
+    return list(range(start_year, end_year + step, step))
 
-ids = get_ids(year)
-logger.info(f"Total {len(ids)} ids fetched successfully.")
 
-movies = get_movie_details(ids)
-logger.info(f"Total {len(movies)} fetched successfully.")
+def read_year_file() -> int:
+    with open(YEAR_FILE, mode='r', encoding='utf-8') as f:
+        return json.load(f)["year"]
+
+
+def write_year_file(year: int) -> None:
+    with open(YEAR_FILE, mode='w', encoding='utf-8') as f:
+        json.dump({"year": year}, f)
+    logger.info(f"Updated {os.path.basename(YEAR_FILE)} with year: {year}")
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Fetch and load yearly data from TMDB, for one year or a range of years.")
+    parser.add_argument("--start-year", type=int, help="first year to backfill, defaults to the year of fetch_year.json")
+    parser.add_argument("--end-year", type=int, help="last year to backfill (inclusive, may be before --start-year), defaults to --start-year")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES, help="stages to run for every year, the load stage needs the details stage")
+    parser.add_argument("--stream", action="store_true", help="load the movies in batches while they are being fetched")
+    parser.add_argument("--batch-size", type=int, default=500, help="number of movies per batch in streaming mode")
+    parser.add_argument("--load-batch-size", type=int, default=1000, help="number of documents per bulk write")
+    parser.add_argument("--load-workers", type=int, default=4, help="number of bulk writes submitted in parallel")
+    parser.add_argument("--concurrency", type=int, help="requests in flight, the upper bound of the adaptive concurrency when it is enabled (TMDB_MAX_CONCURRENCY)")
+    parser.add_argument("--fixed-concurrency", action="store_true", help="keep --concurrency requests in flight instead of adapting them (TMDB_ADAPTIVE_CONCURRENCY=false)")
+    parser.add_argument("--rate-limit", type=float, help="requests per second sent to TMDB (TMDB_RATE_LIMIT)")
+    parser.add_argument("--rate-burst", type=int, help="requests sent to TMDB at once after an idle period (TMDB_RATE_BURST)")
+    parser.add_argument("--raw-credits", action="store_true", help="also load the raw credits of every movie into the people collection, besides the normalized persons")
+    parser.add_argument("--skip-read-models", action="store_true", help="don't refresh the top_movies and genre_movies read models while loading")
+    parser.add_argument("--refetch-loaded", action="store_true", help="also fetch the details of the movies already in the movies collection")
+    parser.add_argument("--land", action="store_true", help="also append the raw movies to the compressed landing zone, see landing/replay.py")
+    parser.add_argument("--land-compression", choices=["gzip", "zstd"], default="gzip", help="compression of the landing zone chunks, zstd needs `pip install zstandard`")
+    parser.add_argument("--land-chunk-size", type=int, default=10_000, help="number of movies per landing zone chunk")
+    parser.add_argument("--retry-sweep", action="store_true", help="re-drive the failed pages and movies of the dead-letter store once the years are done")
+    parser.add_argument("--retry-concurrency", type=int, default=3, help="requests in flight during the retry sweep")
+    parser.add_argument("--retry-rate-limit", type=float, help="requests per second sent to TMDB during the retry sweep, defaults to the rate of the run")
+    parser.add_argument("--profile", action="store_true", help="time every stage and write the report to tmdb_logs/profile_yearly_data_<time>.txt")
+    parser.add_argument("--profile-mode", choices=["cprofile", "sample"], help="also profile the functions of every stage with cProfile or a sampling profiler, implies --profile")
+    parser.add_argument("--trace-memory", action="store_true", help="also trace the peak memory and top allocation sites of every stage with tracemalloc, implies --profile")
+    parser.add_argument("--profile-top", type=int, default=15, help="number of functions and allocation sites reported per stage")
+    parser.add_argument("--profile-interval", type=float, default=0.005, help="seconds between two samples of the sampling profiler")
+    parser.add_argument("--keep-going", action="store_true", help="go on with the next year when a year fails, it is resumed from its checkpoints on the next run")
+    args = parser.parse_args(argv)
+    if "load" in args.stages and "details" not in args.stages:
+        parser.error("the load stage needs the details stage")
+    if args.retry_sweep and "load" not in args.stages:
+        parser.error("the retry sweep needs the load stage")
+
+    profiler = get_profiler()
+    if args.profile or args.profile_mode or args.trace_memory:
+        profiler = configure_profiler(name="yearly_data", mode=args.profile_mode, trace_memory=args.trace_memory, top=args.profile_top, interval=args.profile_interval)
+
+    config = get_config()
+    if args.rate_limit is not None or args.rate_burst is not None:
+        config.tmdb_rate_limit = args.rate_limit or config.tmdb_rate_limit
+        config.tmdb_rate_burst = args.rate_burst or max(int(config.tmdb_rate_limit), 1)
+        configure_rate_limiter(rate=config.tmdb_rate_limit, burst=config.tmdb_rate_burst)
+    if args.fixed_concurrency:
+        config.tmdb_adaptive_concurrency = False
+    if args.concurrency is not None:
+        config.tmdb_max_concurrency = args.concurrency
+        config.tmdb_min_concurrency = min(config.tmdb_min_concurrency, args.concurrency)
+    concurrency = args.concurrency or 10
+
+    from_file = args.start_year is None
+    years = get_years(read_year_file() if from_file else args.start_year, args.end_year)
+    logger.info(f"Backfilling the years {years[0]} to {years[-1]}, stages: {', '.join(args.stages)}")
+
+    loader = None
+    if "load" in args.stages:
+        loader = MongoLoader(db=config.get_mongo_db(), batch_size=args.load_batch_size, max_workers=args.load_workers, raw_credits=args.raw_credits, read_models=not args.skip_read_models)
+    store, dead_letters = ProgressStore(), DeadLetterStore()
+    landing = LandingZone(compression=args.land_compression, chunk_size=args.land_chunk_size) if args.land else None
+    backfill = YearlyBackfill(store=store, loader=loader, stages=args.stages, stream=args.stream, batch_size=args.batch_size, concurrency=concurrency, refetch_loaded=args.refetch_loaded, dead_letters=dead_letters, landing=landing)
+
+    failed = []
+    for year in years:
+        try:
+            report = backfill.run_year(year)
+        except Exception as e:
+            logger.exception(f"❌ Year {year} failed: {e}")
+            failed.append(year)
+            if not args.keep_going:
+                break
+            continue
+        logger.info(f"Year {year} done: {report}")
+        # the file only moves past the years loaded without a failure before them
+        if from_file and loader is not None and not failed:
+            write_year_file(min(year, years[0]) - 1)
 
+    if args.retry_sweep:
+        if args.retry_rate_limit is not None:
+            configure_rate_limiter(rate=args.retry_rate_limit, burst=max(int(args.retry_rate_limit), 1))
+        sweep = RunRetrySweep(loader=loader, dead_letters=dead_letters, progress_store=store, batch_size=args.batch_size, max_concurrency=args.retry_concurrency, landing=landing)
+        with profiler.stage("retry_sweep"):
+            report = sweep.run()
+        logger.info(f"Retry sweep done: {report}, still failing: {dead_letters.get_counts()}")
 
-details, credits, images, videos = format_movie_data(movies)
-logger.info(f"Details bifurcated successfully.")
-input("Please turn off VPN and hit enter!")
+    # the read indexes are only created once the years are loaded
+    if loader is not None:
+        with profiler.stage("indexes"):
+            IndexManager(loader.db).ensure_indexes()
 
-load_details(details, year)
-logger.info(f"Details loaded successfully.")
-load_images(images)
-logger.info(f"Images loaded successfully.")
-load_videos(videos)
-logger.info(f"Videos loaded successfully.")
-load_credits(credits)
-logger.info(f"Credits loaded successfully.")
+    prom_path, json_path = get_metrics().write("yearly_data")
+    logger.info(f"Metrics of the run written to {prom_path} and {json_path}")
+    if profiler.enabled:
+        text_path, _ = profiler.write()
+        logger.info(f"Profile of the run written to {text_path}")
+    if failed:
+        logger.error(f"❌ The years {', '.join(map(str, failed))} failed, rerun them to resume from their checkpoints.")
+        return 1
+    return 0
 
-with open(json_path, mode='w', encoding='utf-8') as f:
-    year_dict = {
-        "year":year-1
-    }
-    json.dump(year_dict, f)
-    print(f"Updated json with year: {year}")
 
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,76 @@
+"""
+Resume of a yearly backfill which crashed between the collections of a batch.
+Runs offline, against the in-memory stand-in of MongoDB and a temporary progress store.
+"""
+
+import os
+import sys
+
+import pytest
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(project_root, "data_pipeline_drivers", "yearly_data"))
+sys.path.insert(0, project_root)
+
+from content_data import IDSet, MongoLoader, ProgressStore
+from content_data.load_bulk_data.benchmark.memory_mongo import MemoryDatabase
+
+YEAR = 2024
+
+
+def get_movie(movie_id):
+    return {
+        "id": movie_id,
+        "details": {"id": movie_id, "title": f"Movie {movie_id}", "popularity": movie_id, "genres": []},
+        "credits": {"id": movie_id, "cast": [], "crew": []},
+        "images": {"id": movie_id, "backdrops": [], "posters": [], "logos": []},
+        "videos": {"id": movie_id, "results": []},
+    }
+
+
+@pytest.fixture
+def backfill(tmp_path, monkeypatch):
+    monkeypatch.setenv("TMDB_API_KEY", "test")
+    from yearly_data import YearlyBackfill
+    store = ProgressStore(path=str(tmp_path / "progress.sqlite3"))
+    loader = MongoLoader(db=MemoryDatabase(), read_models=False)
+    yield YearlyBackfill(store=store, loader=loader)
+    store.close()
+
+
+def test_crash_after_movies_write_is_resumed(backfill):
+    ids = IDSet([1, 2, 3])
+    backfill.load_batch([get_movie(1)], YEAR)
+
+    # the run crashes once the batch is in `movies`, before its images, videos and persons are written
+    def crash(*args):
+        raise RuntimeError("crash")
+    load_images = backfill.loader.load_images
+    backfill.loader.load_images = crash
+    with pytest.raises(RuntimeError):
+        backfill.load_batch([get_movie(2)], YEAR)
+    backfill.loader.load_images = load_images
+
+    # movie 3 was loaded by another pipeline, without any checkpoint of the year
+    backfill.loader.load_details([get_movie(3)["details"]], YEAR)
+
+    assert backfill.loader.db["movies"].find_one({"id": 2}) is not None
+    assert list(backfill.get_pending_ids(ids, YEAR)) == [2]
+
+    backfill.load_batch([get_movie(2)], YEAR)
+    assert backfill.loader.db["images"].find_one({"movie_id": 2}) is not None
+    assert list(backfill.get_pending_ids(ids, YEAR)) == []
+
+
+def test_crash_before_movies_checkpoint_is_resumed(backfill):
+    ids = IDSet([1])
+
+    # the movie document is written but the run crashes before any collection is checkpointed
+    def crash(*args):
+        raise RuntimeError("crash")
+    backfill.store.mark_loaded = crash
+    with pytest.raises(RuntimeError):
+        backfill.load_batch([get_movie(1)], YEAR)
+
+    assert backfill.loader.db["movies"].find_one({"id": 1}) is not None
+    assert list(backfill.get_pending_ids(ids, YEAR)) == [1]